@@ -0,0 +1,168 @@
+"""
+admission.py
+Admission control and load shedding for POST /task.
+
+At most `max_inflight` jobs run at once and at most `max_queued` wait for a
+slot. Waiting jobs are served by lane: retries of nonces we have already
+seen first, then round 2, then round 1. When the queue is full a new job
+either displaces the lowest-priority waiter or is shed with a Retry-After
+derived from how fast the queue has been draining.
+"""
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+
+LANE_RETRY = 0
+LANE_ROUND2 = 1
+LANE_ROUND1 = 2
+
+
+class AdmissionRejected(Exception):
+    """The job was shed; retry_after is the suggested wait in seconds."""
+
+    def __init__(self, retry_after: int, reason: str = 'Server busy'):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """An admitted job's slot; release it (or use it as a context manager) when done."""
+
+    def __init__(self, controller: 'AdmissionController', lane: int, seq: int):
+        self.controller = controller
+        self.lane = lane
+        self.seq = seq
+        self.admitted = False
+        self.evicted = False
+        self.released = False
+
+    def __lt__(self, other):
+        return (self.lane, self.seq) < (other.lane, other.seq)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """Bounded in-flight + queued job counts with priority lanes."""
+
+    def __init__(self, max_inflight: int = 4, max_queued: int = 16, max_wait: Optional[float] = 120.0,
+                 default_job_seconds: float = 120.0, window: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.default_job_seconds = default_job_seconds
+        self.window = window
+        self.clock = clock
+        self.inflight = 0
+        self._queue = []
+        self._seq = itertools.count()
+        self._completions = deque()
+        self._nonces = OrderedDict()
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_env(cls) -> 'AdmissionController':
+        max_wait = float(os.getenv('ADMISSION_MAX_WAIT', '120'))
+        return cls(max_inflight=int(os.getenv('MAX_INFLIGHT_TASKS', '4')),
+                   max_queued=int(os.getenv('MAX_QUEUED_TASKS', '16')),
+                   max_wait=max_wait if max_wait > 0 else None,
+                   default_job_seconds=float(os.getenv('ADMISSION_DEFAULT_JOB_SECONDS', '120')))
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def lane_for(self, round_num, nonce: Optional[str] = None) -> int:
+        """Pick a lane and remember the nonce so a retry of it jumps the queue."""
+        with self._cond:
+            if nonce and nonce in self._nonces:
+                self._nonces.move_to_end(nonce)
+                return LANE_RETRY
+            if nonce:
+                self._nonces[nonce] = True
+                while len(self._nonces) > 10000:
+                    self._nonces.popitem(last=False)
+        try:
+            return LANE_ROUND2 if int(round_num) >= 2 else LANE_ROUND1
+        except (TypeError, ValueError):
+            return LANE_ROUND1
+
+    def drain_rate(self) -> float:
+        """Completed jobs per second over the recent window (or a capacity estimate)."""
+        now = self.clock()
+        while self._completions and now - self._completions[0] > self.window:
+            self._completions.popleft()
+        if len(self._completions) >= 2:
+            span = max(now - self._completions[0], 1.0)
+            return len(self._completions) / span
+        return self.max_inflight / self.default_job_seconds
+
+    def retry_after(self, position: Optional[int] = None) -> int:
+        position = self.queued + 1 if position is None else position
+        return max(1, min(3600, math.ceil(position / self.drain_rate())))
+
+    def admit(self, lane: int = LANE_ROUND1) -> Ticket:
+        """Wait for a slot in the given lane; raise AdmissionRejected if shed."""
+        with self._cond:
+            ticket = Ticket(self, lane, next(self._seq))
+            if self.inflight < self.max_inflight and not self._queue:
+                self.inflight += 1
+                ticket.admitted = True
+                return ticket
+            if len(self._queue) >= self.max_queued:
+                worst = max(self._queue) if self._queue else None
+                if worst is None or ticket.lane >= worst.lane:
+                    raise AdmissionRejected(self.retry_after())
+                # Displace the lowest-priority waiter in favour of this job.
+                self._queue.remove(worst)
+                heapq.heapify(self._queue)
+                worst.evicted = True
+            heapq.heappush(self._queue, ticket)
+            self._cond.notify_all()
+            deadline = None if self.max_wait is None else self.clock() + self.max_wait
+            try:
+                while True:
+                    if ticket.evicted:
+                        raise AdmissionRejected(self.retry_after(), 'Displaced by higher-priority work')
+                    if self._queue and self._queue[0] is ticket and self.inflight < self.max_inflight:
+                        heapq.heappop(self._queue)
+                        self.inflight += 1
+                        ticket.admitted = True
+                        return ticket
+                    remaining = None if deadline is None else deadline - self.clock()
+                    if remaining is not None and remaining <= 0:
+                        raise AdmissionRejected(self.retry_after(), 'Timed out waiting for a slot')
+                    self._cond.wait(remaining)
+            finally:
+                if not ticket.admitted and ticket in self._queue:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+    def _release(self, ticket: Ticket):
+        with self._cond:
+            if ticket.admitted:
+                self.inflight -= 1
+                self._completions.append(self.clock())
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'inflight': self.inflight, 'queued': self.queued,
+                    'max_inflight': self.max_inflight, 'max_queued': self.max_queued,
+                    'drain_rate': round(self.drain_rate(), 4)}
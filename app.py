@@ -1,297 +1,214 @@
 
 import os
-from flask import Flask, request, jsonify
+from pathlib import Path
+from flask import Flask, request, jsonify, send_file, abort
 from dotenv import load_dotenv
 import json
-import google.generativeai as genai
+import shutil
+import threading
+import uuid
 from main import *  # Import all helper functions
+from admission import AdmissionController, AdmissionRejected
+from imaging import ImagePipeline, VARIANTS
+from similarity import SimilarityIndex
+from profiling import JobProfiler, choose_mode, is_admin, list_profiles
+from prompts import HOSTED_IMAGES_HEADER, attachment_descriptors
+from registry import JobRegistry
+from ingest import BodyTooLarge, IngestError, ingest_json, move_spool, safe_filename, summarize
+from checkpoint import Checkpoint, job_key
+from dag import StageFailed
+from leasing import JobQueue, LeaseLost, run_reaper
+from pipeline import GITHUB_USERNAME, RepoSetupError, run_task
+from resilience import DeadlineExceeded, CircuitOpen
 
 load_dotenv()
 SECRET_KEY = os.getenv('secretkey')
+DATA_DIR = Path(os.getenv('DATA_DIR', 'data')).resolve()
+IMAGES = ImagePipeline(DATA_DIR / '_images')
+ADMISSION = AdmissionController.from_env()
+PROFILE_DIR = DATA_DIR / '_profiles'
+SIMILARITY = SimilarityIndex(DATA_DIR / '_similarity')
+JOBS = JobQueue(DATA_DIR / '_jobs')
+REGISTRY = JobRegistry(DATA_DIR / '_registry')
 
 app = Flask(__name__)
 
+
+def task_dir(task_name):
+    return DATA_DIR / safe_filename(task_name, 'default-task')
+
+
+def job_dir(data):
+    """Per-job directory (work dir, checkpoint, attachments), keyed like the job lease."""
+    return task_dir(data.get('task', 'default-task')) / safe_filename(job_key(data), 'job')
+
+
+def save_payload(task_name, public):
+    """Latest accepted request for a task (no secret), written atomically."""
+    path = task_dir(task_name) / 'payload.json'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'payload.json.{uuid.uuid4().hex}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(public, f, indent=2)
+    os.replace(tmp, path)
+
+
+def run_job(job, record=None, lease=None):
+    """Run (or resume) a leased job in its own worker directory.
+
+    Between stages the job stops if its lease was lost, since another worker
+    has reclaimed it by then.
+    """
+    data, brief = job['data'], job['brief']
+    base = job_dir(data)
+    worker_dir = base / 'work'
+    worker_dir.mkdir(parents=True, exist_ok=True)
+    checkpoint = Checkpoint.open(base / 'checkpoint.json', job_key(data))
+
+    def progress(stage):
+        if lease is not None and lease.lost:
+            raise LeaseLost(f'Lease on {lease.job_id} lost, not starting {stage}')
+        if record is not None:
+            REGISTRY.advance(record, stage)
+
+    done = (lambda stage: REGISTRY.stage_done(record, stage)) if record is not None else None
+    return run_task(data, brief, str(worker_dir), index=SIMILARITY, checkpoint=checkpoint,
+                    progress=progress, done=done)
+
+
+def store_attachments(attachments, base_url):
+    """Store image attachments and return their light-variant URLs by name."""
+    stored = {}
+    for attachment in attachments or []:
+        name = attachment.get('name', 'attachment')
+        digest = None
+        try:
+            if 'path' in attachment:
+                if not attachment.get('mime', '').startswith('image/'):
+                    continue
+                digest = IMAGES.ingest_file(attachment['path'])
+            else:
+                digest = IMAGES.ingest_data_uri(attachment.get('url', ''))
+            if not digest:
+                continue
+            info = IMAGES.info(digest)
+        except Exception as e:
+            print(f'Error storing attachment {name}: {e}')
+            if digest:
+                IMAGES.discard(digest)
+            continue
+        stored[name] = {
+            'width': info['width'],
+            'height': info['height'],
+            'original': f'{base_url}assets/{digest}/original',
+            **{variant: f'{base_url}assets/{digest}/{variant}' for variant in VARIANTS},
+        }
+        print(f'Stored attachment {name} as {digest}')
+    return stored
+
+
+def describe_attachments(stored):
+    """Prompt snippet pointing generated pages at the lightweight variants."""
+    if not stored:
+        return ''
+    lines = ['', HOSTED_IMAGES_HEADER]
+    for name, urls in stored.items():
+        lines.append(f"- {name} ({urls['width']}x{urls['height']}): display {urls['webp']}, "
+                     f"preview {urls['thumb']}, grayscale for OCR {urls['gray']}")
+    return '\n'.join(lines)
+
 @app.route('/task', methods=['POST'])
 def handle_task():
-    data = request.get_json(silent=True)
-    print('Received JSON at /task:', data)
+    # Attachments are decoded straight to disk while the body streams in.
+    spool_dir = str(DATA_DIR / '_spool' / uuid.uuid4().hex)
+    try:
+        data = ingest_json(request.stream, spool_dir)
+    except BodyTooLarge as e:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        return jsonify({'error': str(e)}), 413
+    except IngestError as e:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        print(f'Invalid JSON at /task: {e}')
+        return jsonify({'error': 'Invalid JSON'}), 400
+    print('Received JSON at /task:', summarize(data))
     if not data:
+        shutil.rmtree(spool_dir, ignore_errors=True)
         return jsonify({'error': 'Invalid JSON'}), 400
     if 'secret' in data and data['secret'] == SECRET_KEY:
-        print('Secret verified, saving JSON...')
-        with open('receivedjson.json', 'w') as f:
-            json.dump(data, f, indent=2)
-        print('JSON saved. Asking AI agent to generate files...')
+        print('Secret verified')
+        public = {k: v for k, v in data.items() if k != 'secret'}
+        round_num = data.get('round', 1)
+        task_name = data.get('task', 'default-task')
+        print(f'Round: {round_num}, Task: {task_name}')
         try:
-            # Import required modules at the beginning
-            import re
-            from pydantic import BaseModel, Field
-            import requests
-            import base64
-            import shutil
-            
-            # Check round parameter for repo logic
-            round_num = data.get('round', 1)
-            task_name = data.get('task', 'default-task')
-            print(f'Round: {round_num}, Task: {task_name}')
-            
-            # Setup worker directory and handle repo creation/update based on round
-            worker_dir = os.path.abspath(os.path.join(os.getcwd(), '../theworker'))
-            os.makedirs(worker_dir, exist_ok=True)
-            
-            github_token = os.getenv('GITHUB_TOKEN')
-            github_username = 'samarthnaikk'  # constant username
-            
-            if round_num == 1:
-                print('Round 1: Creating new repository...')
-                # Delete existing .git if it exists
-                git_dir = os.path.join(worker_dir, '.git')
-                if os.path.exists(git_dir):
-                    shutil.rmtree(git_dir)
-                    print('Deleted existing .git directory')
-                
-                # Create new GitHub repository using GitHub API
-                repo_create_url = 'https://api.github.com/user/repos'
-                headers = {
-                    'Authorization': f'token {github_token}',
-                    'Accept': 'application/vnd.github.v3+json'
-                }
-                repo_data = {
-                    'name': task_name,
-                    'description': f'Generated project: {task_name}',
-                    'public': True,
-                    'auto_init': False
-                }
-                repo_resp = requests.post(repo_create_url, headers=headers, json=repo_data)
-                print(f'GitHub repo creation response: {repo_resp.status_code} {repo_resp.text}')
-                
-                if repo_resp.status_code == 201:
-                    repo_full_name = f'{github_username}/{task_name}'
-                    print(f'Successfully created repository: {repo_full_name}')
-                else:
-                    repo_full_name = f'{github_username}/{task_name}'
-                    print(f'Repository creation failed. Status: {repo_resp.status_code}')
-                    if repo_resp.status_code == 403:
-                        print('ERROR: GitHub token lacks repository creation permissions.')
-                        print('Please ensure your token has "repo" scope and create the repository manually:')
-                        print(f'1. Go to https://github.com/new')
-                        print(f'2. Create a public repository named: {task_name}')
-                        print(f'3. Enable GitHub Pages in repository settings')
-                        print(f'Or update your token with "repo" scope at: https://github.com/settings/tokens')
-                        return jsonify({'error': 'Repository creation failed - insufficient token permissions', 
-                                      'action_required': f'Create repository manually: {repo_full_name}'}), 403
-                    elif repo_resp.status_code == 422:
-                        print(f'Repository {repo_full_name} already exists, proceeding with updates...')
-                    else:
-                        print(f'Unexpected error creating repository: {repo_resp.text}')
-                        return jsonify({'error': 'Repository creation failed', 'details': repo_resp.text}), 500
-            else:
-                print('Round 2: Updating existing repository...')
-                repo_full_name = data.get('repo_full_name', f'{github_username}/{task_name}')
-                print(f'Using existing repository: {repo_full_name}')
-            
-            api_key = os.getenv('GEMINI_API_KEY')
-            brief = data.get('brief', '')
-            print(f'Calling Gemini API with google-generativeai, brief: {brief}')
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            response = model.generate_content(brief)
-            print(f'Gemini API response: {response.text}')
-            # Use Pydantic to parse markdown/code block for file content
-
-            class GeminiFile(BaseModel):
-                filename: str = Field(...)
-                content: str = Field(...)
-
-            # Use the determined repo_full_name for file operations
-            checks = data.get('checks', [])
-            created_files = set()
-            # Try to create files mentioned in checks
-            for check in checks:
-                print(f'Processing check: {check}')
-                
-                # Enhanced file detection - look for common file patterns or treat check as filename
-                filename = None
-                
-                # Try to match common file patterns first
-                file_patterns = {
-                    r'index\.html': 'index.html',
-                    r'README\.md': 'README.md', 
-                    r'LICENSE': 'LICENSE',
-                    r'style\.css': 'style.css',
-                    r'script\.js': 'script.js',
-                    r'main\.js': 'main.js',
-                    r'app\.js': 'app.js',
-                    r'package\.json': 'package.json'
-                }
-                
-                for pattern, file_name in file_patterns.items():
-                    if re.search(pattern, check, re.IGNORECASE):
-                        filename = file_name
-                        break
-                
-                # If no pattern matched, try to extract filename from the check string
-                if not filename:
-                    # Look for file extensions
-                    ext_match = re.search(r'(\w+\.(html|css|js|md|json|txt|py))', check, re.IGNORECASE)
-                    if ext_match:
-                        filename = ext_match.group(1)
-                    else:
-                        # Default to treating the whole check as a filename requirement
-                        if '.' in check and len(check.split()) == 1:
-                            filename = check.strip()
-                        else:
-                            # Generate a relevant filename based on the check description
-                            print(f'No specific filename found in check: {check}, skipping...')
-                            continue
-                
-                if filename:
-                    print(f'Creating file: {filename} for check: {check}')
-                    
-                    # Special handling for README to make it professional
-                    if filename.lower() == 'readme.md':
-                        file_prompt = f"""Create a professional README.md file for this project with the following requirements:
-                        
-Project: {brief}
-
-Include these sections:
-1. Project title and brief description
-2. Features/Overview
-3. Installation instructions 
-4. Usage guide
-5. Technologies used
-6. Contributing guidelines
-7. License information
-
-Make it well-structured, professional, and include proper markdown formatting. Focus on clarity and completeness."""
-                    else:
-                        file_prompt = f"Generate professional, well-structured content for {filename} based on this project requirement: {brief}. Check requirement: {check}"
-                    
-                    file_response = model.generate_content(file_prompt)
-                    code_block_match = re.search(r'`{3}[a-zA-Z]*\n([\s\S]*?)`{3}', file_response.text)
-                    file_content = code_block_match.group(1).strip() if code_block_match else file_response.text
-                    file_path = os.path.join(worker_dir, filename)
-                    print(f'Creating file: {file_path}')
-                    with open(file_path, 'w') as f:
-                        f.write(file_content)
-                    print(f'File {file_path} created.')
-                    created_files.add(filename)
-                    # Add, commit, and push using GitHub API
-                    commit_message = f"Update {filename} via AI task"
-                    branch = 'main'
-                    with open(file_path, 'rb') as f:
-                        content_b64 = base64.b64encode(f.read()).decode('utf-8')
-                    file_url = f'https://api.github.com/repos/{repo_full_name}/contents/{filename}'
-                    headers = {
-                        'Authorization': f'token {github_token}',
-                        'Accept': 'application/vnd.github.v3+json'
-                    }
-                    data_payload = {
-                        'message': commit_message,
-                        'content': content_b64,
-                        'branch': branch
-                    }
-                    # Check if file exists to get sha
-                    sha = None
-                    sha_resp = requests.get(file_url, headers=headers)
-                    if sha_resp.status_code == 200:
-                        sha = sha_resp.json().get('sha')
-                        print(f'Existing file sha: {sha}')
-                    if sha:
-                        data_payload['sha'] = sha
-                    resp = requests.put(file_url, headers=headers, json=data_payload)
-                    print(f'GitHub API file update response: {resp.status_code} {resp.text}')
-            # Also create index.html if found in Gemini response and not already created
-            code_block_match = re.search(r'`{3}html\n([\s\S]*?)`{3}', response.text)
-            if code_block_match and 'index.html' not in created_files:
-                file_content = code_block_match.group(1).strip()
-                filename = 'index.html'
-                file_path = os.path.join(worker_dir, filename)
-                print(f'Creating file: {file_path}')
-                with open(file_path, 'w') as f:
-                    f.write(file_content)
-                print(f'File {file_path} created.')
-                # Add, commit, and push using GitHub API
-                commit_message = f"Update {filename} via AI task"
-                branch = 'main'
-                with open(file_path, 'rb') as f:
-                    content_b64 = base64.b64encode(f.read()).decode('utf-8')
-                file_url = f'https://api.github.com/repos/{repo_full_name}/contents/{filename}'
-                headers = {
-                    'Authorization': f'token {github_token}',
-                    'Accept': 'application/vnd.github.v3+json'
-                }
-                data_payload = {
-                    'message': commit_message,
-                    'content': content_b64,
-                    'branch': branch
-                }
-                # Check if file exists to get sha
-                sha = None
-                sha_resp = requests.get(file_url, headers=headers)
-                if sha_resp.status_code == 200:
-                    sha = sha_resp.json().get('sha')
-                    print(f'Existing file sha: {sha}')
-                if sha:
-                    data_payload['sha'] = sha
-                resp = requests.put(file_url, headers=headers, json=data_payload)
-                print(f'GitHub API file update response: {resp.status_code} {resp.text}')
-            else:
-                print('Gemini API did not return a code block. No file created.')
-        
-            # Enable GitHub Pages after files are pushed (if not already enabled)
-            try:
-                print('Checking/enabling GitHub Pages...')
-                pages_enable_url = f'https://api.github.com/repos/{repo_full_name}/pages'
-                headers = {
-                    'Authorization': f'token {github_token}',
-                    'Accept': 'application/vnd.github.v3+json'
-                }
-                
-                # Check if Pages is already enabled
-                pages_check_resp = requests.get(pages_enable_url, headers=headers)
-                
-                if pages_check_resp.status_code == 404:
-                    print('GitHub Pages not enabled, enabling now...')
-                    # Enable GitHub Pages
-                    pages_data = {
-                        'source': {
-                            'branch': 'main',
-                            'path': '/'
-                        }
-                    }
-                    pages_enable_resp = requests.post(pages_enable_url, headers=headers, json=pages_data)
-                    print(f'GitHub Pages enable response: {pages_enable_resp.status_code} {pages_enable_resp.text}')
-                else:
-                    print(f'GitHub Pages already enabled: {pages_check_resp.status_code}')
-                    
-            except Exception as e:
-                print(f'Error enabling GitHub Pages: {e}')
-        
-            # Trigger GitHub Pages build after all files are pushed
-            try:
-                pages_url = f'https://api.github.com/repos/{repo_full_name}/pages/builds'
-                headers = {
-                    'Authorization': f'token {github_token}',
-                    'Accept': 'application/vnd.github.v3+json'
-                }
-                pages_resp = requests.post(pages_url, headers=headers)
-                print(f'GitHub Pages build trigger response: {pages_resp.status_code} {pages_resp.text}')
-            except Exception as e:
-                print(f'Error triggering GitHub Pages build: {e}')
-                
+            ticket = ADMISSION.admit(ADMISSION.lane_for(round_num, data.get('nonce')))
+        except AdmissionRejected as e:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+            print(f'Shedding task {task_name}: {e} (retry after {e.retry_after}s)')
+            resp = jsonify({'error': str(e), 'retry_after': e.retry_after})
+            resp.headers['Retry-After'] = str(e.retry_after)
+            return resp, 429
+        profile_mode = choose_mode(request.headers)
+        profiler, profile_path = None, None
+        lease, record, outcome, error = None, None, 'failed', None
+        try:
+            # Inside the try, so a profiler that fails to start still releases the admission ticket.
+            profiler = JobProfiler(task_name, PROFILE_DIR, profile_mode).start() if profile_mode else None
+            attachment_urls = store_attachments(data.get('attachments', []), request.host_url)
+            brief = (data.get('brief', '') + describe_attachments(attachment_urls)
+                     + attachment_descriptors(data.get('attachments', []), skip=attachment_urls))
+            # Claimed by this worker; if it dies, another replica reclaims the job once the lease expires.
+            lease = JOBS.submit(job_dir(data).name, {'data': public, 'brief': brief})
+            if lease is None:
+                print(f'Task {task_name} is already running on another worker')
+                return jsonify({'status': 'in-progress', 'task': task_name, 'round': round_num}), 409
+            # Only the lease holder touches the job's files.
+            move_spool(public, spool_dir, str(job_dir(data) / 'attachments'))
+            JOBS.update(lease)
+            save_payload(task_name, public)
+            print('JSON saved. Asking AI agent to generate files...')
+            record = REGISTRY.start(task_name, data.get('nonce', ''), round_num)
+            with lease.keepalive():
+                repo_full_name, created_files, metrics = run_job(lease.job, record, lease)
+            outcome = 'OK'
+        except StageFailed as e:
+            error = f'{e.stage}: {e.error}'
+            if isinstance(e.error, LeaseLost):
+                print(f'Task {task_name} taken over by another worker: {e.error}')
+                return jsonify({'status': 'in-progress', 'task': task_name, 'round': round_num}), 409
+            if isinstance(e.error, RepoSetupError):
+                return jsonify(e.error.payload), e.error.status_code
+            if isinstance(e.error, DeadlineExceeded):
+                print(f'Task deadline exceeded: {e}')
+                return jsonify({'status': 'error', 'details': str(e.error)}), 504
+            if isinstance(e.error, CircuitOpen):
+                print(f'Dependency unavailable: {e}')
+                return jsonify({'status': 'error', 'details': str(e.error)}), 503
+            print(f'Error generating files: {e}')
+            return jsonify({'status': 'error', 'details': str(e.error)}), 500
         except Exception as e:
+            error = str(e)
             print(f'Error generating files: {e}')
             return jsonify({'status': 'error', 'details': str(e)}), 500
-        
+        finally:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+            if record is not None:
+                REGISTRY.finish(record, outcome, error)
+            if lease is not None:
+                # The caller gets the outcome either way, so failed jobs are not retried in the background.
+                JOBS.complete(lease, {'status': outcome})
+            if profiler:
+                profile_path = profiler.stop()
+            ticket.release()
+
         # Prepare response with repository links
         repo_url = f'https://github.com/{repo_full_name}'
-        pages_url = f'https://{github_username}.github.io/{task_name}'
-        
+        pages_url = f'https://{GITHUB_USERNAME}.github.io/{task_name}'
+
         print('All tasks completed.')
         print(f'Repository: {repo_url}')
         print(f'GitHub Pages: {pages_url}')
-        
+
         return jsonify({
             'status': 'OK',
             'repository': {
@@ -301,15 +218,87 @@ Make it well-structured, professional, and include proper markdown formatting. F
                 'pages_url': pages_url
             },
             'round': round_num,
-            'files_created': list(created_files)
+            'files_created': list(created_files),
+            'attachments': attachment_urls,
+            'metrics': metrics,
+            'profile': profile_path.name if profile_path else None
         }), 200
     else:
+        shutil.rmtree(spool_dir, ignore_errors=True)
         print('Unauthorized: secret mismatch.')
         return jsonify({'error': 'Unauthorized'}), 403
 
+@app.route('/assets/<digest>/<variant>')
+def serve_asset(digest, variant):
+    if variant != 'original' and variant not in VARIANTS:
+        abort(404)
+    try:
+        path = IMAGES.variant_path(digest, variant)
+        mimetype = IMAGES.mimetype(digest, variant)
+    except (ValueError, FileNotFoundError):
+        abort(404)
+    # Content-addressed, so a given URL never changes.
+    resp = send_file(path, mimetype=mimetype, etag=f'{digest}-{variant}', conditional=True, max_age=31536000)
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
+
+@app.route('/admission')
+def admission_stats():
+    return jsonify(ADMISSION.stats())
+
+@app.route('/admin/profiles')
+def admin_profiles():
+    if not is_admin(request.headers):
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({'profiles': list_profiles(PROFILE_DIR)})
+
+@app.route('/admin/profiles/<name>')
+def admin_profile_download(name):
+    if not is_admin(request.headers):
+        return jsonify({'error': 'Unauthorized'}), 403
+    path = PROFILE_DIR / safe_filename(name, '')
+    if path.suffix not in ('.prof', '.collapsed') or not path.is_file():
+        abort(404)
+    return send_file(path, as_attachment=True)
+
 @app.route('/')
 def health():
     return 'API is running!'
 
+@app.route('/jobs')
+def job_stats():
+    return jsonify({'worker': JOBS.worker_id, 'pending': JOBS.pending()})
+
+@app.route('/status')
+def status_overview():
+    return jsonify(REGISTRY.stats())
+
+@app.route('/status/<task>')
+def task_status(task):
+    status = REGISTRY.lookup(task)
+    if status is None:
+        return jsonify({'error': 'Unknown task'}), 404
+    return jsonify(status)
+
+def resume_job(lease):
+    """Finish a job reclaimed from a worker whose lease expired (crash, restart, lost replica)."""
+    print(f'Resuming job {lease.job_id}')
+    data = lease.job['data']
+    record = REGISTRY.start(data.get('task', 'default-task'), data.get('nonce', ''), data.get('round', 1))
+    try:
+        repo_full_name, created_files, metrics = run_job(lease.job, record, lease)
+    except Exception as e:
+        REGISTRY.finish(record, 'failed', str(e))
+        raise
+    REGISTRY.finish(record, 'OK')
+    return {'status': 'OK', 'repository': repo_full_name, 'files_created': list(created_files)}
+
+def start_reaper():
+    threading.Thread(target=run_reaper, args=(JOBS, resume_job), name='job-reaper', daemon=True).start()
+
+# Every process serving the app (gunicorn workers too) reclaims abandoned jobs.
+if os.getenv('RESUME_ON_START', '1') == '1':
+    start_reaper()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=7860)
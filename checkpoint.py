@@ -0,0 +1,111 @@
+"""
+checkpoint.py
+Per-job stage checkpoints so an interrupted task resumes instead of restarting.
+
+Every completed stage's output (repo name, generated file contents, pushed
+shas, Pages state, ...) is written to the job's checkpoint file as soon as
+the stage finishes. A retry of the same job (same task, round and nonce),
+including one the lease reaper resumes after a crash, restores those outputs
+and only runs the stages that had not completed. The checkpoint also holds a
+hash of the brief and checks; a resubmission under the same key that asks
+for something else starts from scratch.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+def job_key(data: Dict[str, Any]) -> str:
+    return f"{data.get('task', 'default-task')}:{data.get('round', 1)}:{data.get('nonce', '')}"
+
+
+def request_digest(data: Dict[str, Any], brief: str) -> str:
+    """Hash of what the job was asked to build: the brief (with attachment lines) and the checks."""
+    request = json.dumps({'brief': brief, 'checks': data.get('checks', [])}, sort_keys=True)
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+
+class Checkpoint:
+    """Stage outputs for one job, persisted atomically after every update."""
+
+    def __init__(self, path, key: str):
+        self.path = Path(path)
+        self.key = key
+        self.status = 'running'
+        self.data: Dict[str, Any] = {}
+        self.brief = ''
+        self.digest = ''
+        self.stages: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path, key: str) -> 'Checkpoint':
+        """Load the checkpoint at path if it belongs to this job, else start a fresh one."""
+        checkpoint = cls(path, key)
+        state = cls._read(path)
+        if state and state.get('job') == key:
+            checkpoint.status = state.get('status', 'running')
+            checkpoint.data = state.get('data', {})
+            checkpoint.brief = state.get('brief', '')
+            checkpoint.digest = state.get('digest', '')
+            checkpoint.stages = state.get('stages', {})
+            if checkpoint.stages:
+                print(f'Resuming {key} with completed stages: {sorted(checkpoint.stages)}')
+        return checkpoint
+
+    @staticmethod
+    def _read(path) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        state = {'job': self.key, 'status': self.status, 'updated': time.time(),
+                 'data': self.data, 'brief': self.brief, 'digest': self.digest, 'stages': self.stages}
+        tmp = self.path.with_name(f'{self.path.name}.{os.getpid()}-{threading.get_ident()}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def begin(self, data: Dict[str, Any], brief: str):
+        """Record what is needed to re-run the job (minus the secret).
+
+        Stages saved for a different brief or different checks are dropped.
+        """
+        digest = request_digest(data, brief)
+        with self._lock:
+            if self.stages and self.digest != digest:
+                print(f'Brief or checks changed for {self.key}, not resuming its checkpoint')
+                self.stages = {}
+            self.digest = digest
+            self.data = {k: v for k, v in data.items() if k != 'secret'}
+            self.brief = brief
+            self.status = 'running'
+            self._write()
+
+    def get(self, stage: str, default=None) -> Any:
+        return self.stages.get(stage, default)
+
+    def done(self, stage: str) -> bool:
+        return stage in self.stages
+
+    def save(self, stage: str, value: Any):
+        """Persist a stage's output; None means 'nothing to resume from' and is not stored."""
+        if value is None:
+            return
+        with self._lock:
+            self.stages[stage] = value
+            self._write()
+
+    def complete(self):
+        with self._lock:
+            self.status = 'done'
+            self._write()
+
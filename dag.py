@@ -0,0 +1,149 @@
+"""
+dag.py
+Minimal dependency-graph executor for pipeline stages.
+
+Stages whose dependencies are satisfied run concurrently on a thread pool.
+Each run records per-stage start/finish times and the critical path, i.e. the
+chain of stages that actually determined the end-to-end time.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class Stage:
+    """A named unit of work and the stages it must wait for."""
+
+    def __init__(self, name: str, fn: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = ()):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+
+    def __repr__(self):
+        return f'Stage({self.name!r}, deps={list(self.deps)})'
+
+
+class StageFailed(Exception):
+    """A stage raised; the original exception is chained as __cause__."""
+
+    def __init__(self, stage: str, error: BaseException):
+        super().__init__(f'Stage {stage} failed: {error}')
+        self.stage = stage
+        self.error = error
+
+
+class DagRun:
+    """Outcome of one execution: results, timings and the critical path."""
+
+    def __init__(self):
+        self.results: Dict[str, Any] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self.critical_path: List[str] = []
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def metrics(self) -> Dict[str, Any]:
+        """JSON-friendly summary for logs and job metrics."""
+        stages = {name: {'start': round(t['start'] - self.started, 3),
+                         'duration': round(t['end'] - t['start'], 3)}
+                  for name, t in self.timings.items()}
+        return {
+            'elapsed': round(self.elapsed, 3),
+            'serial_sum': round(sum(s['duration'] for s in stages.values()), 3),
+            'critical_path': self.critical_path,
+            'stages': stages,
+        }
+
+
+def _validate(stages: List[Stage]):
+    names = {s.name for s in stages}
+    if len(names) != len(stages):
+        raise ValueError('Duplicate stage names')
+    for s in stages:
+        missing = set(s.deps) - names
+        if missing:
+            raise ValueError(f'Stage {s.name} depends on unknown stages: {sorted(missing)}')
+    # Kahn's algorithm, only to reject cycles up front.
+    indegree = {s.name: len(s.deps) for s in stages}
+    dependents = {s.name: [] for s in stages}
+    for s in stages:
+        for d in s.deps:
+            dependents[d].append(s.name)
+    ready = [n for n, d in indegree.items() if d == 0]
+    seen = 0
+    while ready:
+        n = ready.pop()
+        seen += 1
+        for m in dependents[n]:
+            indegree[m] -= 1
+            if indegree[m] == 0:
+                ready.append(m)
+    if seen != len(stages):
+        raise ValueError('Stage graph has a cycle')
+
+
+def _critical_path(stages: Dict[str, Stage], timings: Dict[str, Dict[str, float]]) -> List[str]:
+    """Walk back from the last stage to finish through the dependency that gated it."""
+    if not timings:
+        return []
+    node = max(timings, key=lambda n: timings[n]['end'])
+    path = [node]
+    while True:
+        deps = [d for d in stages[node].deps if d in timings]
+        if not deps:
+            break
+        node = max(deps, key=lambda d: timings[d]['end'])
+        path.append(node)
+    return path[::-1]
+
+
+def run_dag(stages: List[Stage], max_workers: int = 4) -> DagRun:
+    """Run stages as soon as their dependencies finish.
+
+    Every stage function receives the dict of results produced so far. On the
+    first failure no new stages are started; running ones are allowed to
+    finish and StageFailed is raised with the run attached as `.run`.
+    """
+    _validate(stages)
+    by_name = {s.name: s for s in stages}
+    run = DagRun()
+    remaining = {s.name: set(s.deps) for s in stages}
+    running = {}
+    failure: Optional[StageFailed] = None
+
+    def execute(stage: Stage):
+        start = time.monotonic()
+        try:
+            return stage.fn(run.results)
+        finally:
+            run.timings[stage.name] = {'start': start, 'end': time.monotonic()}
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stage') as pool:
+        while remaining or running:
+            if failure is None:
+                for name in [n for n, deps in remaining.items() if not deps]:
+                    del remaining[name]
+                    running[pool.submit(execute, by_name[name])] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    failure = failure or StageFailed(name, error)
+                    continue
+                run.results[name] = future.result()
+                for deps in remaining.values():
+                    deps.discard(name)
+
+    run.finished = time.monotonic()
+    run.critical_path = _critical_path(by_name, run.timings)
+    if failure is not None:
+        failure.run = run
+        raise failure from failure.error
+    return run
@@ -0,0 +1,138 @@
+"""
+github_cache.py
+Conditional-request cache for GitHub API reads.
+
+GETs are sent with If-None-Match / If-Modified-Since when we hold a cached
+copy. GitHub answers unchanged resources with 304, which does not count
+against the primary rate limit, and we serve the stored body. Entries are
+kept in an LRU bounded by total body size and dropped whenever we write to
+the same resource (or one below it). Ancestors are kept: a build request to
+/pages/builds leaves the cached /pages entry valid. A write's response is
+never cached for later GETs; GitHub's ETag covers the response body, which
+differs between a PUT and a GET of the same resource.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+GITHUB_CACHE_BYTES = int(os.getenv('GITHUB_CACHE_BYTES', str(8 * 1024 * 1024)))
+
+# Headers worth replaying from the original 200 response.
+_KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control')
+
+
+class _Entry:
+    __slots__ = ('url', 'etag', 'last_modified', 'status', 'headers', 'body')
+
+    def __init__(self, url, etag, last_modified, status, headers, body):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+def _key(url: str, headers: Optional[Dict[str, str]]) -> tuple:
+    headers = CaseInsensitiveDict(headers or {})
+    # Different tokens may see different data; never store the token itself.
+    auth = headers.get('Authorization')
+    auth = hashlib.sha256(auth.encode()).hexdigest()[:16] if auth else None
+    return url, headers.get('Accept'), auth
+
+
+class ConditionalCache:
+    """LRU of GitHub GET responses keyed by URL, revalidated with ETags."""
+
+    def __init__(self, max_bytes: int = GITHUB_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[tuple, _Entry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _store(self, key, entry: _Entry):
+        if len(entry.body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.body)
+            self._entries[key] = entry
+            self.size += len(entry.body)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.body)
+
+    def invalidate(self, url: str):
+        """Forget url and everything below it; ancestors (e.g. /pages for /pages/builds) are kept."""
+        url = url.split('?', 1)[0].rstrip('/')
+        with self._lock:
+            for key in list(self._entries):
+                cached = key[0].split('?', 1)[0].rstrip('/')
+                if cached == url or cached.startswith(url + '/'):
+                    self.size -= len(self._entries.pop(key).body)
+
+    def _replay(self, entry: _Entry, fresh: requests.Response) -> requests.Response:
+        resp = requests.Response()
+        resp.status_code = entry.status
+        resp._content = entry.body
+        resp.url = entry.url
+        resp.encoding = 'utf-8'
+        resp.headers = CaseInsensitiveDict(entry.headers)
+        # Keep the 304's rate-limit headers, they are the current ones.
+        for name, value in getattr(fresh, 'headers', {}).items():
+            if name.lower().startswith('x-ratelimit'):
+                resp.headers[name] = value
+        resp.headers['X-Cache'] = 'HIT'
+        return resp
+
+    def request(self, method: str, url: str, send: Callable[..., requests.Response],
+                headers: Optional[Dict[str, str]] = None, **kwargs) -> requests.Response:
+        """Issue a request through send(); GETs are conditional, writes invalidate."""
+        if method.upper() != 'GET':
+            resp = send(method, url, headers=headers, **kwargs)
+            if resp.status_code < 400:
+                self.invalidate(url)
+            return resp
+
+        key = _key(url, headers)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if entry.etag:
+                request_headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                request_headers['If-Modified-Since'] = entry.last_modified
+        resp = send(method, url, headers=request_headers, **kwargs)
+        if resp.status_code == 304 and entry is not None:
+            self.hits += 1
+            return self._replay(entry, resp)
+        self.misses += 1
+        resp_headers = getattr(resp, 'headers', {}) or {}
+        etag, last_modified = resp_headers.get('ETag'), resp_headers.get('Last-Modified')
+        if resp.status_code == 200 and (etag or last_modified):
+            kept = {h: resp_headers[h] for h in _KEPT_HEADERS if h in resp_headers}
+            self._store(key, _Entry(url, etag, last_modified, 200, kept, resp.content))
+        elif entry is not None:
+            self.invalidate(url)
+        return resp
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self._entries), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses}
+
+
+GITHUB_CACHE = ConditionalCache()
@@ -0,0 +1,137 @@
+"""
+imaging.py
+Content-addressed image store with lazily generated derivatives.
+
+Each attachment is written once under its SHA-256 digest and decoded at most
+once per process; resized/recompressed variants are produced on first request
+and kept next to the original so later reads are plain file serves.
+"""
+import base64
+import hashlib
+import os
+import re
+import shutil
+import threading
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from cachetools import LRUCache
+from PIL import Image, ImageOps
+
+# variant name -> (max edge in px or None, output format, PIL mode or None)
+VARIANTS: Dict[str, Tuple[Optional[int], str, Optional[str]]] = {
+    'thumb': (320, 'WEBP', None),
+    'webp': (None, 'WEBP', None),
+    'gray': (None, 'PNG', 'L'),
+}
+
+MIME_TYPES = {'WEBP': 'image/webp', 'PNG': 'image/png', 'JPEG': 'image/jpeg', 'GIF': 'image/gif'}
+
+_DATA_URI_RE = re.compile(r'^data:([^;,]+)?(;base64)?,', re.IGNORECASE)
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def parse_data_uri(uri: str) -> Optional[Tuple[str, bytes]]:
+    """Return (mime, payload) for a data URI, or None if it is not one."""
+    m = _DATA_URI_RE.match(uri or '')
+    if not m:
+        return None
+    payload = uri[m.end():]
+    mime = m.group(1) or 'text/plain'
+    if m.group(2):
+        return mime, base64.b64decode(payload)
+    return mime, payload.encode('utf-8')
+
+
+class ImagePipeline:
+    """Store originals by digest and derive web/OCR variants on demand."""
+
+    def __init__(self, root, decode_cache_size: int = 32, quality: int = 80):
+        self.root = Path(root)
+        self.quality = quality
+        self._decoded = LRUCache(maxsize=decode_cache_size)
+        self._lock = threading.Lock()
+
+    def _dir(self, digest: str) -> Path:
+        if not _DIGEST_RE.match(digest):
+            raise ValueError(f'Invalid digest: {digest}')
+        return self.root / digest
+
+    def _store(self, digest: str, write) -> str:
+        original = self._dir(digest) / 'original'
+        if not original.exists():
+            original.parent.mkdir(parents=True, exist_ok=True)
+            tmp = original.with_suffix(f'.{os.getpid()}-{threading.get_ident()}.tmp')
+            write(tmp)
+            os.replace(tmp, original)
+        return digest
+
+    def ingest(self, data: bytes) -> str:
+        """Store raw image bytes and return their digest."""
+        return self._store(hashlib.sha256(data).hexdigest(), lambda tmp: tmp.write_bytes(data))
+
+    def ingest_file(self, path) -> str:
+        """Store an image already on disk (e.g. a spooled attachment)."""
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                h.update(chunk)
+        return self._store(h.hexdigest(), lambda tmp: shutil.copyfile(path, tmp))
+
+    def ingest_data_uri(self, uri: str) -> Optional[str]:
+        parsed = parse_data_uri(uri)
+        if not parsed or not parsed[0].startswith('image/'):
+            return None
+        return self.ingest(parsed[1])
+
+    def decode(self, digest: str) -> Image.Image:
+        """Decode the original once; later callers share the cached image."""
+        with self._lock:
+            img = self._decoded.get(digest)
+            if img is None:
+                img = Image.open(self._dir(digest) / 'original')
+                img.load()
+                self._decoded[digest] = img
+            return img
+
+    def discard(self, digest: str) -> None:
+        """Forget a stored image (e.g. one that turned out not to decode)."""
+        with self._lock:
+            self._decoded.pop(digest, None)
+        shutil.rmtree(self._dir(digest), ignore_errors=True)
+
+    def info(self, digest: str) -> Dict[str, object]:
+        img = self.decode(digest)
+        return {'digest': digest, 'width': img.width, 'height': img.height, 'format': img.format}
+
+    def variant_path(self, digest: str, variant: str) -> Path:
+        """Return the on-disk path of a variant, rendering it on first use."""
+        if variant == 'original':
+            return self._dir(digest) / 'original'
+        if variant not in VARIANTS:
+            raise KeyError(variant)
+        max_edge, fmt, mode = VARIANTS[variant]
+        path = self._dir(digest) / f'{variant}.{fmt.lower()}'
+        if path.exists():
+            return path
+        img = self.decode(digest)
+        with self._lock:
+            out = ImageOps.exif_transpose(img) if img.format == 'JPEG' else img.copy()
+        if mode:
+            out = out.convert(mode)
+        elif fmt == 'WEBP' and out.mode not in ('RGB', 'RGBA'):
+            out = out.convert('RGBA' if 'A' in out.getbands() or 'transparency' in out.info else 'RGB')
+        if max_edge:
+            out.thumbnail((max_edge, max_edge))
+        buf = BytesIO()
+        out.save(buf, fmt, quality=self.quality, optimize=True)
+        tmp = path.with_suffix(f'.{os.getpid()}-{threading.get_ident()}.tmp')
+        tmp.write_bytes(buf.getvalue())
+        os.replace(tmp, path)
+        return path
+
+    def mimetype(self, digest: str, variant: str) -> str:
+        if variant == 'original':
+            return Image.MIME.get(self.decode(digest).format, 'application/octet-stream')
+        return MIME_TYPES[VARIANTS[variant][1]]
@@ -0,0 +1,331 @@
+"""
+ingest.py
+Streaming ingestion of /task request bodies.
+
+The body is parsed incrementally straight from the WSGI input stream. Every
+`attachments[].url` that is a base64 data URI is decoded chunk by chunk into a
+spool file instead of being materialised as a Python string, so memory per
+request stays flat no matter how large the attachments are. Everything else
+(brief, checks, ...) is small metadata and is parsed normally.
+"""
+import base64
+import binascii
+import codecs
+import os
+import re
+import shutil
+from typing import Any, Dict, Tuple
+
+MAX_BODY_BYTES = int(os.getenv('MAX_BODY_BYTES', str(50 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+# Longest data URI header ("data:<mime>;base64,") we are willing to buffer.
+MAX_DATA_URI_HEADER = 256
+
+_SPECIAL = re.compile(r'["\\]')
+_WHITESPACE = ' \t\r\n'
+_NUMBER = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+_UNSAFE_NAME = re.compile(r'[^A-Za-z0-9._-]+')
+
+
+class IngestError(ValueError):
+    """The body is not valid JSON (or not the shape /task expects)."""
+
+
+class BodyTooLarge(IngestError):
+    """The body exceeded the configured maximum size."""
+
+
+class _Reader:
+    """Character buffer over a byte stream with a hard size limit."""
+
+    def __init__(self, stream, max_bytes: int, chunk_size: int = CHUNK_SIZE):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.bytes_read = 0
+        self.eof = False
+
+    def fill(self, need: int = 1) -> bool:
+        """Ensure at least `need` unread characters; False at end of input."""
+        while len(self.buf) - self.pos < need and not self.eof:
+            chunk = self.stream.read(self.chunk_size)
+            if not chunk:
+                self.eof = True
+                text = self.decoder.decode(b'', final=True)
+            else:
+                self.bytes_read += len(chunk)
+                if self.bytes_read > self.max_bytes:
+                    raise BodyTooLarge(f'Request body exceeds {self.max_bytes} bytes')
+                try:
+                    text = self.decoder.decode(chunk)
+                except UnicodeDecodeError as e:
+                    raise IngestError(f'Body is not valid UTF-8: {e}')
+            self.buf = self.buf[self.pos:] + text
+            self.pos = 0
+        return len(self.buf) - self.pos >= need
+
+    def peek(self) -> str:
+        self.skip_ws()
+        if not self.fill():
+            raise IngestError('Unexpected end of JSON input')
+        return self.buf[self.pos]
+
+    def skip_ws(self):
+        while self.fill():
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise IngestError(f'Expected {char!r} at byte ~{self.bytes_read}')
+        self.pos += 1
+
+    def read_string(self, sink) -> None:
+        """Feed the body of a JSON string (opening quote consumed) to sink in pieces."""
+        while True:
+            if not self.fill():
+                raise IngestError('Unterminated string')
+            match = _SPECIAL.search(self.buf, self.pos)
+            if match is None:
+                sink(self.buf[self.pos:])
+                self.pos = len(self.buf)
+                continue
+            if match.start() > self.pos:
+                sink(self.buf[self.pos:match.start()])
+            self.pos = match.start() + 1
+            if match.group() == '"':
+                return
+            sink(self._escape())
+
+    def _escape(self) -> str:
+        if not self.fill():
+            raise IngestError('Unterminated escape')
+        char = self.buf[self.pos]
+        self.pos += 1
+        if char in _ESCAPES:
+            return _ESCAPES[char]
+        if char != 'u':
+            raise IngestError(f'Invalid escape \\{char}')
+        code = self._hex4()
+        if 0xD800 <= code < 0xDC00 and self.fill(6) and self.buf.startswith('\\u', self.pos):
+            self.pos += 2
+            low = self._hex4()
+            return chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00))
+        return chr(code)
+
+    def _hex4(self) -> int:
+        if not self.fill(4):
+            raise IngestError('Truncated \\u escape')
+        try:
+            code = int(self.buf[self.pos:self.pos + 4], 16)
+        except ValueError:
+            raise IngestError('Invalid \\u escape')
+        self.pos += 4
+        return code
+
+    def read_literal(self) -> Any:
+        self.fill(5)
+        for text, value in (('true', True), ('false', False), ('null', None)):
+            if self.buf.startswith(text, self.pos):
+                self.pos += len(text)
+                return value
+        self.fill(64)
+        match = _NUMBER.match(self.buf, self.pos)
+        if not match:
+            raise IngestError(f'Invalid JSON value at byte ~{self.bytes_read}')
+        self.pos = match.end()
+        text = match.group()
+        return float(text) if any(c in text for c in '.eE') else int(text)
+
+
+class _Base64Spool:
+    """Decode base64 text incrementally into a file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.pending = ''
+        self.size = 0
+
+    def write(self, text: str):
+        text = self.pending + ''.join(text.split())
+        usable = len(text) - len(text) % 4
+        self.pending = text[usable:]
+        if usable:
+            self._decode(text[:usable])
+
+    def _decode(self, text: str):
+        try:
+            data = base64.b64decode(text, validate=True)
+        except binascii.Error as e:
+            raise IngestError(f'Invalid base64 attachment: {e}')
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        if self.pending:
+            self._decode(self.pending + '=' * (-len(self.pending) % 4))
+            self.pending = ''
+        self.file.close()
+
+
+def safe_filename(name: str, default: str = 'attachment') -> str:
+    """Reduce a client-supplied name to a single safe path component."""
+    return _UNSAFE_NAME.sub('_', os.path.basename(name or '')).strip('._') or default
+
+
+class _Parser:
+    def __init__(self, reader: _Reader, spool_dir: str):
+        self.reader = reader
+        self.spool_dir = spool_dir
+        # attachment index -> spooled file; kept out of the parsed data so a
+        # client can never make ingest_json treat its own values as spool files.
+        self.spooled: Dict[int, Dict[str, Any]] = {}
+
+    def value(self, path: Tuple) -> Any:
+        char = self.reader.peek()
+        if char == '{':
+            return self.obj(path)
+        if char == '[':
+            return self.array(path)
+        if char == '"':
+            self.reader.pos += 1
+            if len(path) == 3 and path[0] == 'attachments' and path[2] == 'url':
+                return self.attachment_url(path[1])
+            return self.string()
+        return self.reader.read_literal()
+
+    def string(self) -> str:
+        parts = []
+        self.reader.read_string(parts.append)
+        return ''.join(parts)
+
+    def obj(self, path: Tuple) -> Dict[str, Any]:
+        self.reader.expect('{')
+        result = {}
+        if self.reader.peek() == '}':
+            self.reader.pos += 1
+            return result
+        while True:
+            self.reader.expect('"')
+            key = self.string()
+            self.reader.expect(':')
+            result[key] = self.value(path + (key,))
+            if self.reader.peek() == ',':
+                self.reader.pos += 1
+                continue
+            self.reader.expect('}')
+            return result
+
+    def array(self, path: Tuple) -> list:
+        self.reader.expect('[')
+        result = []
+        if self.reader.peek() == ']':
+            self.reader.pos += 1
+            return result
+        while True:
+            result.append(self.value(path + (len(result),)))
+            if self.reader.peek() == ',':
+                self.reader.pos += 1
+                continue
+            self.reader.expect(']')
+            return result
+
+    def attachment_url(self, index: int) -> str:
+        """Spool a base64 data URI to disk and record it in self.spooled ('' takes its place)."""
+        head = []  # prefix buffered until we know whether this is a base64 data URI
+        spool = None
+        decided = False
+        mime = None
+
+        def sink(piece: str):
+            nonlocal spool, decided, mime
+            if decided:
+                (spool.write if spool else head.append)(piece)
+                return
+            head.append(piece)
+            text = ''.join(head)
+            comma = text.find(',')
+            if comma == -1 and len(text) <= MAX_DATA_URI_HEADER:
+                return
+            decided = True
+            header = text[:comma] if comma != -1 else ''
+            if header.startswith('data:') and header.endswith(';base64'):
+                os.makedirs(self.spool_dir, exist_ok=True)
+                spool = _Base64Spool(os.path.join(self.spool_dir, f'{index}.part'))
+                mime = header[5:-7].split(';')[0] or 'application/octet-stream'
+                head[:] = []
+                spool.write(text[comma + 1:])
+            else:
+                head[:] = [text]
+
+        try:
+            self.reader.read_string(sink)
+        finally:
+            if spool:
+                spool.close()
+        if not spool:
+            return ''.join(head)
+        self.spooled[index] = {'path': spool.path, 'mime': mime, 'size': spool.size}
+        return ''
+
+
+def ingest_json(stream, spool_dir: str, max_bytes: int = MAX_BODY_BYTES) -> Dict[str, Any]:
+    """Parse a /task body from a stream, spooling data-URI attachments into spool_dir.
+
+    Spooled attachments come back as {'name', 'mime', 'size', 'path'} instead
+    of {'name', 'url'}; other attachments are returned untouched.
+    """
+    reader = _Reader(stream, max_bytes)
+    parser = _Parser(reader, spool_dir)
+    data = parser.value(())
+    reader.skip_ws()
+    if reader.fill():
+        raise IngestError('Trailing data after JSON body')
+    if not isinstance(data, dict):
+        raise IngestError('Body must be a JSON object')
+    attachments = data.get('attachments') or []
+    if not isinstance(attachments, list):
+        raise IngestError('attachments must be a JSON array')
+    for index, attachment in enumerate(attachments):
+        if not isinstance(attachment, dict):
+            continue
+        if not isinstance(attachment.get('url', ''), str):
+            raise IngestError('Attachment url must be a string')
+        spooled = parser.spooled.get(index)
+        if spooled is None:
+            continue
+        attachment.pop('url', None)
+        path = os.path.join(spool_dir, f"{index}-{safe_filename(attachment.get('name'))}")
+        os.replace(spooled['path'], path)
+        attachment.update(mime=spooled['mime'], size=spooled['size'], path=path)
+    return data
+
+
+def move_spool(data: Dict[str, Any], spool_dir: str, dest_dir: str) -> None:
+    """Move spooled attachments into dest_dir (replacing it) and update their paths."""
+    shutil.rmtree(dest_dir, ignore_errors=True)
+    if not os.path.isdir(spool_dir):
+        return
+    os.makedirs(os.path.dirname(dest_dir), exist_ok=True)
+    shutil.move(spool_dir, dest_dir)
+    for attachment in data.get('attachments') or []:
+        if isinstance(attachment, dict) and 'path' in attachment:
+            attachment['path'] = os.path.join(dest_dir, os.path.basename(attachment['path']))
+
+
+def summarize(data: Dict[str, Any]) -> Dict[str, Any]:
+    """The request metadata worth logging (no secret, no attachment payloads)."""
+    summary = {k: v for k, v in data.items() if k not in ('secret', 'attachments')}
+    summary['attachments'] = [
+        {k: v for k, v in a.items() if k != 'url' or len(str(v)) <= MAX_DATA_URI_HEADER}
+        for a in data.get('attachments') or [] if isinstance(a, dict)
+    ]
+    return summary
+
@@ -0,0 +1,219 @@
+"""
+leasing.py
+Lease-based job distribution over a shared directory.
+
+Several server processes (gunicorn workers, containers on one volume) share
+DATA_DIR/_jobs. A job is claimed by writing a lease with an expiry; the
+owner renews it with heartbeats while it works. If a worker dies its lease
+runs out and any other worker's reaper claims the job and resumes it from
+its checkpoint. All state changes happen under one filelock, so claims are
+exclusive even across hosts that share the volume.
+
+    _jobs/queue/<id>.json   pending or running job (request metadata + brief)
+    _jobs/leases/<id>.json  {"owner": ..., "expires": ...}
+    _jobs/done/<id>.json    outcome of finished jobs
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from filelock import FileLock
+
+LEASE_SECONDS = float(os.getenv('LEASE_SECONDS', '60'))
+MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+
+
+def default_worker_id() -> str:
+    return f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+
+
+class LeaseLost(Exception):
+    """Raised by a job that notices its lease was taken over by another worker."""
+
+
+class Lease:
+    """A worker's claim on one job."""
+
+    def __init__(self, queue: 'JobQueue', job_id: str, job: Dict[str, Any]):
+        self.queue = queue
+        self.job_id = job_id
+        self.job = job
+        self.lost = False
+
+    @contextmanager
+    def keepalive(self, interval: Optional[float] = None):
+        """Heartbeat in the background while the body runs."""
+        interval = interval or self.queue.lease_seconds / 3
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                if not self.queue.heartbeat(self):
+                    print(f'Lease on {self.job_id} lost to another worker')
+                    self.lost = True
+                    return
+
+        thread = threading.Thread(target=beat, name=f'lease-{self.job_id}', daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+
+
+class JobQueue:
+    """Shared-directory job queue with expiring leases."""
+
+    def __init__(self, root, worker_id: Optional[str] = None, lease_seconds: float = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS, clock=time.time):
+        self.root = Path(root)
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.clock = clock
+        for sub in ('queue', 'leases', 'done'):
+            (self.root / sub).mkdir(parents=True, exist_ok=True)
+        self._lock = FileLock(str(self.root / 'jobs.lock'))
+
+    # -- file helpers (call with the lock held) -------------------------------
+
+    def _path(self, kind: str, job_id: str) -> Path:
+        return self.root / kind / f'{job_id}.json'
+
+    def _read(self, kind: str, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self._path(kind, job_id).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, kind: str, job_id: str, value: Dict[str, Any]):
+        path = self._path(kind, job_id)
+        tmp = path.with_name(f'{path.name}.{self.worker_id}.tmp')
+        tmp.write_text(json.dumps(value))
+        os.replace(tmp, path)
+
+    def _lease_live(self, job_id: str) -> Optional[Dict[str, Any]]:
+        lease = self._read('leases', job_id)
+        if lease and lease['expires'] > self.clock():
+            return lease
+        return None
+
+    def _take(self, job_id: str, job: Dict[str, Any]) -> Lease:
+        job['attempts'] = job.get('attempts', 0) + 1
+        self._write('queue', job_id, job)
+        self._write('leases', job_id, {'owner': self.worker_id, 'expires': self.clock() + self.lease_seconds})
+        return Lease(self, job_id, job)
+
+    # -- public API ---------------------------------------------------------
+
+    def submit(self, job_id: str, job: Dict[str, Any]) -> Optional[Lease]:
+        """Enqueue a job and claim it for this worker in one step.
+
+        Returns None when another worker holds a live lease on the same job
+        (e.g. a duplicate request while the first is still running).
+        """
+        with self._lock:
+            if self._lease_live(job_id):
+                return None
+            existing = self._read('queue', job_id) or {}
+            job = dict(job, attempts=existing.get('attempts', 0), submitted=self.clock())
+            return self._take(job_id, job)
+
+    def claim(self) -> Optional[Lease]:
+        """Claim the oldest job that nobody holds a live lease on."""
+        with self._lock:
+            candidates = []
+            for path in (self.root / 'queue').glob('*.json'):
+                job_id = path.stem
+                if self._lease_live(job_id):
+                    continue
+                job = self._read('queue', job_id)
+                if job is None:
+                    continue
+                if job.get('attempts', 0) >= self.max_attempts:
+                    print(f'Giving up on job {job_id} after {job["attempts"]} attempts')
+                    self._finish(job_id, {'status': 'failed', 'error': 'too many attempts'})
+                    continue
+                candidates.append((job.get('submitted', 0), job_id, job))
+            if not candidates:
+                return None
+            _, job_id, job = min(candidates, key=lambda c: c[:2])
+            print(f'Worker {self.worker_id} claimed job {job_id}')
+            return self._take(job_id, job)
+
+    def heartbeat(self, lease: Lease) -> bool:
+        """Extend our lease; False if it expired and someone else took the job."""
+        with self._lock:
+            current = self._read('leases', lease.job_id)
+            if not current or current['owner'] != self.worker_id:
+                return False
+            current['expires'] = self.clock() + self.lease_seconds
+            self._write('leases', lease.job_id, current)
+            return True
+
+    def _finish(self, job_id: str, result: Dict[str, Any]):
+        self._write('done', job_id, dict(result, worker=self.worker_id, finished=self.clock()))
+        for kind in ('queue', 'leases'):
+            try:
+                self._path(kind, job_id).unlink()
+            except FileNotFoundError:
+                pass
+
+    def complete(self, lease: Lease, result: Dict[str, Any]) -> bool:
+        """Mark the job finished; False if we no longer own it."""
+        with self._lock:
+            current = self._read('leases', lease.job_id)
+            if not current or current['owner'] != self.worker_id:
+                return False
+            self._finish(lease.job_id, result)
+            return True
+
+    def update(self, lease: Lease) -> bool:
+        """Persist changes to lease.job (e.g. moved attachment paths); False if we no longer own it."""
+        with self._lock:
+            current = self._read('leases', lease.job_id)
+            if not current or current['owner'] != self.worker_id:
+                return False
+            self._write('queue', lease.job_id, lease.job)
+            return True
+
+    def release(self, lease: Lease):
+        """Give a job back (e.g. after an error) so another attempt can pick it up."""
+        with self._lock:
+            current = self._read('leases', lease.job_id)
+            if current and current['owner'] == self.worker_id:
+                self._path('leases', lease.job_id).unlink()
+
+    def result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._read('done', job_id)
+
+    def pending(self) -> List[str]:
+        return sorted(p.stem for p in (self.root / 'queue').glob('*.json'))
+
+
+def run_reaper(queue: JobQueue, handle, interval: float = 5.0, stop: Optional[threading.Event] = None):
+    """Claim jobs abandoned by dead workers and run handle(lease) on each, until stopped."""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        lease = None
+        try:
+            lease = queue.claim()
+        except Exception as e:
+            print(f'Error claiming job: {e}')
+        if lease is None:
+            stop.wait(interval)
+            continue
+        try:
+            with lease.keepalive():
+                result = handle(lease)
+            queue.complete(lease, result)
+        except Exception as e:
+            print(f'Error running reclaimed job {lease.job_id}: {e}')
+            queue.release(lease)
@@ -9,6 +9,8 @@ import requests
 from typing import List, Optional, Dict, Any
 from pathlib import Path
 from pydantic import BaseModel, Field, field_validator
+from quota import GEMINI_QUOTA, gemini_usage
+from resilience import DEFAULT_TIMEOUT, GEMINI_BREAKER, CircuitOpen, http_request
 
 # Add missing AppBriefRequest model
 class AppBriefRequest(BaseModel):
@@ -43,7 +45,7 @@ def create_github_repo(task_name, github_token):
         'has_projects': True,
         'has_wiki': True
     }
-    response = requests.post(url, headers=headers, json=data)
+    response = http_request('POST', url, headers=headers, json=data)
     if response.status_code == 201:
         print(f'Repo {task_name} created.')
         return response.json()['full_name']
@@ -64,7 +66,7 @@ def upload_file_to_repo(repo_full_name, file_path, github_token, branch='gh-page
         'content': content,
         'branch': branch
     }
-    response = requests.put(url, headers=headers, json=data)
+    response = http_request('PUT', url, headers=headers, json=data)
     print(f'Upload {file_path}:', response.status_code, response.text)
     return response.status_code in [201, 200]
 
@@ -80,7 +82,7 @@ def enable_github_pages(repo_full_name, github_token, branch='gh-pages'):
             'path': '/'
         }
     }
-    response = requests.post(url, headers=headers, json=data)
+    response = http_request('POST', url, headers=headers, json=data)
     print('Enable GitHub Pages:', response.status_code, response.text)
     return response.status_code in [201, 204]
 
@@ -89,7 +91,9 @@ def use_gemini_api(brief, api_key):
     url = 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent'
     headers = {'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'}
     payload = {"contents": [{"parts": [{"text": brief}]}]}
-    response = requests.post(url, headers=headers, json=payload)
+    response = GEMINI_QUOTA.call(
+        lambda: http_request('POST', url, breaker=GEMINI_BREAKER, headers=headers, json=payload),
+        prompt=brief, usage=gemini_usage)
     return response.json()
 
 def update_github_pages(worker_dir):
@@ -108,7 +112,7 @@ def check_requirements(checks, worker_dir):
 
 def update_evaluation_url(evaluation_url, repo_details, nonce):
     payload = {"repo_details": repo_details, "nonce": nonce}
-    response = requests.post(evaluation_url, json=payload)
+    response = requests.post(evaluation_url, json=payload, timeout=DEFAULT_TIMEOUT)
     print('Evaluation URL response:', response.text)
     return response.status_code == 200
 
@@ -176,10 +180,13 @@ class AppBuilder:
         }
         
         try:
-            response = requests.post(f"{url}?key={self.gemini_api_key}", json=data, headers=headers)
+            response = GEMINI_QUOTA.call(
+                lambda: http_request("POST", f"{url}?key={self.gemini_api_key}", breaker=GEMINI_BREAKER,
+                                     json=data, headers=headers),
+                prompt=prompt, usage=gemini_usage)
             response.raise_for_status()
             return response.json()
-        except requests.RequestException as e:
+        except (requests.RequestException, CircuitOpen) as e:
             return {"error": str(e)}
     
     def process_attachments(self, request: AppBriefRequest, task_dir: Path) -> List[Path]:
@@ -0,0 +1,348 @@
+"""
+optimize.py
+Size optimizations applied to generated files before they are published.
+
+Generated HTML, CSS and JS are pushed to Pages as the model wrote them:
+unminified, with repeated rule blocks and megabytes of inline base64. This
+module shrinks them without changing behaviour:
+
+- inline base64 images above INLINE_ASSET_LIMIT bytes move to content-hashed
+  files under assets/, so the page is cacheable and parses sooner;
+- <img> tags get width/height (read with Pillow), decoding="async", and
+  loading="lazy" for every image after the first;
+- HTML, CSS and JS are minified conservatively (comments and redundant
+  whitespace go, identical CSS blocks are kept once, newlines that JS might
+  rely on for semicolon insertion are kept).
+
+Pure Python, no network access.
+"""
+import hashlib
+import os
+import posixpath
+import re
+from io import BytesIO
+from typing import Callable, Dict, Optional
+
+from PIL import Image
+
+from imaging import parse_data_uri
+
+INLINE_ASSET_LIMIT = int(os.getenv('INLINE_ASSET_LIMIT', '1024'))
+ASSET_DIR = 'assets'
+
+EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/jpg': 'jpg',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'image/avif': 'avif',
+    'image/svg+xml': 'svg',
+}
+
+_DATA_URI = re.compile(r'data:image/[a-z0-9.+-]+;base64,[A-Za-z0-9+/=]+', re.IGNORECASE)
+_ATTRS = r'''((?:[^>"']|"[^"]*"|'[^']*')*)'''
+_IMG = re.compile(r'<img\b' + _ATTRS + '>', re.IGNORECASE)
+_SRC = re.compile(r'''\ssrc\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE)
+_RAW_BLOCK = re.compile(r'(<(pre|textarea|script|style)\b' + _ATTRS + r'>)([\s\S]*?)(</\2\s*>)', re.IGNORECASE)
+_HTML_COMMENT = re.compile(r'<!--(?!\[if)[\s\S]*?-->')
+_BLOCK_TAG = re.compile(
+    r'\s*(</?(?:!doctype|html|head|body|meta|link|title|base|script|style|noscript|div|p|section|header|footer|'
+    r'nav|main|article|aside|h[1-6]|ul|ol|li|dl|dt|dd|table|thead|tbody|tfoot|tr|td|th|form|fieldset|'
+    r'br|hr|figure|figcaption|canvas|video|audio|source|template)\b' + _ATTRS + r'>)\s*', re.IGNORECASE)
+_JS_TYPES = ('', 'text/javascript', 'application/javascript', 'module')
+
+_CSS_SKIP = re.compile(r'''/\*[\s\S]*?\*/|"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|url\([^)]*\)''', re.IGNORECASE)
+_PLACEHOLDER = re.compile(r'\x00(\d+)\x00')
+
+_JS_WORD = re.compile(r'[A-Za-z0-9_$\x80-\uffff]')
+_REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void',
+                   'throw', 'instanceof', 'yield', 'await'}
+
+
+# -- CSS --------------------------------------------------------------------
+
+def _dedupe_blocks(css: str) -> str:
+    """Drop earlier copies of identical top-level blocks; the last copy decides the cascade anyway."""
+    blocks, depth, start = [], 0, 0
+    for i, c in enumerate(css):
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                blocks.append(css[start:i + 1])
+                start = i + 1
+        elif c == ';' and depth == 0:
+            blocks.append(css[start:i + 1])
+            start = i + 1
+    blocks.append(css[start:])
+    last = {block: i for i, block in enumerate(blocks) if block.endswith('}')}
+    return ''.join(block for i, block in enumerate(blocks) if last.get(block, i) == i)
+
+
+def minify_css(css: str) -> str:
+    kept = []
+
+    def skip(m):
+        token = m.group(0)
+        if token.startswith('/*'):
+            return ' '
+        kept.append(token)
+        return f'\x00{len(kept) - 1}\x00'
+
+    css = _CSS_SKIP.sub(skip, css)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    css = css.replace(';}', '}').strip()
+    css = _dedupe_blocks(css)
+    return _PLACEHOLDER.sub(lambda m: kept[int(m.group(1))], css)
+
+
+# -- JS ---------------------------------------------------------------------
+
+def _skip_string(src: str, i: int) -> int:
+    quote, i = src[i], i + 1
+    while i < len(src) and src[i] != quote:
+        if src[i] == '\\':
+            i += 1
+        elif src[i] == '\n':  # unterminated; leave the rest of the line alone
+            return i
+        i += 1
+    return i + 1
+
+
+def _skip_template(src: str, i: int) -> int:
+    i += 1
+    while i < len(src) and src[i] != '`':
+        if src[i] == '\\':
+            i += 2
+            continue
+        if src.startswith('${', i):
+            i, depth = i + 2, 1
+            while i < len(src) and depth:
+                c = src[i]
+                if c in '"\'':
+                    i = _skip_string(src, i)
+                    continue
+                if c == '`':
+                    i = _skip_template(src, i)
+                    continue
+                depth += c == '{'
+                depth -= c == '}'
+                i += 1
+            continue
+        i += 1
+    return i + 1
+
+
+def _skip_regex(src: str, i: int) -> int:
+    i, in_class = i + 1, False
+    while i < len(src) and src[i] != '\n':
+        c = src[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '[':
+            in_class = True
+        elif c == ']':
+            in_class = False
+        elif c == '/' and not in_class:
+            i += 1
+            while i < len(src) and src[i].isalpha():
+                i += 1
+            return i
+        i += 1
+    return i
+
+
+def _regex_allowed(out: list) -> bool:
+    text = ''.join(out[-12:]).rstrip()
+    if not text:
+        return True
+    if text[-1] in '(,=:[!&|?{};+-*%<>~^':
+        return True
+    word = re.search(r'[A-Za-z_$]+$', text)
+    return bool(word) and word.group(0) in _REGEX_KEYWORDS
+
+
+def minify_js(src: str) -> str:
+    """Strip comments and redundant whitespace; strings, templates and regexes are copied verbatim."""
+    out, i, n = [], 0, len(src)
+    while i < n:
+        c = src[i]
+        if c in '"\'':
+            end = _skip_string(src, i)
+            out.append(src[i:end])
+            i = end
+        elif c == '`':
+            end = _skip_template(src, i)
+            out.append(src[i:end])
+            i = end
+        elif src.startswith('//', i):
+            while i < n and src[i] != '\n':
+                i += 1
+        elif src.startswith('/*', i):
+            end = src.find('*/', i + 2)
+            end = n if end < 0 else end + 2
+            # A comment spanning lines still separates statements for semicolon insertion.
+            src = src[:i] + ('\n' if '\n' in src[i:end] else ' ') + src[end:]
+            n = len(src)
+        elif c == '/' and _regex_allowed(out):
+            end = _skip_regex(src, i)
+            out.append(src[i:end])
+            i = end
+        elif c.isspace():
+            start = i
+            while i < n and src[i].isspace():
+                i += 1
+            prev = out[-1][-1] if out and out[-1] else ''
+            nxt = src[i] if i < n else ''
+            if not prev or not nxt or prev == '\n':
+                continue
+            if '\n' in src[start:i]:
+                if prev not in '{;,' and nxt not in '}),;]':
+                    out.append('\n')
+            elif (_JS_WORD.match(prev) and _JS_WORD.match(nxt)) or (prev == nxt and prev in '+-/'):
+                out.append(' ')
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out).strip()
+
+
+# -- HTML -------------------------------------------------------------------
+
+def _minify_raw(m) -> str:
+    open_tag, name, attrs, body, close_tag = m.groups()
+    name = name.lower()
+    if name == 'style':
+        body = minify_css(body)
+    elif name == 'script' and not re.search(r'\ssrc\s*=', attrs, re.IGNORECASE):
+        kind = re.search(r'''\stype\s*=\s*["']?([^"'\s>]*)''', attrs, re.IGNORECASE)
+        if (kind.group(1).lower() if kind else '') in _JS_TYPES:
+            body = minify_js(body)
+    return open_tag + body + close_tag
+
+
+def minify_html(html: str, transform: Optional[Callable[[str], str]] = None) -> str:
+    """Minify markup; transform (e.g. image hints) sees only the markup outside raw blocks.
+
+    <pre>, <textarea>, <script> and <style> bodies are set aside first, so
+    comment stripping and transform never touch text such as a JS string
+    holding "<!-- x -->" or "<img src='b.png'>".
+    """
+    kept = []
+
+    def protect(m):
+        kept.append(_minify_raw(m))
+        return f'\x00{len(kept) - 1}\x00'
+
+    html = _RAW_BLOCK.sub(protect, html)
+    html = _HTML_COMMENT.sub('', html)
+    if transform is not None:
+        html = transform(html)
+    html = re.sub(r'\s+', ' ', html)
+    html = _BLOCK_TAG.sub(r'\1', html).strip()
+    return _PLACEHOLDER.sub(lambda m: kept[int(m.group(1))], html)
+
+
+# -- assets -----------------------------------------------------------------
+
+def _asset_ref(filename: str, asset_path: str) -> str:
+    return posixpath.relpath(asset_path, posixpath.dirname(filename) or '.')
+
+
+def externalize(text: str, filename: str, assets: Dict[str, bytes]) -> str:
+    """Replace large inline base64 images with references to hashed files (collected in assets)."""
+    def replace(m):
+        mime, payload = parse_data_uri(m.group(0))
+        ext = EXTENSIONS.get(mime.lower())
+        if ext is None or len(payload) < INLINE_ASSET_LIMIT:
+            return m.group(0)
+        path = f'{ASSET_DIR}/{hashlib.sha256(payload).hexdigest()[:16]}.{ext}'
+        assets[path] = payload
+        return _asset_ref(filename, path)
+
+    return _DATA_URI.sub(replace, text)
+
+
+def image_size(data: bytes):
+    try:
+        with Image.open(BytesIO(data)) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def _has_attr(attrs: str, name: str) -> bool:
+    return re.search(r'\s' + name + r'\s*=', attrs, re.IGNORECASE) is not None
+
+
+def add_image_hints(html: str, filename: str, assets: Dict[str, bytes], root: Optional[str] = None) -> str:
+    """width/height from the image itself, async decoding, and lazy loading below the first image."""
+    seen = [0]
+
+    def source_bytes(src: str) -> Optional[bytes]:
+        path = posixpath.normpath(posixpath.join(posixpath.dirname(filename), src))
+        if path in assets:
+            return assets[path]
+        if root and not re.match(r'^[a-z][a-z0-9+.-]*:|^//', src, re.IGNORECASE) and not path.startswith('..'):
+            try:
+                with open(os.path.join(root, path), 'rb') as f:
+                    return f.read()
+            except OSError:
+                return None
+        return None
+
+    def hint(m):
+        attrs = m.group(1)
+        closing = '/' if attrs.rstrip().endswith('/') else ''
+        attrs = attrs.rstrip().rstrip('/')
+        extra = []
+        if not _has_attr(attrs, 'width') and not _has_attr(attrs, 'height'):
+            src = _SRC.search(attrs)
+            data = source_bytes(next(g for g in src.groups() if g is not None)) if src else None
+            size = image_size(data) if data else None
+            if size:
+                extra.append(f'width="{size[0]}" height="{size[1]}"')
+        if not _has_attr(attrs, 'decoding'):
+            extra.append('decoding="async"')
+        # The first image is likely above the fold; lazy-loading it would delay the largest paint.
+        if seen[0] and not _has_attr(attrs, 'loading'):
+            extra.append('loading="lazy"')
+        seen[0] += 1
+        return '<img' + attrs + (' ' + ' '.join(extra) if extra else '') + closing + '>'
+
+    return _IMG.sub(hint, html)
+
+
+# -- entry point ------------------------------------------------------------
+
+def optimizable(filename: str) -> bool:
+    return os.path.splitext(filename)[1].lower() in ('.html', '.htm', '.css', '.js', '.mjs')
+
+
+def optimize(filename: str, content: str, root: Optional[str] = None) -> Dict:
+    """Optimized content, extracted assets {path: bytes} and the size report for one file."""
+    assets: Dict[str, bytes] = {}
+    ext = os.path.splitext(filename)[1].lower()
+    try:
+        if ext in ('.html', '.htm'):
+            out = externalize(content, filename, assets)
+            out = minify_html(out, lambda markup: add_image_hints(markup, filename, assets, root))
+        elif ext == '.css':
+            out = minify_css(externalize(content, filename, assets))
+        elif ext in ('.js', '.mjs'):
+            out = minify_js(content)
+        else:
+            out = content
+    except Exception as e:
+        print(f'Error optimizing {filename}: {e}')
+        out, assets = content, {}
+    before, after = len(content.encode('utf-8')), len(out.encode('utf-8'))
+    print(f'Optimized {filename}: {before} -> {after} bytes'
+          + (f', {len(assets)} inline image(s) moved to {ASSET_DIR}/' if assets else ''))
+    return {'content': out, 'assets': assets, 'before': before, 'after': after,
+            'asset_bytes': sum(len(a) for a in assets.values())}
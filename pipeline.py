@@ -0,0 +1,463 @@
+"""
+pipeline.py
+The /task pipeline expressed as a graph of stages.
+
+Repository setup and Pages enablement do not depend on generated content, so
+they run alongside the Gemini calls instead of in front of them. Pushes to
+the repository are serialized (the contents API commits to one branch) but
+each file is pushed as soon as its content is ready.
+"""
+import base64
+import os
+import re
+import shutil
+import threading
+
+import google.generativeai as genai
+
+from checkpoint import Checkpoint
+from dag import Stage, run_dag
+from github_cache import GITHUB_CACHE
+from optimize import optimizable, optimize
+from profiling import profiled
+from prompts import PROMPT_TOKEN_BUDGET, TokenLedger, build_prompt, compact_brief, file_prompt, strip_inline_data
+from quota import GEMINI_QUOTA, gemini_usage, is_throttled, job_priority
+from resilience import GEMINI_BREAKER, GEMINI_LATENCY, TaskBudget, hedge, http_request
+from similarity import asset_digests, find_reusable
+
+GITHUB_USERNAME = 'samarthnaikk'  # constant username
+GEMINI_HEDGE = os.getenv('GEMINI_HEDGE') == '1'
+STAGE_WORKERS = int(os.getenv('STAGE_WORKERS', '4'))
+
+FILE_PATTERNS = {
+    r'index\.html': 'index.html',
+    r'README\.md': 'README.md',
+    r'LICENSE': 'LICENSE',
+    r'style\.css': 'style.css',
+    r'script\.js': 'script.js',
+    r'main\.js': 'main.js',
+    r'app\.js': 'app.js',
+    r'package\.json': 'package.json'
+}
+
+
+class RepoSetupError(Exception):
+    """Repository creation failed in a way the caller has to act on."""
+
+    def __init__(self, status_code, payload):
+        super().__init__(payload.get('error', 'Repository creation failed'))
+        self.status_code = status_code
+        self.payload = payload
+
+
+def github_headers(github_token):
+    return {
+        'Authorization': f'token {github_token}',
+        'Accept': 'application/vnd.github.v3+json'
+    }
+
+
+def github_request(method, url, **kwargs):
+    """GitHub API call through the conditional cache: GETs revalidate, writes invalidate."""
+    return GITHUB_CACHE.request(method, url, send=http_request, **kwargs)
+
+
+def generate_content(model, prompt, stage, priority=0.0, ledger=None, label=None):
+    """One Gemini call under quota, circuit breaker and stage deadline, optionally hedged.
+
+    With a TokenLedger, the call's prompt/response tokens are recorded under label.
+    """
+    def attempt():
+        return GEMINI_QUOTA.call(
+            lambda: GEMINI_BREAKER.call(lambda: model.generate_content(
+                prompt, request_options={'timeout': stage.timeout(None)}), is_healthy_error=is_throttled),
+            prompt=prompt, priority=priority, usage=gemini_usage, timeout=stage.timeout(None))
+
+    response = hedge(attempt, GEMINI_LATENCY, timeout=stage.timeout(None)) if GEMINI_HEDGE else attempt()
+    if ledger is not None:
+        ledger.record(label or 'gemini', prompt, response)
+    return response
+
+
+def filename_for_check(check):
+    """Map a check description to the file it is about, or None."""
+    # Try to match common file patterns first
+    for pattern, file_name in FILE_PATTERNS.items():
+        if re.search(pattern, check, re.IGNORECASE):
+            return file_name
+    # Look for file extensions
+    ext_match = re.search(r'(\w+\.(html|css|js|md|json|txt|py))', check, re.IGNORECASE)
+    if ext_match:
+        return ext_match.group(1)
+    # Default to treating the whole check as a filename requirement
+    if '.' in check and len(check.split()) == 1:
+        return check.strip()
+    return None
+
+
+def extract_code(text, language='[a-zA-Z]*'):
+    match = re.search(r'`{3}' + language + r'\n([\s\S]*?)`{3}', text)
+    return match.group(1).strip() if match else None
+
+
+class TaskContext:
+    """Per-job state shared by the stages of one pipeline run."""
+
+    def __init__(self, data, brief, worker_dir, budget=None, model=None):
+        self.data = data
+        self.brief = brief
+        self.round_num = data.get('round', 1)
+        self.task_name = data.get('task', 'default-task')
+        self.checks = data.get('checks', [])
+        self.worker_dir = worker_dir
+        self.budget = budget or TaskBudget()
+        self.github_token = os.getenv('GITHUB_TOKEN')
+        self.model = model
+        self.created_files = set()
+        self.reused = {}
+        self.generated = {}
+        self.optimization = {}
+        # Built once and shared by every per-file prompt instead of the full brief.
+        self.summary = compact_brief(brief)
+        self.tokens = TokenLedger()
+        self.pushed_assets = set()
+        self.push_lock = threading.Lock()
+        self.files_stage = self.budget.stage('files')
+
+    @property
+    def headers(self):
+        return github_headers(self.github_token)
+
+    def planned_files(self):
+        """Ordered {filename: check}; later checks for the same file win, as before."""
+        files = {}
+        for check in self.checks:
+            filename = filename_for_check(check)
+            if filename:
+                files[filename] = check
+            else:
+                print(f'No specific filename found in check: {check}, skipping...')
+        return files
+
+
+def setup_repo(ctx):
+    """Create the repository for round 1, or resolve the existing one for round 2."""
+    if ctx.round_num != 1:
+        print('Round 2: Updating existing repository...')
+        repo_full_name = ctx.data.get('repo_full_name', f'{GITHUB_USERNAME}/{ctx.task_name}')
+        print(f'Using existing repository: {repo_full_name}')
+        return repo_full_name
+
+    print('Round 1: Creating new repository...')
+    # Delete existing .git if it exists
+    git_dir = os.path.join(ctx.worker_dir, '.git')
+    if os.path.exists(git_dir):
+        shutil.rmtree(git_dir)
+        print('Deleted existing .git directory')
+
+    repo_full_name = f'{GITHUB_USERNAME}/{ctx.task_name}'
+    repo_data = {
+        'name': ctx.task_name,
+        'description': f'Generated project: {ctx.task_name}',
+        'public': True,
+        # Initialise main so Pages can be enabled without waiting for our pushes.
+        'auto_init': True
+    }
+    repo_resp = github_request('POST', 'https://api.github.com/user/repos',
+                               timeout=ctx.budget.stage('repo').timeout(),
+                             headers=ctx.headers, json=repo_data)
+    print(f'GitHub repo creation response: {repo_resp.status_code} {repo_resp.text}')
+    if repo_resp.status_code == 201:
+        print(f'Successfully created repository: {repo_full_name}')
+    elif repo_resp.status_code == 422:
+        print(f'Repository {repo_full_name} already exists, proceeding with updates...')
+    elif repo_resp.status_code == 403:
+        print('ERROR: GitHub token lacks repository creation permissions.')
+        print('Please ensure your token has "repo" scope and create the repository manually:')
+        print(f'1. Go to https://github.com/new')
+        print(f'2. Create a public repository named: {ctx.task_name}')
+        print(f'3. Enable GitHub Pages in repository settings')
+        print(f'Or update your token with "repo" scope at: https://github.com/settings/tokens')
+        raise RepoSetupError(403, {'error': 'Repository creation failed - insufficient token permissions',
+                                   'action_required': f'Create repository manually: {repo_full_name}'})
+    else:
+        print(f'Unexpected error creating repository: {repo_resp.text}')
+        raise RepoSetupError(500, {'error': 'Repository creation failed', 'details': repo_resp.text})
+    return repo_full_name
+
+
+def generate_brief(ctx):
+    # Attachment lines are kept whole; only the brief text is cut to the budget.
+    prompt = build_prompt('{brief}', PROMPT_TOKEN_BUDGET, brief=strip_inline_data(ctx.brief))
+    print(f'Calling Gemini API with google-generativeai, brief: {prompt}')
+    response = generate_content(ctx.model, prompt, ctx.budget.stage('brief'), job_priority(ctx.round_num),
+                                ledger=ctx.tokens, label='brief')
+    print(f'Gemini API response: {response.text}')
+    return response.text
+
+
+def generate_file(ctx, filename, check, total):
+    if filename in ctx.reused:
+        print(f'Reusing prior content for {filename}')
+        return ctx.reused[filename]
+    print(f'Creating file: {filename} for check: {check}')
+    prompt = file_prompt(filename, ctx.summary, check)
+    response = generate_content(ctx.model, prompt, ctx.files_stage,
+                                job_priority(ctx.round_num, len(ctx.created_files), total),
+                                ledger=ctx.tokens, label=f'gen:{filename}')
+    content = extract_code(response.text)
+    return content if content is not None else response.text
+
+
+def write_file(ctx, filename, content):
+    file_path = os.path.join(ctx.worker_dir, filename)
+    print(f'Creating file: {file_path}')
+    with open(file_path, 'w') as f:
+        f.write(content)
+    print(f'File {file_path} created.')
+    ctx.generated[filename] = content
+    return file_path
+
+
+def optimize_file(ctx, filename, content):
+    """Minify a generated file and move its inline images to assets/ in the worker dir.
+
+    The optimized copy replaces the file on disk; ctx.generated keeps the
+    original so reused apps never point at assets of another repository.
+    """
+    result = optimize(filename, content, root=ctx.worker_dir)
+    for path, data in result['assets'].items():
+        asset_path = os.path.join(ctx.worker_dir, path)
+        os.makedirs(os.path.dirname(asset_path), exist_ok=True)
+        with open(asset_path, 'wb') as f:
+            f.write(data)
+    with open(os.path.join(ctx.worker_dir, filename), 'w') as f:
+        f.write(result['content'])
+    report = {'before': result['before'], 'after': result['after'],
+              'asset_bytes': result['asset_bytes'], 'assets': sorted(result['assets'])}
+    ctx.optimization[filename] = report
+    return dict(report, content=result['content'])
+
+
+def push_optimized(ctx, repo_full_name, filename, original, optimized):
+    """Push a file's extracted assets, then the file; fall back to the original if an asset fails."""
+    if not optimized:
+        return push_file(ctx, repo_full_name, filename, original)
+    for path in optimized['assets']:
+        if path in ctx.pushed_assets:
+            continue
+        with open(os.path.join(ctx.worker_dir, path), 'rb') as f:
+            pushed = push_file(ctx, repo_full_name, path, f.read())
+        if pushed is None:
+            print(f'Could not push {path}; publishing unoptimized {filename}')
+            return push_file(ctx, repo_full_name, filename, original)
+        ctx.pushed_assets.add(path)
+    return push_file(ctx, repo_full_name, filename, optimized['content'])
+
+
+def push_file(ctx, repo_full_name, filename, content):
+    """Commit one file (str or bytes) through the contents API, creating or updating it."""
+    file_url = f'https://api.github.com/repos/{repo_full_name}/contents/{filename}'
+    raw = content if isinstance(content, bytes) else content.encode('utf-8')
+    data_payload = {
+        'message': f"Update {filename} via AI task",
+        'content': base64.b64encode(raw).decode('utf-8'),
+        'branch': 'main'
+    }
+    with ctx.push_lock:
+        # Check if file exists to get sha
+        sha_resp = github_request('GET', file_url, timeout=ctx.files_stage.timeout(), headers=ctx.headers)
+        if sha_resp.status_code == 200:
+            sha = sha_resp.json().get('sha')
+            print(f'Existing file sha: {sha}')
+            if sha:
+                data_payload['sha'] = sha
+        resp = github_request('PUT', file_url, timeout=ctx.files_stage.timeout(),
+                              headers=ctx.headers, json=data_payload)
+    print(f'GitHub API file update response: {resp.status_code} {resp.text}')
+    ctx.created_files.add(filename)
+    if resp.status_code not in (200, 201):
+        return None
+    return {'status': resp.status_code, 'sha': resp.json().get('content', {}).get('sha')}
+
+
+def enable_pages(ctx, repo_full_name):
+    """Enable GitHub Pages on main if it is not enabled yet; failures are logged, not fatal.
+
+    Returns 'enabled' / 'already-enabled', or None when Pages could not be enabled.
+    """
+    try:
+        print('Checking/enabling GitHub Pages...')
+        pages_stage = ctx.budget.stage('pages')
+        pages_enable_url = f'https://api.github.com/repos/{repo_full_name}/pages'
+        pages_check_resp = github_request('GET', pages_enable_url, timeout=pages_stage.timeout(),
+                                          headers=ctx.headers)
+        if pages_check_resp.status_code == 404:
+            print('GitHub Pages not enabled, enabling now...')
+            pages_data = {
+                'source': {
+                    'branch': 'main',
+                    'path': '/'
+                }
+            }
+            pages_enable_resp = github_request('POST', pages_enable_url, timeout=pages_stage.timeout(),
+                                               headers=ctx.headers, json=pages_data)
+            print(f'GitHub Pages enable response: {pages_enable_resp.status_code} {pages_enable_resp.text}')
+            return 'enabled' if pages_enable_resp.status_code in (201, 204) else None
+        print(f'GitHub Pages already enabled: {pages_check_resp.status_code}')
+        return 'already-enabled' if pages_check_resp.status_code == 200 else None
+    except Exception as e:
+        print(f'Error enabling GitHub Pages: {e}')
+
+
+def trigger_build(ctx, repo_full_name):
+    try:
+        pages_url = f'https://api.github.com/repos/{repo_full_name}/pages/builds'
+        pages_resp = github_request('POST', pages_url, timeout=ctx.budget.stage('pages').timeout(),
+                                    headers=ctx.headers)
+        print(f'GitHub Pages build trigger response: {pages_resp.status_code} {pages_resp.text}')
+        return pages_resp.status_code if pages_resp.status_code < 300 else None
+    except Exception as e:
+        print(f'Error triggering GitHub Pages build: {e}')
+
+
+def build_stages(ctx):
+    """Dependency graph for one task.
+
+    repo ─────────────────────────────┬──> push:<file> ──┐
+    gen:<file> ──> opt:<file> ────────┘                   ├──> build
+    brief ──> push:index.html (fallback) ─────────────────┤
+    repo ──> pages ───────────────────────────────────────┘
+
+    Files reused from a similar earlier app make their gen stage a no-op;
+    the brief call is dropped entirely when index.html is reused. HTML, CSS
+    and JS get an opt stage; other files are pushed as generated.
+    """
+    planned = ctx.planned_files()
+    stages = [
+        Stage('repo', lambda r: setup_repo(ctx)),
+        Stage('pages', lambda r: enable_pages(ctx, r['repo']), deps=['repo']),
+    ]
+    if 'index.html' not in ctx.reused:
+        stages.append(Stage('brief', lambda r: generate_brief(ctx)))
+    push_stages = []
+    for filename, check in planned.items():
+        def gen(r, filename=filename, check=check):
+            content = generate_file(ctx, filename, check, len(planned))
+            write_file(ctx, filename, content)
+            return content
+
+        def opt(r, filename=filename):
+            return optimize_file(ctx, filename, r[f'gen:{filename}'])
+
+        def push(r, filename=filename):
+            return push_optimized(ctx, r['repo'], filename, r[f'gen:{filename}'], r.get(f'opt:{filename}'))
+
+        stages.append(Stage(f'gen:{filename}', gen))
+        content_stage = f'gen:{filename}'
+        if optimizable(filename):
+            stages.append(Stage(f'opt:{filename}', opt, deps=[f'gen:{filename}']))
+            content_stage = f'opt:{filename}'
+        stages.append(Stage(f'push:{filename}', push, deps=['repo', content_stage]))
+        push_stages.append(f'push:{filename}')
+
+    if 'index.html' not in planned:
+        # Also create index.html if found in Gemini response and not already created
+        def fallback_index(r):
+            content = ctx.reused.get('index.html') or extract_code(r['brief'], 'html')
+            if content is None:
+                print('Gemini API did not return a code block. No file created.')
+                return None
+            write_file(ctx, 'index.html', content)
+            optimized = optimize_file(ctx, 'index.html', content)
+            return push_optimized(ctx, r['repo'], 'index.html', content, optimized)
+
+        index_deps = ['repo'] if 'index.html' in ctx.reused else ['repo', 'brief']
+        stages.append(Stage('push:index.html', fallback_index, deps=index_deps))
+        push_stages.append('push:index.html')
+
+    stages.append(Stage('build', lambda r: trigger_build(ctx, r['repo']), deps=push_stages + ['pages']))
+    return stages
+
+
+def restore(ctx, name, value):
+    """Re-apply a checkpointed stage's side effects on the in-memory context."""
+    kind, _, filename = name.partition(':')
+    if kind == 'gen':
+        write_file(ctx, filename, value)
+    elif kind == 'opt':
+        with open(os.path.join(ctx.worker_dir, filename), 'w') as f:
+            f.write(value['content'])
+        ctx.optimization[filename] = {k: v for k, v in value.items() if k != 'content'}
+    elif kind == 'push':
+        ctx.created_files.add(filename)
+
+
+def checkpointed(ctx, checkpoint, stage):
+    """Skip a stage whose output is already checkpointed; checkpoint it otherwise."""
+    def fn(results):
+        if checkpoint.done(stage.name):
+            value = checkpoint.get(stage.name)
+            restore(ctx, stage.name, value)
+            return value
+        value = stage.fn(results)
+        checkpoint.save(stage.name, value)
+        return value
+    return Stage(stage.name, fn, stage.deps)
+
+
+def tracked(stage, progress, done=None):
+    """Report the stage name to progress(name) when it starts and to done(name) when it ends."""
+    def fn(results):
+        progress(stage.name)
+        try:
+            return stage.fn(results)
+        finally:
+            if done is not None:
+                done(stage.name)
+    return Stage(stage.name, fn, stage.deps)
+
+
+def run_task(data, brief, worker_dir, index=None, checkpoint: Checkpoint = None, progress=None, done=None):
+    """Run the full pipeline for one task; returns (repo_full_name, created files, metrics).
+
+    With a SimilarityIndex, files of a sufficiently similar earlier app are
+    reused instead of generated, and this task's files are added afterwards.
+    With a Checkpoint, completed stages are restored rather than re-run.
+    progress(stage_name) is called as each stage starts (e.g. JobRegistry.advance)
+    and done(stage_name) as it ends, whether or not it succeeded.
+    """
+    api_key = os.getenv('GEMINI_API_KEY')
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel('gemini-2.5-flash')
+    ctx = TaskContext(data, brief, worker_dir, model=model)
+    if index is not None:
+        ctx.reused = find_reusable(index, ctx.task_name, data.get('brief', ''), ctx.checks,
+                                   assets=asset_digests(brief))
+    stages = build_stages(ctx)
+    if checkpoint is not None:
+        checkpoint.begin(data, brief)
+        stages = [checkpointed(ctx, checkpoint, s) for s in stages]
+    if progress is not None:
+        stages = [tracked(s, progress, done) for s in stages]
+    stages = [Stage(s.name, profiled(s.fn), s.deps) for s in stages]
+    run = run_dag(stages, max_workers=STAGE_WORKERS)
+    metrics = run.metrics()
+    print(f"Pipeline finished in {metrics['elapsed']}s (serial sum {metrics['serial_sum']}s), "
+          f"critical path: {' -> '.join(metrics['critical_path'])}")
+    metrics['reused_files'] = sorted(set(ctx.reused) & set(ctx.generated))
+    metrics['optimization'] = ctx.optimization
+    metrics['tokens'] = ctx.tokens.metrics()
+    if ctx.optimization:
+        before = sum(o['before'] for o in ctx.optimization.values())
+        after = sum(o['after'] for o in ctx.optimization.values())
+        print(f'Optimized {len(ctx.optimization)} file(s): {before} -> {after} bytes')
+    if checkpoint is not None:
+        checkpoint.complete()
+    if index is not None and ctx.generated:
+        try:
+            index.add(ctx.task_name, data.get('brief', ''), ctx.checks, ctx.generated,
+                      assets=asset_digests(brief))
+        except Exception as e:
+            print(f'Error updating similarity index: {e}')
+    return run.results['repo'], ctx.created_files, metrics
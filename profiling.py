@@ -0,0 +1,198 @@
+"""
+profiling.py
+Opt-in per-job profiling for /task.
+
+A job is profiled when an admin asks for it (X-Profile header plus a valid
+X-Admin-Token) or when it is picked by PROFILE_SAMPLE_RATE. Two modes:
+
+- cprofile: deterministic cProfile per participating thread, merged into one
+  `.prof` file (open with snakeviz, pstats or flameprof).
+- sample: a low-overhead stack sampler writing a `.collapsed` file that
+  flamegraph.pl / speedscope read directly.
+
+Stage threads join the job's profile through profiled(), so time spent in
+the DAG workers is attributed to the job that started them.
+"""
+import cProfile
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_SAMPLE_MODE = os.getenv('PROFILE_SAMPLE_MODE', 'sample')
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.005'))
+MODES = ('cprofile', 'sample')
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9._-]+')
+_local = threading.local()
+
+
+def is_admin(headers) -> bool:
+    return bool(ADMIN_TOKEN) and headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+
+def choose_mode(headers) -> Optional[str]:
+    """Profiling mode for this request, or None to run unprofiled."""
+    requested = headers.get('X-Profile')
+    if requested and is_admin(headers):
+        return requested if requested in MODES else 'cprofile'
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return PROFILE_SAMPLE_MODE if PROFILE_SAMPLE_MODE in MODES else 'sample'
+    return None
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class _StackSampler(threading.Thread):
+    """Periodically records the stacks of a set of threads as collapsed stacks."""
+
+    def __init__(self, interval: float):
+        super().__init__(name='stack-sampler', daemon=True)
+        self.interval = interval
+        self.threads = set()
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self.threads):
+                frame = frames.get(ident)
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                if labels:
+                    self.stacks[';'.join(reversed(labels))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class JobProfiler:
+    """Profile one job across every thread that works on it."""
+
+    def __init__(self, task_id: str, out_dir, mode: str = 'cprofile', interval: float = PROFILE_INTERVAL):
+        if mode not in MODES:
+            raise ValueError(f'Unknown profiling mode: {mode}')
+        self.task_id = task_id
+        self.out_dir = Path(out_dir)
+        self.mode = mode
+        self.interval = interval
+        self._profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._sampler: Optional[_StackSampler] = None
+        self._started = None
+        self._own_scope = None
+
+    def start(self) -> 'JobProfiler':
+        self._started = time.time()
+        if self.mode == 'sample':
+            self._sampler = _StackSampler(self.interval)
+            self._sampler.start()
+        self._own_scope = self.thread()
+        self._own_scope.__enter__()
+        return self
+
+    @contextmanager
+    def thread(self):
+        """Include the calling thread in this job's profile for the duration."""
+        if getattr(_local, 'profiler', None) is self:
+            yield
+            return
+        _local.profiler = self
+        ident = threading.get_ident()
+        profile = None
+        if self.mode == 'cprofile':
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:  # another profiler already owns this interpreter/thread
+                print(f'Profiling unavailable in {threading.current_thread().name}: {e}')
+                profile = None
+        else:
+            self._sampler.threads.add(ident)
+        try:
+            yield
+        finally:
+            _local.profiler = None
+            if profile is not None:
+                profile.disable()
+                with self._lock:
+                    self._profiles.append(profile)
+            elif self._sampler is not None:
+                self._sampler.threads.discard(ident)
+
+    def stop(self) -> Optional[Path]:
+        """Stop profiling and write the dump; returns its path (None if nothing was captured)."""
+        if self._own_scope is not None:
+            self._own_scope.__exit__(None, None, None)
+            self._own_scope = None
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime(self._started))
+        base = self.out_dir / f"{_UNSAFE.sub('_', self.task_id) or 'task'}-{stamp}-{os.getpid()}"
+        if self.mode == 'sample':
+            self._sampler.stop()
+            if not self._sampler.stacks:
+                return None
+            path = base.with_name(base.name + '.collapsed')
+            with open(path, 'w') as f:
+                for stack, count in self._sampler.stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+        else:
+            if not self._profiles:
+                return None
+            stats = pstats.Stats(self._profiles[0])
+            for profile in self._profiles[1:]:
+                stats.add(profile)
+            path = base.with_name(base.name + '.prof')
+            stats.dump_stats(str(path))
+        print(f'Profile for {self.task_id} written to {path}')
+        return path
+
+
+def current() -> Optional[JobProfiler]:
+    return getattr(_local, 'profiler', None)
+
+
+def profiled(fn: Callable) -> Callable:
+    """Wrap fn so that, when run on another thread, it joins the current job's profile."""
+    profiler = current()
+    if profiler is None:
+        return fn
+
+    def wrapper(*args, **kwargs):
+        with profiler.thread():
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def list_profiles(out_dir) -> List[Dict[str, object]]:
+    """Newest first; the task id is the file name up to the timestamp."""
+    out_dir = Path(out_dir)
+    if not out_dir.is_dir():
+        return []
+    entries = []
+    for path in out_dir.iterdir():
+        if path.suffix not in ('.prof', '.collapsed'):
+            continue
+        stat = path.stat()
+        task = path.stem.rsplit('-', 2)[0]
+        entries.append({'name': path.name, 'task': task, 'mode': 'cprofile' if path.suffix == '.prof' else 'sample',
+                        'size': stat.st_size, 'modified': stat.st_mtime})
+    return sorted(entries, key=lambda e: e['modified'], reverse=True)
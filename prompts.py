@@ -0,0 +1,204 @@
+"""
+prompts.py
+Prompt assembly under per-call token budgets.
+
+Every per-check Gemini call used to carry the full brief, so a long brief
+(or one with an inline data URI) was paid for once per check. Prompts are now
+built from a compact project summary computed once per job, attachments are
+referred to by short descriptors instead of their contents, and every
+assembled prompt is held to PROMPT_TOKEN_BUDGET using a fast local token
+estimate. A TokenLedger records prompt/response tokens per stage for the
+job metrics.
+"""
+import os
+import re
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '4000'))
+SUMMARY_TOKEN_BUDGET = int(os.getenv('SUMMARY_TOKEN_BUDGET', '600'))
+
+README_PROMPT = """Create a professional README.md file for this project with the following requirements:
+
+Project: {brief}
+
+Include these sections:
+1. Project title and brief description
+2. Features/Overview
+3. Installation instructions
+4. Usage guide
+5. Technologies used
+6. Contributing guidelines
+7. License information
+
+Make it well-structured, professional, and include proper markdown formatting. Focus on clarity and completeness."""
+
+FILE_PROMPT = ("Generate professional, well-structured content for {filename} based on this project "
+               "requirement: {brief}. Check requirement: {check}")
+
+TRUNCATED = ' [...]'
+
+# Headers of the attachment lines appended to a brief; those lines are never truncated.
+HOSTED_IMAGES_HEADER = 'Attached images are hosted; reference these URLs instead of embedding data URIs:'
+ATTACHED_FILES_HEADER = 'Attached files (available in the repository request, not inlined here):'
+
+# Words, short digit groups, and any other single non-space character: close to
+# how BPE vocabularies split English, code and markup.
+_PIECE = re.compile(r'[A-Za-z]+|\d{1,3}|\S')
+_DATA_URI = re.compile(r'data:([\w.+-]+/[\w.+-]+)?(?:;(?!base64)[\w=.-]+)*(;base64)?,[A-Za-z0-9+/=%._~-]{64,}', re.IGNORECASE)
+# A sentence ends at .!? followed by whitespace, so URLs and filenames stay whole.
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n')
+_DESCRIPTORS = re.compile(f'^(?:{re.escape(HOSTED_IMAGES_HEADER)}|{re.escape(ATTACHED_FILES_HEADER)})$',
+                          re.MULTILINE)
+
+
+def _piece_tokens(piece: str) -> int:
+    return (len(piece) + 5) // 6 if piece[0].isalpha() else 1
+
+
+def estimate_tokens(text: str) -> int:
+    """Local token estimate: a token per word (per ~6 letters for long ones), one per symbol."""
+    if not text:
+        return 1
+    return max(1, sum(_piece_tokens(p) for p in _PIECE.findall(text)))
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens (marker included), preferring a sentence or line boundary."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max_tokens - estimate_tokens(TRUNCATED)
+    if limit <= 0:
+        return ''
+    used = 0
+    for m in _PIECE.finditer(text):
+        used += _piece_tokens(m.group(0))
+        if used > limit:
+            head = text[:m.start()]
+            boundary = max(head.rfind('. '), head.rfind('\n'))
+            if boundary > len(head) // 2:
+                head = head[:boundary + 1]
+            return head.rstrip() + TRUNCATED
+    return text
+
+
+def _size(n: int) -> str:
+    return f'{n / 1024:.1f} KB' if n >= 1024 else f'{n} B'
+
+
+def strip_inline_data(text: str) -> str:
+    """Replace inline data URIs with a one-line descriptor of what they contain."""
+    def describe(m):
+        mime = m.group(1) or 'text/plain'
+        payload = len(m.group(0)) - m.group(0).index(',') - 1
+        size = payload * 3 // 4 if m.group(2) else payload
+        return f'[inline {mime}, {_size(size)}]'
+    return _DATA_URI.sub(describe, text or '')
+
+
+def describe_attachment(attachment: Dict[str, Any]) -> str:
+    """'name (mime, size)' for a spooled or inline attachment, never its contents."""
+    name = attachment.get('name', 'attachment')
+    mime, size = attachment.get('mime'), attachment.get('size')
+    url = attachment.get('url', '')
+    if mime is None and url.startswith('data:'):
+        mime = url[5:].split(';', 1)[0].split(',', 1)[0] or 'text/plain'
+        payload = len(url) - url.find(',') - 1
+        size = payload * 3 // 4 if ';base64' in url.split(',', 1)[0] else payload
+    parts = [p for p in (mime, _size(size) if size is not None else None) if p]
+    if url and not url.startswith('data:'):
+        parts.append(url)
+    return f"{name} ({', '.join(parts)})" if parts else name
+
+
+def attachment_descriptors(attachments: Iterable[Dict[str, Any]], skip: Iterable[str] = ()) -> str:
+    """Prompt snippet listing attachments (except those already described elsewhere)."""
+    skip = set(skip)
+    lines = [f'- {describe_attachment(a)}' for a in attachments or []
+             if isinstance(a, dict) and a.get('name') not in skip]
+    if not lines:
+        return ''
+    return '\n'.join(['', ATTACHED_FILES_HEADER] + lines)
+
+
+def split_descriptors(brief: str):
+    """(brief text, appended attachment lines); the second part is '' if there are none."""
+    m = _DESCRIPTORS.search(brief or '')
+    if m is None:
+        return brief or '', ''
+    return brief[:m.start()], brief[m.start():].strip()
+
+
+def compact_brief(brief: str, max_tokens: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """Project summary shared by all per-file prompts of one job.
+
+    Inline data goes, whitespace is collapsed, repeated sentences are kept
+    once, and the text is cut to max_tokens at a sentence boundary. Attached
+    image/file lines appended to the brief are kept whole after the cut.
+    """
+    text, attached = split_descriptors(strip_inline_data(brief))
+    seen, sentences = set(), []
+    for part in _SENTENCE_END.split(text):
+        sentence = ' '.join(part.split())
+        key = sentence.lower()
+        if sentence and key not in seen:
+            seen.add(key)
+            sentences.append(sentence)
+    summary = truncate(' '.join(sentences), max_tokens)
+    return f'{summary}\n{attached}' if attached else summary
+
+
+def build_prompt(template: str, budget: int = PROMPT_TOKEN_BUDGET, **fields) -> str:
+    """Format template, shrinking the {brief} field (but not its attachment lines) to fit budget."""
+    fixed = estimate_tokens(template.format(**dict(fields, brief='')))
+    brief, attached = split_descriptors(fields.pop('brief', ''))
+    if not attached:
+        return template.format(brief=truncate(brief, budget - fixed), **fields)
+    brief = truncate(brief, budget - fixed - estimate_tokens(attached)).rstrip()
+    return template.format(brief=f'{brief}\n{attached}', **fields)
+
+
+def file_prompt(filename: str, brief: str, check: str, budget: int = PROMPT_TOKEN_BUDGET) -> str:
+    # Special handling for README to make it professional
+    if filename.lower() == 'readme.md':
+        return build_prompt(README_PROMPT, budget, brief=brief)
+    return build_prompt(FILE_PROMPT, budget, filename=filename, brief=brief, check=check)
+
+
+def response_tokens(response) -> Dict[str, Optional[int]]:
+    """Prompt/response token counts reported by Gemini, if the response carries them."""
+    meta = getattr(response, 'usage_metadata', None)
+    if meta is None:
+        return {'prompt': None, 'response': None}
+    return {'prompt': getattr(meta, 'prompt_token_count', None),
+            'response': getattr(meta, 'candidates_token_count', None)}
+
+
+class TokenLedger:
+    """Per-stage prompt/response token counts for one job."""
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, prompt: str, response) -> None:
+        reported = response_tokens(response)
+        prompt_tokens = reported['prompt'] or estimate_tokens(prompt)
+        completion = reported['response']
+        if completion is None:
+            try:
+                completion = estimate_tokens(response.text or '')
+            except Exception:  # blocked / empty candidates
+                completion = 0
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'calls': 0, 'prompt_tokens': 0, 'response_tokens': 0})
+            entry['calls'] += 1
+            entry['prompt_tokens'] += prompt_tokens
+            entry['response_tokens'] += completion
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {name: dict(entry) for name, entry in self.stages.items()}
+        return {'prompt_tokens': sum(e['prompt_tokens'] for e in stages.values()),
+                'response_tokens': sum(e['response_tokens'] for e in stages.values()),
+                'stages': stages}
@@ -0,0 +1,240 @@
+"""
+quota.py
+Token-bucket quota governor shared by every Gemini call.
+
+Two buckets are kept, one for requests per minute and one for tokens per
+minute. The refill rate backs off multiplicatively whenever Gemini answers
+429/RESOURCE_EXHAUSTED and creeps back up on success, so we hover at the
+quota ceiling instead of stampeding into it. Waiters are served by priority
+(round 2 and nearly-finished jobs first). Setting a state file makes the
+buckets shared between processes through a file lock.
+"""
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from filelock import FileLock
+
+from prompts import estimate_tokens
+
+
+def job_priority(round_num: int = 1, done: int = 0, total: int = 0) -> float:
+    """Round 2 work outranks round 1; within a round, closer to done wins."""
+    progress = done / total if total else 0.0
+    return (1.0 if round_num and int(round_num) >= 2 else 0.0) + progress
+
+
+def is_throttled(result: Any) -> bool:
+    """True for a 429 response or a RESOURCE_EXHAUSTED / 429 exception."""
+    if getattr(result, 'status_code', None) == 429:
+        return True
+    if isinstance(result, BaseException):
+        if getattr(result, 'code', None) == 429:
+            return True
+        text = f'{type(result).__name__} {result}'
+        return 'RESOURCE_EXHAUSTED' in text or 'ResourceExhausted' in text or '429' in text
+    return False
+
+
+class QuotaExceeded(Exception):
+    """Raised when a caller gives up waiting for quota or exhausts its retries."""
+
+
+class QuotaGovernor:
+    """Priority-aware, adaptive requests/tokens per minute limiter."""
+
+    def __init__(self, rpm: int, tpm: int, state_file: Optional[str] = None,
+                 min_rate: float = 0.1, recovery_step: float = 0.05,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.min_rate = min_rate
+        self.recovery_step = recovery_step
+        self.clock = clock
+        self.state_file = state_file
+        self._file_lock = FileLock(state_file + '.lock') if state_file else None
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._state = {'requests': float(rpm), 'tokens': float(tpm), 'rate': 1.0,
+                       'paused_until': 0.0, 'backoff_at': 0.0, 'stamp': self._now()}
+
+    @classmethod
+    def from_env(cls) -> 'QuotaGovernor':
+        return cls(rpm=int(os.getenv('GEMINI_RPM', '10')),
+                   tpm=int(os.getenv('GEMINI_TPM', '250000')),
+                   state_file=os.getenv('GEMINI_QUOTA_FILE') or None)
+
+    def _now(self) -> float:
+        # Cross-process state needs a clock every process agrees on.
+        return time.time() if self.state_file else self.clock()
+
+    # -- state access -------------------------------------------------------
+
+    def _update(self, fn):
+        """Apply fn to the (refilled) bucket state, locally or under the file lock."""
+        if not self._file_lock:
+            self._refill(self._state)
+            return fn(self._state)
+        with self._file_lock:
+            state = dict(self._state)
+            try:
+                with open(self.state_file) as f:
+                    state.update(json.load(f))
+            except (OSError, ValueError):
+                pass
+            self._refill(state)
+            result = fn(state)
+            tmp = f'{self.state_file}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_file)
+            self._state = state
+            return result
+
+    def _refill(self, state):
+        now = self._now()
+        elapsed = max(0.0, now - state['stamp'])
+        state['stamp'] = now
+        if now < state['paused_until']:
+            return
+        rate = state['rate']
+        state['requests'] = min(float(self.rpm), state['requests'] + elapsed * self.rpm * rate / 60.0)
+        state['tokens'] = min(float(self.tpm), state['tokens'] + elapsed * self.tpm * rate / 60.0)
+
+    def _try_take(self, tokens: int) -> float:
+        """Take quota if available; otherwise return seconds until it should be."""
+        tokens = min(tokens, self.tpm)
+
+        def take(state):
+            now = self._now()
+            if now < state['paused_until']:
+                return state['paused_until'] - now
+            if state['requests'] >= 1 and state['tokens'] >= tokens:
+                state['requests'] -= 1
+                state['tokens'] -= tokens
+                return 0.0
+            rate = state['rate']
+            need_req = max(0.0, 1 - state['requests']) * 60.0 / (self.rpm * rate)
+            need_tok = max(0.0, tokens - state['tokens']) * 60.0 / (self.tpm * rate)
+            return max(need_req, need_tok, 0.001)
+
+        return self._update(take)
+
+    # -- public API ---------------------------------------------------------
+
+    def acquire(self, tokens: int = 1, priority: float = 0.0, timeout: Optional[float] = None) -> float:
+        """Block until one request and `tokens` tokens are available; returns when they were granted."""
+        deadline = None if timeout is None else self.clock() + timeout
+        entry = (-priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    wait = None
+                    if self._waiters[0] == entry:
+                        wait = self._try_take(tokens)
+                        if wait == 0.0:
+                            return self._now()
+                    if deadline is not None:
+                        remaining = deadline - self.clock()
+                        if remaining <= 0:
+                            raise QuotaExceeded('Timed out waiting for Gemini quota')
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def record_usage(self, estimated: int, actual: Optional[int]) -> None:
+        """Reconcile an estimate with the token count Gemini reported."""
+        if actual is None or actual == estimated:
+            return
+
+        def settle(state):
+            state['tokens'] = min(float(self.tpm), state['tokens'] - (actual - estimated))
+
+        with self._cond:
+            self._update(settle)
+
+    def report_success(self) -> None:
+        def recover(state):
+            state['rate'] = min(1.0, state['rate'] + self.recovery_step)
+
+        with self._cond:
+            self._update(recover)
+
+    def report_throttled(self, retry_after: Optional[float] = None, acquired_at: Optional[float] = None) -> None:
+        """Halve the refill rate and pause all callers for the back-off window.
+
+        A 429 for a request granted before the latest back-off belongs to the
+        same burst and is ignored, so concurrent throttles halve the rate once.
+        """
+        def back_off(state):
+            if acquired_at is not None and acquired_at < state.get('backoff_at', 0.0):
+                return
+            state['backoff_at'] = self._now()
+            state['rate'] = max(self.min_rate, state['rate'] / 2)
+            state['requests'] = 0.0
+            pause = retry_after if retry_after is not None else 60.0 / (self.rpm * state['rate'])
+            state['paused_until'] = max(state['paused_until'], self._now() + pause)
+
+        with self._cond:
+            self._update(back_off)
+            self._cond.notify_all()
+
+    @property
+    def rate(self) -> float:
+        return self._state['rate']
+
+    def call(self, fn: Callable[[], Any], prompt: str = '', priority: float = 0.0,
+             retries: int = 3, timeout: Optional[float] = None,
+             usage: Callable[[Any], Optional[int]] = None) -> Any:
+        """Run fn under quota, retrying with back-off while Gemini throttles us.
+
+        fn may either raise a RESOURCE_EXHAUSTED error or return a response
+        object with status_code 429; both are treated as throttling.
+        """
+        estimated = estimate_tokens(prompt)
+        for attempt in range(retries + 1):
+            acquired_at = self.acquire(estimated, priority=priority, timeout=timeout)
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_throttled(e) or attempt == retries:
+                    raise
+                print(f'Gemini throttled ({e}), backing off (attempt {attempt + 1}/{retries})')
+                self.report_throttled(acquired_at=acquired_at)
+                continue
+            if is_throttled(result):
+                if attempt == retries:
+                    return result
+                retry_after = getattr(result, 'headers', {}).get('Retry-After')
+                print(f'Gemini returned 429, backing off (attempt {attempt + 1}/{retries})')
+                self.report_throttled(float(retry_after) if retry_after and retry_after.isdigit() else None,
+                                      acquired_at=acquired_at)
+                continue
+            self.report_success()
+            if usage:
+                self.record_usage(estimated, usage(result))
+            return result
+        raise QuotaExceeded('Gemini quota retries exhausted')
+
+
+def gemini_usage(response) -> Optional[int]:
+    """Total token count from a google-generativeai or REST response, if present."""
+    meta = getattr(response, 'usage_metadata', None)
+    if meta is not None:
+        return getattr(meta, 'total_token_count', None)
+    try:
+        return response.json().get('usageMetadata', {}).get('totalTokenCount')
+    except Exception:
+        return None
+
+
+GEMINI_QUOTA = QuotaGovernor.from_env()
@@ -0,0 +1,377 @@
+"""
+registry.py
+In-memory job registry for status endpoints and dashboards.
+
+Jobs are __slots__ records keyed by (task, nonce), with a second index by
+task so "what is task X doing" is a dict lookup. Stages of one job run
+concurrently, so each record counts its running stages per kind, and a
+registry-wide counter of jobs per stage kind is adjusted as stages start and
+end; "how many jobs are in stage Y" never walks the jobs. Finished jobs move
+to a bounded ring buffer; the oldest ones spill to a JSONL file on disk once
+it is full. The spill file is rotated at REGISTRY_SPILL_BYTES (one previous
+generation is kept) and indexed by task, so a status lookup reads one line.
+Replicas sharing DATA_DIR append to and rotate the same files under a file
+lock.
+
+The registry is per process. Replicas each report the jobs they run.
+
+Run `python registry.py --bench [jobs]` for memory-per-job and lookup timings.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from filelock import FileLock
+
+REGISTRY_HISTORY = int(os.getenv('REGISTRY_HISTORY', '1000'))
+REGISTRY_SPILL_BYTES = int(os.getenv('REGISTRY_SPILL_BYTES', str(8 * 1024 * 1024)))
+
+SPILL_FILE = 'history.jsonl'
+ROTATED_FILE = 'history.jsonl.1'
+
+
+class JobRecord:
+    __slots__ = ('task', 'nonce', 'round', 'stage', 'running', 'status', 'started', 'updated', 'error')
+
+    def __init__(self, task: str, nonce: str, round_num: int, started: float):
+        self.task = task
+        self.nonce = nonce
+        self.round = round_num
+        self.stage = 'queued'  # kind of the most recently started stage
+        self.running: Dict[str, int] = {}  # running stages per kind
+        self.status = 'running'
+        self.started = started
+        self.updated = started
+        self.error = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: dict(self.running) if name == 'running' else getattr(self, name)
+                for name in self.__slots__}
+
+
+def stage_kind(stage: str) -> str:
+    """'gen:index.html' -> 'gen'; counters are kept per kind, not per file."""
+    return sys.intern(stage.partition(':')[0])
+
+
+class JobRegistry:
+    """Running jobs, per-stage counts and a bounded history of finished jobs."""
+
+    def __init__(self, root=None, history: int = REGISTRY_HISTORY, spill_bytes: int = REGISTRY_SPILL_BYTES,
+                 clock=time.time):
+        self.root = Path(root) if root is not None else None
+        self.spill_bytes = spill_bytes
+        self.clock = clock
+        self._jobs: Dict[Tuple[str, str], JobRecord] = {}
+        self._by_task: Dict[str, JobRecord] = {}
+        self._stages: Counter = Counter()
+        self._outcomes: Counter = Counter()
+        self._finished: deque = deque(maxlen=history)
+        self._spilled = 0
+        self._spill = None
+        self._index: Optional[Dict[str, Tuple[str, int]]] = None  # task -> (spill file, offset)
+        self._indexed: Dict[str, Tuple[int, int]] = {}  # spill file -> (inode, bytes indexed)
+        self._lock = threading.Lock()
+
+    # -- transitions --------------------------------------------------------
+
+    def _leave_stages(self, record: JobRecord) -> None:
+        """Drop a job that stops running from every stage counter it is in."""
+        if record.stage == 'queued':
+            self._stages['queued'] -= 1
+        for kind in record.running:
+            self._stages[kind] -= 1
+        record.running.clear()
+
+    def start(self, task: str, nonce: str = '', round_num: int = 1) -> JobRecord:
+        record = JobRecord(task, nonce or '', round_num, self.clock())
+        with self._lock:
+            old = self._jobs.pop((record.task, record.nonce), None)
+            if old is not None and old.status == 'running':
+                self._leave_stages(old)
+                old.status = 'superseded'
+            self._jobs[(record.task, record.nonce)] = record
+            self._by_task[task] = record
+            self._stages[record.stage] += 1
+        return record
+
+    def advance(self, record: JobRecord, stage: str) -> None:
+        """A stage of the job started; the job counts in that stage until stage_done."""
+        kind = stage_kind(stage)
+        with self._lock:
+            if record.status != 'running':
+                return
+            if record.stage == 'queued':
+                self._stages['queued'] -= 1
+            n = record.running.get(kind, 0)
+            if not n:
+                self._stages[kind] += 1
+            record.running[kind] = n + 1
+            record.stage = kind
+            record.updated = self.clock()
+
+    def stage_done(self, record: JobRecord, stage: str) -> None:
+        """A stage of the job ended (successfully or not)."""
+        kind = stage_kind(stage)
+        with self._lock:
+            n = record.running.get(kind, 0)
+            if record.status != 'running' or not n:
+                return
+            if n == 1:
+                del record.running[kind]
+                self._stages[kind] -= 1
+            else:
+                record.running[kind] = n - 1
+            record.updated = self.clock()
+
+    def finish(self, record: JobRecord, status: str = 'OK', error: Optional[str] = None) -> None:
+        with self._lock:
+            if record.status != 'running':
+                return
+            self._leave_stages(record)
+            if self._jobs.get((record.task, record.nonce)) is record:
+                del self._jobs[(record.task, record.nonce)]
+            record.status = sys.intern(status)
+            record.error = error
+            record.updated = self.clock()
+            self._outcomes[record.status] += 1
+            if len(self._finished) == self._finished.maxlen:
+                self._spill_record(self._finished[0])
+            self._finished.append(record)
+
+    def _spill_record(self, record: JobRecord) -> None:
+        if self._by_task.get(record.task) is record:
+            del self._by_task[record.task]
+        self._spilled += 1
+        if self.root is None:
+            return
+        self._load_index()
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Replicas may share the spill files: append and rotate under a file
+        # lock, and take offsets from the file's real size, not our handle.
+        with FileLock(str(self.root / 'history.lock')):
+            path = self.root / SPILL_FILE
+            if self._spill is not None and not self._spilling_to(path):
+                self._spill.close()  # another replica rotated it
+                self._spill = None
+            if self._spill is None:
+                self._spill = open(path, 'ab')
+            offset = os.fstat(self._spill.fileno()).st_size
+            if offset >= self.spill_bytes:
+                self._rotate()
+                offset = 0
+            line = json.dumps(record.to_dict()).encode() + b'\n'
+            self._spill.write(line)
+            self._spill.flush()
+            self._index[record.task] = (SPILL_FILE, offset)
+            ino = os.fstat(self._spill.fileno()).st_ino
+            if self._indexed.get(SPILL_FILE) == (ino, offset):
+                self._indexed[SPILL_FILE] = (ino, offset + len(line))
+
+    def _spilling_to(self, path: Path) -> bool:
+        try:
+            return os.stat(path).st_ino == os.fstat(self._spill.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _rotate(self) -> None:
+        """Start a new spill file; the previous one is kept, the one before it is dropped."""
+        self._spill.close()
+        os.replace(self.root / SPILL_FILE, self.root / ROTATED_FILE)
+        self._spill = open(self.root / SPILL_FILE, 'ab')
+        self._catch_up()
+
+    def _load_index(self) -> Dict[str, Tuple[str, int]]:
+        """task -> latest spilled line, built on first use from the spill files on disk."""
+        if self._index is None:
+            self._index, self._indexed = {}, {}
+            self._catch_up()
+        return self._index
+
+    def _catch_up(self) -> None:
+        """Index lines appended since we last looked, by us or by another replica.
+
+        A spill file whose inode changed was rotated in; entries pointing at
+        the old file under that name are dropped and the new one is indexed.
+        """
+        for name in (ROTATED_FILE, SPILL_FILE):
+            try:
+                st = os.stat(self.root / name)
+            except FileNotFoundError:
+                self._forget(name)
+                continue
+            ino, start = self._indexed.get(name, (None, 0))
+            if ino != st.st_ino:
+                self._forget(name)
+                start = 0
+            if st.st_size > start:
+                with open(self.root / name, 'rb') as f:
+                    f.seek(start)
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            break  # another replica is still writing it
+                        try:
+                            self._index[json.loads(line)['task']] = (name, start)
+                        except (ValueError, KeyError):
+                            pass
+                        start += len(line)
+            self._indexed[name] = (st.st_ino, start)
+
+    def _forget(self, name: str) -> None:
+        self._index = {task: entry for task, entry in self._index.items() if entry[0] != name}
+        self._indexed.pop(name, None)
+
+    # -- queries ------------------------------------------------------------
+
+    def get(self, task: str, nonce: Optional[str] = None) -> Optional[JobRecord]:
+        """Latest job for task (or the exact task/nonce job) still held in memory."""
+        if nonce is not None:
+            record = self._jobs.get((task, nonce))
+            if record is not None:
+                return record
+            latest = self._by_task.get(task)
+            return latest if latest is not None and latest.nonce == nonce else None
+        return self._by_task.get(task)
+
+    def spilled(self) -> Iterator[Dict[str, Any]]:
+        """Jobs that aged out of memory and are still on disk, oldest first."""
+        if self.root is None:
+            return
+        for name in (ROTATED_FILE, SPILL_FILE):
+            try:
+                with open(self.root / name) as f:
+                    lines = f.readlines()
+            except OSError:
+                continue
+            for line in lines:
+                yield json.loads(line)
+
+    def lookup(self, task: str) -> Optional[Dict[str, Any]]:
+        """Status for task: memory first, then its indexed line in the spilled history.
+
+        The line found at the indexed offset must name the task. On a miss or
+        a mismatch (another replica appended or rotated the shared file) the
+        index catches up with the files once and the lookup is retried.
+        """
+        record = self.get(task)
+        if record is not None:
+            return record.to_dict()
+        if self.root is None:
+            return None
+        with self._lock:
+            self._load_index()
+            for attempt in range(2):
+                entry = self._index.get(task)
+                if entry is not None:
+                    found = self._read_line(*entry)
+                    if found is not None and found.get('task') == task:
+                        return found
+                if attempt == 0:
+                    self._catch_up()  # spilled or rotated by another replica since we indexed
+            return None
+
+    def _read_line(self, name: str, offset: int) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.root / name, 'rb') as f:
+                f.seek(offset)
+                return json.loads(f.readline())
+        except (OSError, ValueError):
+            return None
+
+    def stage_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {stage: n for stage, n in self._stages.items() if n}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'running': len(self._jobs), 'stages': {s: n for s, n in self._stages.items() if n},
+                    'outcomes': dict(self._outcomes), 'history': len(self._finished),
+                    'history_max': self._finished.maxlen, 'spilled': self._spilled}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+
+
+# -- offline benchmark ------------------------------------------------------
+
+_STAGE_NAMES = ('repo', 'pages', 'brief', 'gen:index.html', 'opt:index.html', 'push:index.html', 'build')
+
+
+def benchmark(jobs: int = 100_000, lookups: int = 200_000) -> Dict[str, Any]:
+    """Memory per running job, lookup / count / transition cost, and finish-with-spill throughput."""
+    import random
+    import tempfile
+    import tracemalloc
+
+    tasks = [f'task-{i}' for i in range(jobs)]
+    nonces = [f'nonce-{i:08x}' for i in range(jobs)]
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = JobRegistry(tmp)
+        tracemalloc.start()
+        base = tracemalloc.take_snapshot()
+        start = time.perf_counter()
+        records = [registry.start(task, nonce, 1) for task, nonce in zip(tasks, nonces)]
+        start_s = time.perf_counter() - start
+        used = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(base, 'filename'))
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        for i, record in enumerate(records):
+            registry.advance(record, _STAGE_NAMES[i % len(_STAGE_NAMES)])
+        advance_s = time.perf_counter() - start
+
+        rng = random.Random(0)
+        probe = [tasks[rng.randrange(jobs)] for _ in range(lookups)]
+        start = time.perf_counter()
+        for task in probe:
+            registry.get(task)
+        lookup_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(1000):
+            registry.stage_counts()
+        counts_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for record in records:
+            registry.finish(record)
+        finish_s = time.perf_counter() - start
+        stats = registry.stats()
+        registry.close()
+        start = time.perf_counter()
+        for task in probe[:1000]:
+            registry.lookup(task)
+        spilled_lookup_s = time.perf_counter() - start
+        on_disk = sum(1 for _ in registry.spilled())
+        spill_bytes = sum((Path(tmp) / name).stat().st_size for name in (SPILL_FILE, ROTATED_FILE)
+                          if (Path(tmp) / name).exists())
+    return {
+        'jobs': jobs,
+        'bytes_per_job': round(used / jobs, 1),
+        'start_us': round(start_s / jobs * 1e6, 3),
+        'advance_us': round(advance_s / jobs * 1e6, 3),
+        'lookup_us': round(lookup_s / lookups * 1e6, 3),
+        'stage_counts_us': round(counts_s / 1000 * 1e6, 3),
+        'finish_with_spill_us': round(finish_s / jobs * 1e6, 3),
+        'spilled_lookup_us': round(spilled_lookup_s / 1000 * 1e6, 3),
+        'history_in_memory': stats['history'],
+        'spilled': stats['spilled'],
+        'spill_bytes_per_job': round(spill_bytes / max(on_disk, 1), 1),
+    }
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == '--bench':
+        jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+        print(json.dumps(benchmark(jobs), indent=2))
+    else:
+        print('Usage: python registry.py --bench [jobs]')
+        sys.exit(1)
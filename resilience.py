@@ -0,0 +1,215 @@
+"""
+resilience.py
+Deadlines, circuit breakers and hedged calls for the task pipeline.
+
+A TaskBudget splits one overall time budget into per-stage deadlines so that
+no single HTTP or LLM call can outlive the task. Circuit breakers stop us
+from hammering Gemini or GitHub while they are failing, and hedge() sends a
+second attempt when the first is slower than the observed p95.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+import requests
+
+DEFAULT_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '30'))
+TASK_BUDGET_SECONDS = float(os.getenv('TASK_BUDGET_SECONDS', '600'))
+
+# Fraction of the overall budget each stage may use at most.
+STAGE_SHARES: Dict[str, float] = {
+    'repo': 0.1,
+    'brief': 0.3,
+    'files': 0.6,
+    'pages': 0.1,
+    'notify': 0.05,
+}
+
+
+class DeadlineExceeded(Exception):
+    """The task or stage ran out of time before the call could start."""
+
+
+class CircuitOpen(Exception):
+    """The breaker is open; the dependency is failing and calls are short-circuited."""
+
+
+class StageDeadline:
+    """Deadline for one stage, never later than the overall task deadline."""
+
+    def __init__(self, name: str, deadline: float, clock: Callable[[], float]):
+        self.name = name
+        self.deadline = deadline
+        self.clock = clock
+
+    def remaining(self) -> float:
+        return self.deadline - self.clock()
+
+    def timeout(self, cap: Optional[float] = DEFAULT_TIMEOUT) -> float:
+        """Seconds the next call may take; raises once the stage is out of time."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f'Stage {self.name} exceeded its deadline')
+        return remaining if cap is None else min(cap, remaining)
+
+
+class TaskBudget:
+    """Overall time budget for one task, handed out as per-stage deadlines."""
+
+    def __init__(self, total: float = TASK_BUDGET_SECONDS, shares: Dict[str, float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.total = total
+        self.shares = shares or STAGE_SHARES
+        self.clock = clock
+        self.deadline = clock() + total
+
+    def remaining(self) -> float:
+        return self.deadline - self.clock()
+
+    def stage(self, name: str) -> StageDeadline:
+        """Start a stage now; it may use its share of the budget, capped by what is left."""
+        share = self.shares.get(name, 1.0) * self.total
+        return StageDeadline(name, min(self.clock() + share, self.deadline), self.clock)
+
+
+class CircuitBreaker:
+    """Closed -> open after N consecutive failures -> half-open after a cool-down."""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def _before(self):
+        with self._lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self._probing):
+                raise CircuitOpen(f'{self.name} circuit is open')
+            if state == 'half-open':
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+                print(f'{self.name} circuit opened after {self.failures} failures')
+            self._probing = False
+
+    def call(self, fn: Callable[[], Any], is_failure: Callable[[Any], bool] = None,
+             is_healthy_error: Callable[[Exception], bool] = None) -> Any:
+        """Run fn through the breaker; errors matching is_healthy_error (e.g. throttling) are not failures."""
+        self._before()
+        try:
+            result = fn()
+        except Exception as e:
+            if is_healthy_error and is_healthy_error(e):
+                # The service answered; the caller (e.g. the quota governor) deals with the error.
+                self.record_success()
+            else:
+                self.record_failure()
+            raise
+        if is_failure and is_failure(result):
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+
+class LatencyTracker:
+    """Sliding window of call latencies used to pick the hedging delay."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.getenv('HEDGE_WORKERS', '8')),
+                                 thread_name_prefix='hedge')
+
+
+def hedge(fn: Callable[[], Any], tracker: LatencyTracker, delay: Optional[float] = None,
+          timeout: Optional[float] = None) -> Any:
+    """Run fn; if it is still running after the p95 delay, race a second attempt.
+
+    The first attempt to succeed wins. Without enough latency samples (and no
+    explicit delay) this is a plain call that just records its latency.
+    """
+    delay = delay if delay is not None else tracker.percentile(0.95)
+
+    def timed():
+        start = time.monotonic()
+        result = fn()
+        tracker.record(time.monotonic() - start)
+        return result
+
+    if delay is None:
+        return timed()
+    pending = {_hedge_pool.submit(timed)}
+    done, _ = wait(pending, timeout=delay)
+    if not done:
+        print(f'Hedging call after {delay:.2f}s')
+        pending.add(_hedge_pool.submit(timed))
+    deadline = None if timeout is None else time.monotonic() + timeout
+    error = None
+    while pending:
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceeded('Hedged call timed out')
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+GEMINI_BREAKER = CircuitBreaker('gemini')
+GITHUB_BREAKER = CircuitBreaker('github')
+GEMINI_LATENCY = LatencyTracker()
+
+
+def _server_error(response) -> bool:
+    return response.status_code >= 500
+
+
+def http_request(method: str, url: str, breaker: CircuitBreaker = GITHUB_BREAKER,
+                 timeout: float = DEFAULT_TIMEOUT, **kwargs) -> requests.Response:
+    """requests.request with a mandatory timeout, guarded by a circuit breaker."""
+    return breaker.call(lambda: requests.request(method, url, timeout=timeout, **kwargs),
+                        is_failure=_server_error)
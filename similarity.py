@@ -0,0 +1,286 @@
+"""
+similarity.py
+Nearest-neighbour index over completed tasks, used to reuse earlier apps.
+
+Each completed task is stored as its normalized brief + checks together with
+the files we generated for it. Lookups embed the incoming brief as a TF-IDF
+vector (unigrams + bigrams, NumPy) and return the closest prior app by cosine
+similarity. The index lives on disk, is loaded on first use and reloaded
+when another process has changed it; additions re-read it under a file lock
+so replicas sharing DATA_DIR never drop each other's entries.
+A match is only reused when both tasks host the same attachments, since
+generated pages link to them by digest under /assets/.
+
+Run `python similarity.py --bench` for an offline latency / hit-rate check.
+"""
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from filelock import FileLock
+
+SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', '0.9'))
+
+_URL = re.compile(r'https?://\S+|\?url=\S+|/files/\S+')
+_NUMBER = re.compile(r'\d+')
+_WORD = re.compile(r'[a-z#]+')
+_UNSAFE = re.compile(r'[^A-Za-z0-9._-]+')
+_ASSET = re.compile(r'/assets/([0-9a-f]{64})/')
+
+
+def normalize(brief: str, checks: List[str]) -> str:
+    """Lower-case, mask URLs and numbers, and append checks in a stable order."""
+    parts = [brief or ''] + sorted(str(c) for c in checks or [])
+    text = ' '.join(parts).lower()
+    text = _URL.sub(' url ', text)
+    return _NUMBER.sub('#', text)
+
+
+def asset_digests(brief: str) -> List[str]:
+    """Digests of the hosted attachments a brief links to, sorted."""
+    return sorted(set(_ASSET.findall(brief or '')))
+
+
+def terms(text: str) -> Counter:
+    words = _WORD.findall(text)
+    return Counter(words + [f'{a} {b}' for a, b in zip(words, words[1:])])
+
+
+class SimilarityIndex:
+    """Persisted TF-IDF index of completed tasks and their generated files."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._lock = threading.RLock()
+        self._entries: Optional[List[Dict]] = None
+        self._version: Optional[Tuple[int, int]] = None  # (inode, mtime) of the loaded index.json
+        self._matrix = None
+        self._vocab: Dict[str, int] = {}
+        self._idf = None
+
+    # -- persistence --------------------------------------------------------
+
+    def _load(self):
+        """(Re)load index.json unless the copy in memory is current."""
+        path = self.root / 'index.json'
+        version = self._stat(path)
+        if self._entries is not None and version == self._version:
+            return
+        self._entries = json.loads(path.read_text()) if version is not None else []
+        self._version = version
+        self._matrix = None
+
+    @staticmethod
+    def _stat(path: Path) -> Optional[Tuple[int, int]]:
+        # Every save is an os.replace, so the inode changes even if mtime does not.
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def _save(self):
+        tmp = self.root / f'index.json.{os.getpid()}.tmp'
+        tmp.write_text(json.dumps(self._entries))
+        os.replace(tmp, self.root / 'index.json')
+        self._version = self._stat(self.root / 'index.json')
+
+    def _build(self):
+        """(Re)compute vocabulary, IDF weights and the normalized document matrix."""
+        docs = [Counter(e['terms']) for e in self._entries]
+        df = Counter()
+        for doc in docs:
+            df.update(doc.keys())
+        self._vocab = {term: i for i, term in enumerate(sorted(df))}
+        n = len(docs)
+        self._idf = np.array([math.log((1 + n) / (1 + df[t])) + 1 for t in sorted(df)], dtype=np.float32)
+        matrix = np.zeros((n, len(self._vocab)), dtype=np.float32)
+        for row, doc in enumerate(docs):
+            for term, count in doc.items():
+                matrix[row, self._vocab[term]] = 1 + math.log(count)
+        matrix *= self._idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self._matrix = matrix / np.where(norms == 0, 1, norms)
+
+    def _vector(self, text: str):
+        vec = np.zeros(len(self._vocab), dtype=np.float32)
+        for term, count in terms(text).items():
+            col = self._vocab.get(term)
+            if col is not None:
+                vec[col] = 1 + math.log(count)
+        vec *= self._idf
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    # -- public API ---------------------------------------------------------
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._entries)
+
+    def add(self, task: str, brief: str, checks: List[str], files: Dict[str, str],
+            assets: Iterable[str] = ()) -> None:
+        """Record a completed task and the attachment digests its files link to.
+
+        A later task with the same name replaces it.
+        """
+        key = _UNSAFE.sub('_', task) or 'task'
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._lock, FileLock(str(self.root / 'index.lock')):
+            self._entries = None  # re-read: another replica may have added entries
+            self._load()
+            app_dir = self.root / 'apps' / key
+            shutil.rmtree(app_dir, ignore_errors=True)
+            app_dir.mkdir(parents=True)
+            for filename, content in files.items():
+                (app_dir / _UNSAFE.sub('_', filename)).write_text(content)
+            self._entries = [e for e in self._entries if e['key'] != key]
+            text = normalize(brief, checks)
+            self._entries.append({'key': key, 'task': task, 'text': text, 'terms': terms(text),
+                                  'files': {f: _UNSAFE.sub('_', f) for f in files},
+                                  'assets': sorted(set(assets))})
+            self._save()
+            self._matrix = None
+
+    def lookup(self, brief: str, checks: List[str]) -> Tuple[Optional[Dict], float]:
+        """Closest prior task and its cosine similarity (None, 0.0 if the index is empty)."""
+        with self._lock:
+            self._load()
+            if not self._entries:
+                return None, 0.0
+            if self._matrix is None:
+                self._build()
+            scores = self._matrix @ self._vector(normalize(brief, checks))
+            best = int(np.argmax(scores))
+            return self._entries[best], float(scores[best])
+
+    def load_files(self, entry: Dict) -> Dict[str, str]:
+        app_dir = self.root / 'apps' / entry['key']
+        return {name: (app_dir / stored).read_text() for name, stored in entry['files'].items()
+                if (app_dir / stored).exists()}
+
+
+def adapt(content: str, old_task: str, new_task: str) -> str:
+    """Light adaptation of a reused file: carry over the new task's name."""
+    if not old_task or old_task == new_task:
+        return content
+    old_title = old_task.replace('-', ' ').title()
+    new_title = new_task.replace('-', ' ').title()
+    return content.replace(old_task, new_task).replace(old_title, new_title)
+
+
+def find_reusable(index: SimilarityIndex, task: str, brief: str, checks: List[str],
+                  threshold: float = SIMILARITY_THRESHOLD, assets: Iterable[str] = ()) -> Dict[str, str]:
+    """Files from the nearest prior app, adapted to this task, if it is similar enough.
+
+    Nothing is reused unless the prior app linked to the same attachment
+    digests, otherwise its pages would point at the other task's images.
+    """
+    try:
+        entry, score = index.lookup(brief, checks)
+    except Exception as e:
+        print(f'Similarity lookup failed: {e}')
+        return {}
+    if entry is None or score < threshold:
+        if entry is not None:
+            print(f"Nearest prior app {entry['task']} scored {score:.3f}, below {threshold}")
+        return {}
+    if entry.get('assets', []) != sorted(set(assets)):
+        print(f"Nearest prior app {entry['task']} used different attachments, not reusing it")
+        return {}
+    print(f"Reusing files from {entry['task']} (similarity {score:.3f})")
+    return {name: adapt(content, entry['task'], task) for name, content in index.load_files(entry).items()}
+
+
+# -- offline benchmark ------------------------------------------------------
+
+_VARIANT_EDITS = [
+    lambda b: b,
+    lambda b: b.replace('Create', 'Build'),
+    lambda b: b + ' Keep it simple.',
+    lambda b: re.sub(r'https?://\S+|\?url=\S+', '?url=https://example.org/other.png', b),
+    lambda b: b.replace('.', ' quickly.', 1),
+]
+
+_UNRELATED = [
+    'Publish a markdown-to-html converter with live preview and copy button.',
+    'Create a weather dashboard that fetches a city forecast and charts temperature.',
+    'Build a todo list that persists items in localStorage with filters.',
+    'Render a sales CSV attachment as a sortable table with totals per region.',
+]
+
+
+def _load_corpus(testdir: Path) -> List[Dict]:
+    corpus = []
+    for request_file in sorted(testdir.glob('*/request.json')) + sorted(testdir.glob('*/payload.json')):
+        data = json.loads(request_file.read_text())
+        files = {p.name: p.read_text() for p in request_file.parent.iterdir()
+                 if p.suffix in ('.html', '.css', '.js', '.md') or p.name == 'LICENSE'}
+        corpus.append({'task': data.get('task', request_file.parent.name), 'brief': data.get('brief', ''),
+                       'checks': data.get('checks', []), 'files': files})
+    return corpus
+
+
+def benchmark(testdir: str = 'testdir', threshold: float = SIMILARITY_THRESHOLD, repeat: int = 200) -> Dict:
+    """Index testdir apps, then query perturbed and unrelated briefs."""
+    import tempfile
+    corpus = _load_corpus(Path(testdir))
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SimilarityIndex(tmp)
+        for item in corpus:
+            index.add(item['task'], item['brief'], item['checks'], item['files'])
+        # Reload from disk so the first lookup pays the lazy load + build cost.
+        index = SimilarityIndex(tmp)
+        start = time.perf_counter()
+        index.lookup('warm up', [])
+        cold = time.perf_counter() - start
+
+        queries = [(item['task'], edit(item['brief']), item['checks'])
+                   for item in corpus for edit in _VARIANT_EDITS]
+        queries += [(None, brief, ['Repo has MIT license']) for brief in _UNRELATED]
+        latencies, hits, correct, false_hits = [], 0, 0, 0
+        for _ in range(repeat):
+            for expected, brief, checks in queries:
+                start = time.perf_counter()
+                entry, score = index.lookup(brief, checks)
+                latencies.append(time.perf_counter() - start)
+        for expected, brief, checks in queries:
+            entry, score = index.lookup(brief, checks)
+            hit = entry is not None and score >= threshold
+            if expected is None:
+                false_hits += hit
+            else:
+                hits += hit
+                correct += hit and entry['task'] == expected
+    latencies.sort()
+    related = len(queries) - len(_UNRELATED)
+    return {
+        'indexed': len(corpus),
+        'queries': len(queries),
+        'threshold': threshold,
+        'cold_lookup_ms': round(cold * 1000, 3),
+        'mean_lookup_ms': round(sum(latencies) / len(latencies) * 1000, 4),
+        'p95_lookup_ms': round(latencies[int(0.95 * len(latencies))] * 1000, 4),
+        'hit_rate': round(hits / related, 3) if related else 0.0,
+        'correct_hit_rate': round(correct / related, 3) if related else 0.0,
+        'false_hit_rate': round(false_hits / len(_UNRELATED), 3),
+    }
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == '--bench':
+        testdir = sys.argv[2] if len(sys.argv) > 2 else 'testdir'
+        print(json.dumps(benchmark(testdir), indent=2))
+    else:
+        print('Usage: python similarity.py --bench [testdir]')
+        sys.exit(1)
@@ -0,0 +1,101 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+from admission import (LANE_RETRY, LANE_ROUND1, LANE_ROUND2, AdmissionController,
+                       AdmissionRejected)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def wait_for(predicate, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < end, 'condition not reached'
+        time.sleep(0.01)
+
+
+def test_sheds_beyond_inflight_and_queue_caps():
+    ctl = AdmissionController(max_inflight=1, max_queued=0, default_job_seconds=30)
+    ticket = ctl.admit()
+    with pytest.raises(AdmissionRejected) as info:
+        ctl.admit()
+    assert info.value.retry_after == 30  # one slot, ~30s per job
+    ticket.release()
+    ctl.admit().release()
+
+
+def test_retry_after_tracks_drain_rate():
+    clock = FakeClock()
+    ctl = AdmissionController(max_inflight=1, max_queued=0, clock=clock)
+    for _ in range(10):
+        ctl.admit().release()
+        clock.now += 2  # one completion every 2 seconds
+    ctl.admit()
+    with pytest.raises(AdmissionRejected) as info:
+        ctl.admit()
+    assert info.value.retry_after == 2
+
+
+def test_lanes_order_waiters():
+    ctl = AdmissionController(max_inflight=1, max_queued=5)
+    running = ctl.admit()
+    order = []
+
+    def worker(lane):
+        with ctl.admit(lane):
+            order.append(lane)
+
+    threads = [threading.Thread(target=worker, args=(lane,))
+               for lane in (LANE_ROUND1, LANE_ROUND2, LANE_RETRY)]
+    for t in threads:
+        t.start()
+        wait_for(lambda: ctl.queued == threads.index(t) + 1)
+    running.release()
+    for t in threads:
+        t.join(2)
+    assert order == [LANE_RETRY, LANE_ROUND2, LANE_ROUND1]
+
+
+def test_higher_lane_displaces_queued_round1():
+    ctl = AdmissionController(max_inflight=1, max_queued=1)
+    running = ctl.admit()
+    errors = []
+
+    def low():
+        try:
+            ctl.admit(LANE_ROUND1)
+        except AdmissionRejected as e:
+            errors.append(e)
+
+    t = threading.Thread(target=low)
+    t.start()
+    wait_for(lambda: ctl.queued == 1)
+    done = []
+    high = threading.Thread(target=lambda: done.append(ctl.admit(LANE_ROUND2)))
+    high.start()
+    t.join(2)
+    assert errors and errors[0].retry_after >= 1
+    running.release()
+    high.join(2)
+    assert done and done[0].admitted
+
+
+def test_known_nonce_uses_retry_lane():
+    ctl = AdmissionController()
+    assert ctl.lane_for(1, 'abc') == LANE_ROUND1
+    assert ctl.lane_for(2, 'def') == LANE_ROUND2
+    assert ctl.lane_for(1, 'abc') == LANE_RETRY
@@ -32,3 +32,38 @@ def test_post_task(tmp_path, monkeypatch):
     # check file saved
     task_dir = DATA_DIR / 'captcha-solver-test'
     assert (task_dir / 'payload.json').exists()
+
+
+def test_undecodable_image_attachment_is_skipped(tmp_path, monkeypatch):
+    import app as app_module
+    from imaging import ImagePipeline
+
+    monkeypatch.setattr(app_module, 'IMAGES', ImagePipeline(tmp_path / 'images'))
+    stored = app_module.store_attachments(
+        [{"name": "sample.png", "url": "data:image/png;base64,iVBORw0KGgo="}], 'http://host/')
+    assert stored == {}
+    assert not any((tmp_path / 'images').glob('*/original'))
+
+
+def test_run_job_uses_job_dir_and_stops_when_lease_lost(tmp_path, monkeypatch):
+    import app as app_module
+    import pytest
+    from leasing import JobQueue, LeaseLost
+
+    monkeypatch.setattr(app_module, 'DATA_DIR', tmp_path)
+    seen = {}
+
+    def fake_run_task(data, brief, worker_dir, index=None, checkpoint=None, progress=None, done=None):
+        seen['worker_dir'] = worker_dir
+        progress('repo')
+        lease.lost = True
+        progress('gen:index.html')
+
+    monkeypatch.setattr(app_module, 'run_task', fake_run_task)
+    data = {'task': 'demo', 'round': 2, 'nonce': 'n-1'}
+    lease = JobQueue(tmp_path / '_jobs', worker_id='a').submit('demo_2_n-1', {'data': data, 'brief': 'x'})
+    with pytest.raises(LeaseLost):
+        app_module.run_job(lease.job, lease=lease)
+    assert seen['worker_dir'] == str(app_module.job_dir(data) / 'work')
+    assert app_module.job_dir(data).parent == tmp_path / 'demo'
+    assert app_module.job_dir(data).name != app_module.job_dir(dict(data, nonce='n-2')).name
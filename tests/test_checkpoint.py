@@ -0,0 +1,126 @@
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+import pipeline
+from checkpoint import Checkpoint, job_key
+from quota import QuotaGovernor
+from dag import StageFailed, run_dag
+
+DATA = {'task': 'demo', 'round': 1, 'nonce': 'n-1', 'secret': 'shh',
+        'checks': ['index.html exists', 'README.md is professional', 'style.css exists']}
+
+
+class Response:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+        self.text = ''
+        self.content = b''
+        self.headers = {}
+
+    def json(self):
+        return self._payload
+
+
+class CountingModel:
+    def __init__(self, fail_on=None, fail_after=None):
+        self.prompts = []
+        self.fail_on = fail_on
+        self.fail_after = fail_after
+
+    def generate_content(self, prompt, request_options=None):
+        self.prompts.append(prompt)
+        if self.fail_on and self.fail_on in prompt:
+            if self.fail_after is not None:
+                assert self.fail_after.wait(10)
+            raise RuntimeError('process died')
+
+        class Result:
+            text = f'```\ncontent for {len(self.prompts)}\n```'
+        return Result()
+
+
+def fake_http(method, url, timeout=None, **kwargs):
+    if method == 'PUT':
+        return Response(201, {'content': {'sha': 'sha-' + url.rsplit('/', 1)[1]}})
+    return Response(201 if method == 'POST' else 404)
+
+
+def run(tmp_path, model, checkpoint, brief='Build a demo', max_workers=1):
+    ctx = pipeline.TaskContext(DATA, brief, str(tmp_path / 'work'), model=model)
+    (tmp_path / 'work').mkdir(exist_ok=True)
+    stages = [pipeline.checkpointed(ctx, checkpoint, s) for s in pipeline.build_stages(ctx)]
+    checkpoint.begin(DATA, brief)
+    return ctx, run_dag(stages, max_workers=max_workers)
+
+
+def test_resume_skips_completed_stages(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, 'http_request', fake_http)
+    monkeypatch.setattr(pipeline, 'GEMINI_QUOTA', QuotaGovernor(rpm=1000, tpm=10 ** 7))
+    path = tmp_path / 'demo' / 'checkpoint.json'
+
+    # style.css fails only once README.md's push is checkpointed, whatever the scheduling.
+    pushed = threading.Event()
+    checkpoint = Checkpoint.open(path, job_key(DATA))
+    save = checkpoint.save
+
+    def save_and_signal(stage, value):
+        save(stage, value)
+        if stage == 'push:README.md':
+            pushed.set()
+
+    checkpoint.save = save_and_signal
+    with pytest.raises(StageFailed):
+        run(tmp_path, CountingModel(fail_on='style.css', fail_after=pushed), checkpoint, max_workers=2)
+    state = Checkpoint.open(path, job_key(DATA))
+    assert 'gen:index.html' in state.stages and 'gen:style.css' not in state.stages
+    assert state.stages['push:README.md'] == {'status': 201, 'sha': 'sha-README.md'}
+    assert 'secret' not in state.data
+    assert state.status == 'running'
+
+    model = CountingModel()
+    ctx, result = run(tmp_path, model, state)
+    # Only the interrupted file is generated again.
+    assert len(model.prompts) == 1 and 'style.css' in model.prompts[0]
+    assert ctx.created_files == {'index.html', 'README.md', 'style.css'}
+    assert (tmp_path / 'work' / 'index.html').exists()
+    state.complete()
+    assert Checkpoint.open(path, job_key(DATA)).status == 'done'
+
+
+def test_changed_brief_starts_fresh(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, 'http_request', fake_http)
+    # Earlier tests drain the shared 10 RPM governor.
+    monkeypatch.setattr(pipeline, 'GEMINI_QUOTA', QuotaGovernor(rpm=1000, tpm=10 ** 7))
+    path = tmp_path / 'checkpoint.json'
+    first = CountingModel()
+    run(tmp_path, first, Checkpoint.open(path, job_key(DATA)))
+    model = CountingModel()
+    run(tmp_path, model, Checkpoint.open(path, job_key(DATA)), brief='Build a different demo')
+    assert len(model.prompts) == len(first.prompts)  # every Gemini stage ran again
+    assert all('different' in p for p in model.prompts)
+
+    model = CountingModel()
+    run(tmp_path, model, Checkpoint.open(path, job_key(DATA)), brief='Build a different demo')
+    assert model.prompts == []
+
+
+def test_new_nonce_starts_fresh(tmp_path):
+    path = tmp_path / 'checkpoint.json'
+    first = Checkpoint.open(path, 'demo:1:a')
+    first.save('repo', 'o/demo')
+    assert Checkpoint.open(path, 'demo:1:a').done('repo')
+    assert not Checkpoint.open(path, 'demo:1:b').done('repo')
+
+
+def test_none_results_are_not_checkpointed(tmp_path):
+    checkpoint = Checkpoint(tmp_path / 'c.json', 'k')
+    checkpoint.save('pages', None)
+    assert not checkpoint.done('pages')
@@ -0,0 +1,57 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+from dag import Stage, StageFailed, run_dag
+
+
+def sleeper(seconds, value=None):
+    def fn(results):
+        time.sleep(seconds)
+        return value
+    return fn
+
+
+def test_independent_stages_overlap():
+    stages = [
+        Stage('repo', sleeper(0.2, 'repo')),
+        Stage('gen', sleeper(0.3, 'content')),
+        Stage('push', lambda r: (r['repo'], r['gen']), deps=['repo', 'gen']),
+    ]
+    run = run_dag(stages)
+    assert run.results['push'] == ('repo', 'content')
+    assert run.elapsed < 0.45  # longest chain, not the 0.5s sum
+    assert run.critical_path == ['gen', 'push']
+    metrics = run.metrics()
+    assert metrics['serial_sum'] >= 0.5
+    assert set(metrics['stages']) == {'repo', 'gen', 'push'}
+
+
+def test_failure_skips_dependents():
+    ran = []
+
+    def boom(results):
+        raise RuntimeError('boom')
+
+    stages = [
+        Stage('a', boom),
+        Stage('b', lambda r: ran.append('b'), deps=['a']),
+    ]
+    with pytest.raises(StageFailed) as info:
+        run_dag(stages)
+    assert info.value.stage == 'a'
+    assert isinstance(info.value.error, RuntimeError)
+    assert ran == []
+
+
+def test_rejects_cycles_and_unknown_deps():
+    with pytest.raises(ValueError):
+        run_dag([Stage('a', None, deps=['b']), Stage('b', None, deps=['a'])])
+    with pytest.raises(ValueError):
+        run_dag([Stage('a', None, deps=['missing'])])
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import sys
+from pathlib import Path
+
+import requests
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+import pipeline
+from github_cache import ConditionalCache
+
+REPO = 'https://api.github.com/repos/o/r'
+
+
+def response(status, body=b'', headers=None):
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = body
+    resp.headers.update(headers or {})
+    return resp
+
+
+def etag_of(body):
+    return f'W/"{hashlib.sha256(body).hexdigest()[:16]}"'
+
+
+class FakeGitHub:
+    """Serves one JSON document per URL, honouring If-None-Match.
+
+    Like GitHub, the ETag is a hash of the response body, so a PUT's ETag
+    (new file metadata + commit) never matches a later GET of the file.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.calls = []
+
+    def send(self, method, url, headers=None, **kwargs):
+        self.calls.append((method, url, dict(headers or {})))
+        if method == 'PUT':
+            self.docs[url] = {'sha': f'sha-{len(self.calls)}', 'content': 'b64'}
+            body = json.dumps({'content': {'sha': self.docs[url]['sha']}, 'commit': {'sha': 'c'}}).encode()
+            return response(201, body, {'ETag': etag_of(body)})
+        if method != 'GET':
+            return response(201)
+        if url not in self.docs:
+            return response(404)
+        body = json.dumps(self.docs[url]).encode()
+        etag = etag_of(body)
+        if (headers or {}).get('If-None-Match') == etag:
+            return response(304, headers={'ETag': etag, 'X-RateLimit-Remaining': '4999'})
+        return response(200, body, {'ETag': etag, 'Content-Type': 'application/json'})
+
+
+def test_unchanged_get_is_served_from_304():
+    gh = FakeGitHub()
+    gh.docs[f'{REPO}/pages'] = {'sha': 'abc'}
+    cache = ConditionalCache()
+    first = cache.request('GET', f'{REPO}/pages', gh.send, headers={'Authorization': 'token t'})
+    second = cache.request('GET', f'{REPO}/pages', gh.send, headers={'Authorization': 'token t'})
+    assert first.json() == second.json() == {'sha': 'abc'}
+    assert second.status_code == 200 and second.headers['X-Cache'] == 'HIT'
+    assert second.headers['X-RateLimit-Remaining'] == '4999'
+    assert gh.calls[1][2]['If-None-Match'] == first.headers['ETag']
+    assert cache.stats()['hits'] == 1
+
+
+def test_own_writes_invalidate_only_that_resource():
+    gh = FakeGitHub()
+    url = f'{REPO}/contents/index.html'
+    gh.docs[url] = {'sha': 'old'}
+    gh.docs[f'{REPO}/pages'] = {'sha': 'pages'}
+    cache = ConditionalCache()
+    cache.request('GET', url, gh.send)
+    cache.request('GET', f'{REPO}/pages', gh.send)
+    cache.request('PUT', url, gh.send, json={})
+    assert cache.request('GET', url, gh.send).json()['sha'] == gh.docs[url]['sha']
+    assert 'If-None-Match' not in gh.calls[-1][2]
+
+    cache.request('POST', f'{REPO}/pages/builds', gh.send)
+    assert cache.request('GET', f'{REPO}/pages', gh.send).headers['X-Cache'] == 'HIT'
+    cache.request('POST', f'{REPO}/pages', gh.send, json={})
+    cache.request('GET', f'{REPO}/pages', gh.send)
+    assert 'If-None-Match' not in gh.calls[-1][2]
+    assert cache.stats()['hits'] == 1
+
+
+def test_memory_is_bounded():
+    gh = FakeGitHub()
+    cache = ConditionalCache(max_bytes=100)
+    for i in range(10):
+        gh.docs[f'{REPO}/contents/f{i}'] = {'sha': 'x' * 20}
+        cache.request('GET', f'{REPO}/contents/f{i}', gh.send)
+    assert cache.size <= 100
+    assert f'{REPO}/contents/f9' in [key[0] for key in cache._entries]
+
+
+def test_tokens_do_not_share_entries():
+    gh = FakeGitHub()
+    gh.docs[REPO] = {'sha': 'a'}
+    cache = ConditionalCache()
+    cache.request('GET', REPO, gh.send, headers={'Authorization': 'token one'})
+    cache.request('GET', REPO, gh.send, headers={'Authorization': 'token two'})
+    assert 'If-None-Match' not in gh.calls[-1][2]
+
+
+def test_pipeline_rounds_revalidate_with_304(tmp_path, monkeypatch):
+    gh = FakeGitHub()
+    gh.docs[f'{REPO}/pages'] = {'sha': 'pages'}
+    cache = ConditionalCache()
+    monkeypatch.setattr(pipeline, 'GITHUB_CACHE', cache)
+    monkeypatch.setattr(pipeline, 'http_request', gh.send)
+    ctx = pipeline.TaskContext({'task': 'r', 'round': 1, 'checks': []}, 'brief', str(tmp_path), model=None)
+    for round_num in (1, 2):
+        for filename in ('index.html', 'README.md'):
+            assert pipeline.push_file(ctx, 'o/r', filename, f'round {round_num}')
+        assert pipeline.enable_pages(ctx, 'o/r') == 'already-enabled'
+        assert pipeline.trigger_build(ctx, 'o/r') == 201
+
+    conditional = [url for method, url, headers in gh.calls if method == 'GET' and 'If-None-Match' in headers]
+    # Our own PUTs invalidate the files, so round 2 refetches them; the Pages
+    # check survives the build POST and is answered with a 304.
+    assert conditional == [f'{REPO}/pages']
+    assert cache.stats()['hits'] == 1
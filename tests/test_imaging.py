@@ -0,0 +1,60 @@
+import base64
+import sys
+from io import BytesIO
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+from PIL import Image
+from imaging import ImagePipeline, parse_data_uri
+
+
+def make_png(size=(800, 400), color=(200, 30, 30)):
+    buf = BytesIO()
+    Image.new('RGB', size, color).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def test_parse_data_uri():
+    data = make_png((4, 4))
+    uri = 'data:image/png;base64,' + base64.b64encode(data).decode()
+    assert parse_data_uri(uri) == ('image/png', data)
+    assert parse_data_uri('https://example.com/a.png') is None
+
+
+def test_ingest_is_content_addressed(tmp_path):
+    pipeline = ImagePipeline(tmp_path)
+    data = make_png()
+    assert pipeline.ingest(data) == pipeline.ingest(data)
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_variants_are_lazy_and_decoded_once(tmp_path, monkeypatch):
+    pipeline = ImagePipeline(tmp_path)
+    digest = pipeline.ingest(make_png())
+    assert not (tmp_path / digest / 'thumb.webp').exists()
+
+    opened = []
+    real_open = Image.open
+    monkeypatch.setattr(Image, 'open', lambda *a, **k: opened.append(a) or real_open(*a, **k))
+
+    thumb = pipeline.variant_path(digest, 'thumb')
+    gray = pipeline.variant_path(digest, 'gray')
+    assert len(opened) == 1
+    with real_open(thumb) as img:
+        assert img.format == 'WEBP' and max(img.size) == 320
+    with real_open(gray) as img:
+        assert img.mode == 'L' and img.size == (800, 400)
+    assert pipeline.variant_path(digest, 'thumb') == thumb
+
+
+def test_rejects_bad_digest(tmp_path):
+    pipeline = ImagePipeline(tmp_path)
+    try:
+        pipeline.variant_path('../etc', 'thumb')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('expected ValueError')
@@ -0,0 +1,108 @@
+import base64
+import io
+import json
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+from ingest import BodyTooLarge, IngestError, ingest_json, move_spool, summarize
+
+
+class ChunkedStream:
+    """Byte stream that yields small, awkwardly sized chunks like a socket would."""
+
+    def __init__(self, data, size=7):
+        self.buf = io.BytesIO(data)
+        self.size = size
+
+    def read(self, n=-1):
+        return self.buf.read(min(n, self.size) if n > 0 else self.size)
+
+
+def body(**overrides):
+    payload = {
+        'email': 'student@example.com',
+        'secret': 's3cr3t',
+        'task': 'captcha-solver',
+        'round': 2,
+        'brief': 'Solve é captchas \U0001F600 with "quotes"',
+        'checks': ['README.md is professional'],
+        'attachments': [],
+    }
+    payload.update(overrides)
+    return json.dumps(payload)
+
+
+def test_matches_json_loads_for_metadata(tmp_path):
+    text = body(extra={'n': -1.5e3, 'ok': True, 'none': None, 'list': [1, [2, {}]]})
+    data = ingest_json(ChunkedStream(text.encode()), str(tmp_path))
+    assert data == json.loads(text)
+
+
+def test_data_uri_spooled_to_disk(tmp_path):
+    raw = os.urandom(10_000)
+    uri = 'data:image/png;base64,' + base64.b64encode(raw).decode()
+    text = body(attachments=[{'name': '../sample.png', 'url': uri},
+                             {'name': 'remote.png', 'url': 'https://example.com/a.png'}])
+    # json.dumps escapes "/" only if asked; exercise the escape path too
+    text = text.replace('/', '\\/')
+    spool = tmp_path / 'spool'
+    data = ingest_json(ChunkedStream(text.encode(), size=1000), str(spool))
+    spooled, remote = data['attachments']
+    assert spooled['mime'] == 'image/png' and spooled['size'] == len(raw)
+    assert Path(spooled['path']).read_bytes() == raw
+    assert Path(spooled['path']).name == '0-sample.png'
+    assert 'url' not in spooled
+    assert remote['url'] == 'https://example.com/a.png'
+
+    dest = tmp_path / 'task' / 'attachments'
+    move_spool(data, str(spool), str(dest))
+    assert not spool.exists()
+    assert Path(data['attachments'][0]['path']).read_bytes() == raw
+    assert 'secret' not in summarize(data)
+
+
+def test_client_cannot_name_spool_files(tmp_path):
+    victim = tmp_path / 'victim.txt'
+    victim.write_text('keep me')
+    uri = 'data:image/png;base64,' + base64.b64encode(b'png').decode()
+    forged = {'__spooled__': str(victim), 'mime': 'text/plain', 'size': 7}
+    for attachments in ([{'name': 'a.png', 'url': uri}, {'name': 'b.txt', 'url': forged}],
+                        [{'name': 'b.txt', 'url': forged}]):
+        with pytest.raises(IngestError):
+            ingest_json(io.BytesIO(body(attachments=attachments).encode()), str(tmp_path / 'spool'))
+    assert victim.read_text() == 'keep me'
+
+
+def test_memory_stays_flat_for_large_attachment(tmp_path):
+    raw = os.urandom(8 * 1024 * 1024)
+    uri = 'data:application/octet-stream;base64,' + base64.b64encode(raw).decode()
+    encoded = body(attachments=[{'name': 'big.bin', 'url': uri}]).encode()
+    del uri
+    stream = io.BytesIO(encoded)
+    tracemalloc.start()
+    data = ingest_json(stream, str(tmp_path / 'spool'))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert data['attachments'][0]['size'] == len(raw)
+    assert peak < 2 * 1024 * 1024
+
+
+def test_body_size_limit(tmp_path):
+    with pytest.raises(BodyTooLarge):
+        ingest_json(io.BytesIO(body(brief='x' * 5000).encode()), str(tmp_path), max_bytes=1000)
+
+
+@pytest.mark.parametrize('text', ['{"a": 1', '[1, 2]', '{"a": tru}', '{"a": 1} x',
+                                  '{"attachments": 5}', '{"attachments": {"name": "a"}}',
+                                  '{"attachments": [{"url": "data:image/png;base64,@@@@"}]}'])
+def test_invalid_bodies(tmp_path, text):
+    with pytest.raises(IngestError):
+        ingest_json(io.BytesIO(text.encode()), str(tmp_path))
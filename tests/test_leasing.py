@@ -0,0 +1,131 @@
+import multiprocessing
+import sys
+import threading
+import time
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+from leasing import JobQueue, run_reaper
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_submit_claims_job_and_blocks_duplicates(tmp_path):
+    clock = FakeClock()
+    a = JobQueue(tmp_path, worker_id='a', lease_seconds=30, clock=clock)
+    b = JobQueue(tmp_path, worker_id='b', lease_seconds=30, clock=clock)
+
+    lease = a.submit('demo-1', {'data': {'task': 'demo'}, 'brief': 'x'})
+    assert lease is not None and lease.job['attempts'] == 1
+    assert b.submit('demo-1', {'data': {'task': 'demo'}, 'brief': 'x'}) is None
+    assert b.claim() is None
+
+    assert a.complete(lease, {'status': 'OK'})
+    assert a.pending() == []
+    assert b.result('demo-1')['status'] == 'OK'
+    assert b.result('demo-1')['worker'] == 'a'
+
+
+def test_expired_lease_is_reclaimed_and_old_owner_loses_it(tmp_path):
+    clock = FakeClock()
+    a = JobQueue(tmp_path, worker_id='a', lease_seconds=30, clock=clock)
+    b = JobQueue(tmp_path, worker_id='b', lease_seconds=30, clock=clock)
+    lease = a.submit('demo-1', {'data': {'task': 'demo'}, 'brief': 'x'})
+
+    clock.now += 20
+    assert a.heartbeat(lease)
+    clock.now += 20
+    assert b.claim() is None  # heartbeat kept it alive
+
+    clock.now += 31
+    reclaimed = b.claim()
+    assert reclaimed.job_id == 'demo-1' and reclaimed.job['attempts'] == 2
+    assert reclaimed.job['brief'] == 'x'
+    assert not a.heartbeat(lease)
+    lease.job['brief'] = 'stale'
+    assert not a.update(lease)
+    reclaimed.job['data']['attachments'] = [{'path': 'moved'}]
+    assert b.update(reclaimed)
+    clock.now += 31
+    again = a.claim()
+    assert again.job['brief'] == 'x' and again.job['data']['attachments'] == [{'path': 'moved'}]
+    assert not b.complete(reclaimed, {'status': 'OK'})
+    assert a.complete(again, {'status': 'OK'})
+
+
+def test_claim_gives_up_after_max_attempts(tmp_path):
+    clock = FakeClock()
+    queue = JobQueue(tmp_path, worker_id='a', lease_seconds=1, max_attempts=2, clock=clock)
+    queue.submit('flaky', {'data': {}, 'brief': ''})
+    clock.now += 2
+    assert queue.claim() is not None
+    clock.now += 2
+    assert queue.claim() is None
+    assert queue.result('flaky')['status'] == 'failed'
+
+
+def test_keepalive_renews_lease(tmp_path):
+    queue = JobQueue(tmp_path, worker_id='a', lease_seconds=0.3)
+    other = JobQueue(tmp_path, worker_id='b', lease_seconds=0.3)
+    lease = queue.submit('slow', {'data': {}, 'brief': ''})
+    with lease.keepalive(interval=0.05):
+        time.sleep(0.6)
+        assert other.claim() is None
+    assert not lease.lost
+
+
+def test_reaper_runs_abandoned_jobs(tmp_path):
+    dead = JobQueue(tmp_path, worker_id='dead', lease_seconds=0.05)
+    dead.submit('orphan', {'data': {'task': 'orphan'}, 'brief': 'b'})
+    time.sleep(0.1)
+
+    alive = JobQueue(tmp_path, worker_id='alive', lease_seconds=5)
+    stop = threading.Event()
+    seen = []
+
+    def handle(lease):
+        seen.append(lease.job_id)
+        stop.set()
+        return {'status': 'OK'}
+
+    run_reaper(alive, handle, interval=0.01, stop=stop)
+    assert seen == ['orphan']
+    assert alive.result('orphan')['worker'] == 'alive'
+
+
+def _claim_all(root, worker_id, out):
+    queue = JobQueue(root, worker_id=worker_id, lease_seconds=60)
+    claimed = []
+    while True:
+        lease = queue.claim()
+        if lease is None:
+            break
+        claimed.append(lease.job_id)
+    out.put(claimed)
+
+
+def test_claims_are_exclusive_across_processes(tmp_path):
+    seed = JobQueue(tmp_path, worker_id='seed', lease_seconds=0)
+    for i in range(40):
+        seed.submit(f'job-{i}', {'data': {}, 'brief': ''})
+    time.sleep(0.01)
+
+    ctx = multiprocessing.get_context('spawn')
+    out = ctx.Queue()
+    procs = [ctx.Process(target=_claim_all, args=(str(tmp_path), f'w{i}', out)) for i in range(3)]
+    for p in procs:
+        p.start()
+    results = [out.get(timeout=60) for _ in procs]
+    for p in procs:
+        p.join()
+    claimed = [job for r in results for job in r]
+    assert sorted(claimed) == sorted(f'job-{i}' for i in range(40))
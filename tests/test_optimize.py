@@ -0,0 +1,171 @@
+import base64
+import json
+import random
+import sys
+import threading
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+import pipeline
+from dag import run_dag
+from optimize import minify_css, minify_html, minify_js, optimize
+
+
+def png_data_uri(width, height):
+    buf = BytesIO()
+    # Noise so the PNG is comfortably above the inline limit.
+    Image.frombytes('RGB', (width, height), random.Random(0).randbytes(width * height * 3)).save(buf, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buf.getvalue()).decode()
+
+
+def test_minify_css_keeps_strings_and_drops_duplicate_blocks():
+    css = """/* theme */
+body {  color: red;  margin: 0 auto; }
+.a::before { content: "x  ;  }"; }
+body {  color: red;  margin: 0 auto; }
+@media (max-width: 600px) { .a { display: none; } }
+"""
+    out = minify_css(css)
+    assert out == '.a::before{content:"x  ;  }"}body{color:red;margin:0 auto}@media (max-width:600px){.a{display:none}}'
+
+
+def test_minify_js_preserves_semantics_sensitive_tokens():
+    js = """// header
+const re = /a\\/b[/]c/g;  // trailing
+let s = 'it\\'s // not a comment';
+let t = `x ${ ok ? `in ${b}` : '}' } y`;
+function f(a, b) {
+    /* block
+       comment */
+    return a ++ + b
+}
+let x = 1
+let y = x / 2 / 3
+"""
+    out = minify_js(js)
+    assert "const re=/a\\/b[/]c/g;" in out
+    assert "'it\\'s // not a comment'" in out
+    assert "`x ${ ok ? `in ${b}` : '}' } y`" in out
+    assert 'return a++ +b}' in out
+    # Newlines that may carry automatic semicolon insertion are kept.
+    assert 'let x=1\nlet y=x/2/3' in out
+    assert 'header' not in out and 'block' not in out
+
+
+def test_minify_html_leaves_pre_and_minifies_inline_code():
+    html = """<!DOCTYPE html>
+<html>
+  <head>
+    <!-- generated -->
+    <style> body { color: red; } </style>
+  </head>
+  <body>
+    <p>Hello   <b>world</b> !</p>
+    <pre>  keep
+   this </pre>
+    <script type="application/json">{ "a":  1 }</script>
+    <script>
+      // greet
+      console.log("a  b");
+    </script>
+  </body>
+</html>"""
+    out = minify_html(html)
+    assert out.startswith('<!DOCTYPE html><html><head><style>body{color:red}</style></head><body>')
+    assert '<p>Hello <b>world</b> !</p>' in out
+    assert '<pre>  keep\n   this </pre>' in out
+    assert '{ "a":  1 }' in out
+    assert '<script>console.log("a  b");</script>' in out
+    assert 'generated' not in out
+
+
+def test_script_bodies_are_not_rewritten_as_markup():
+    html = """<html><body><!-- drop me --><img src="https://x/a.png">
+<script>
+  const s = "<!-- x -->";
+  el.innerHTML = "<img src='b.png'>";
+</script></body></html>"""
+    out = optimize('index.html', html)['content']
+    assert 'const s="<!-- x -->";' in out
+    assert """el.innerHTML="<img src='b.png'>";""" in out
+    assert '<img src="https://x/a.png" decoding="async">' in out
+    assert 'drop me' not in out
+
+
+def test_optimize_externalizes_images_and_adds_hints():
+    uri = png_data_uri(40, 30)
+    html = f'<html><body><img src="{uri}" alt="a"><img src="{uri}"/><img src="https://x/y.png" width="5"></body></html>'
+    result = optimize('index.html', html)
+
+    assert len(result['assets']) == 1
+    asset = next(iter(result['assets']))
+    assert asset.startswith('assets/') and asset.endswith('.png')
+    out = result['content']
+    assert 'data:image' not in out
+    assert f'<img src="{asset}" alt="a" width="40" height="30" decoding="async">' in out
+    assert f'<img src="{asset}" width="40" height="30" decoding="async" loading="lazy"/>' in out
+    assert '<img src="https://x/y.png" width="5" decoding="async" loading="lazy">' in out
+    assert result['before'] > result['after']
+
+
+def test_optimize_css_asset_paths_are_relative_to_the_file():
+    uri = png_data_uri(20, 20)
+    result = optimize('css/site.css', f'.hero {{ background: url({uri}) no-repeat; }}')
+    asset = next(iter(result['assets']))
+    assert result['content'] == f'.hero{{background:url(../{asset}) no-repeat}}'
+
+
+def test_small_images_stay_inline():
+    tiny = 'data:image/gif;base64,R0lGODlhAQABAAAAACw='
+    result = optimize('index.html', f'<img src="{tiny}">')
+    assert result['assets'] == {}
+    assert tiny in result['content']
+
+
+class FakeResponse:
+    def __init__(self, status_code=201):
+        self.status_code = status_code
+        self.text = ''
+        self.content = b''
+        self.headers = {}
+
+    def json(self):
+        return {}
+
+
+def test_pipeline_pushes_assets_before_the_page(tmp_path, monkeypatch):
+    uri = png_data_uri(40, 30)
+    pushed = []
+    lock = threading.Lock()
+
+    def fake_http(method, url, timeout=None, **kwargs):
+        if method == 'PUT':
+            with lock:
+                pushed.append((url.split('/contents/', 1)[1], kwargs['json']['content']))
+        return FakeResponse(404 if method == 'GET' else 201)
+
+    class Model:
+        def generate_content(self, prompt, request_options=None):
+            class Result:
+                text = f'```html\n<html>\n  <body>\n    <img src="{uri}">\n  </body>\n</html>\n```'
+            return Result()
+
+    monkeypatch.setattr(pipeline, 'http_request', fake_http)
+    data = {'task': 'demo', 'round': 1, 'checks': ['index.html exists']}
+    ctx = pipeline.TaskContext(data, 'Build a demo', str(tmp_path), model=Model())
+    run = run_dag(pipeline.build_stages(ctx), max_workers=4)
+
+    names = [name for name, _ in pushed]
+    asset = ctx.optimization['index.html']['assets'][0]
+    assert names.index(asset) < names.index('index.html')
+    page = base64.b64decode(dict(pushed)['index.html']).decode()
+    assert page == f'<html><body><img src="{asset}" width="40" height="30" decoding="async"></body></html>'
+    assert (tmp_path / asset).read_bytes() == base64.b64decode(dict(pushed)[asset])
+    assert 'data:image' in ctx.generated['index.html']
+    assert json.dumps(run.results['opt:index.html'])  # checkpointable
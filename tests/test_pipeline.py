@@ -0,0 +1,83 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+import pipeline
+from dag import run_dag
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, payload=None, text='', headers=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+        self.text = text
+        self.content = text.encode()
+        self.headers = headers or {}
+
+    def json(self):
+        return self._payload
+
+
+class FakeModel:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def generate_content(self, prompt, request_options=None):
+        time.sleep(self.delay)
+
+        class Result:
+            text = '```html\n<h1>hi</h1>\n```'
+        return Result()
+
+
+def test_repo_setup_overlaps_generation(tmp_path, monkeypatch):
+    calls = []
+    lock = threading.Lock()
+
+    def fake_http(method, url, timeout=None, **kwargs):
+        with lock:
+            calls.append((method, url.rsplit('/', 2)[-1]))
+        if url.endswith('/user/repos'):
+            time.sleep(0.2)
+            return FakeResponse(201)
+        if method == 'GET':
+            return FakeResponse(404)
+        return FakeResponse(201)
+
+    monkeypatch.setattr(pipeline, 'http_request', fake_http)
+    data = {'task': 'demo', 'round': 1, 'checks': ['index.html exists', 'README.md is professional']}
+    ctx = pipeline.TaskContext(data, 'Build a demo', str(tmp_path), model=FakeModel(0.2))
+    run = run_dag(pipeline.build_stages(ctx), max_workers=4)
+
+    assert ctx.created_files == {'index.html', 'README.md'}
+    assert (tmp_path / 'index.html').read_text() == '<h1>hi</h1>'
+    # repo (0.2s) and three Gemini calls (0.2s each) all overlap
+    assert run.elapsed < 0.5
+    assert run.critical_path[-1] == 'build'
+    assert ('POST', 'pages') in calls
+
+
+def test_filename_for_check():
+    assert pipeline.filename_for_check('Repo has MIT license') == 'LICENSE'
+    assert pipeline.filename_for_check('Page loads without errors') is None
+    assert pipeline.filename_for_check('Has a notes.txt file') == 'notes.txt'
+
+
+def test_similar_app_skips_gemini(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, 'http_request', lambda method, url, timeout=None, **kw: FakeResponse(201))
+
+    class NoModel:
+        def generate_content(self, *args, **kwargs):
+            raise AssertionError('Gemini should not be called for reused files')
+
+    data = {'task': 'demo-2', 'round': 1, 'checks': ['README.md is professional']}
+    ctx = pipeline.TaskContext(data, 'Build a demo', str(tmp_path), model=NoModel())
+    ctx.reused = {'README.md': '# Demo 2', 'index.html': '<h1>demo-2</h1>'}
+    run = run_dag(pipeline.build_stages(ctx))
+    assert 'brief' not in run.results
+    assert ctx.created_files == {'README.md', 'index.html'}
@@ -0,0 +1,60 @@
+import pstats
+import sys
+import threading
+import time
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+import profiling
+from profiling import JobProfiler, choose_mode, list_profiles, profiled
+
+
+def busy_stage():
+    end = time.monotonic() + 0.1
+    while time.monotonic() < end:
+        sum(range(1000))
+
+
+def run_in_thread(fn):
+    t = threading.Thread(target=fn)
+    t.start()
+    t.join()
+
+
+def test_cprofile_covers_stage_threads(tmp_path):
+    profiler = JobProfiler('captcha.solver', tmp_path, 'cprofile').start()
+    run_in_thread(profiled(busy_stage))
+    path = profiler.stop()
+    assert path.name.startswith('captcha.solver-') and path.suffix == '.prof'
+    stats = pstats.Stats(str(path))
+    assert any(func[2] == 'busy_stage' for func in stats.stats)
+
+
+def test_sampler_writes_collapsed_stacks(tmp_path):
+    profiler = JobProfiler('task-1', tmp_path, 'sample', interval=0.002).start()
+    run_in_thread(profiled(busy_stage))
+    path = profiler.stop()
+    lines = path.read_text().splitlines()
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert any('busy_stage (test_profiling.py' in line for line in lines)
+    entries = list_profiles(tmp_path)
+    assert entries[0]['task'] == 'task-1' and entries[0]['mode'] == 'sample'
+
+
+def test_profiled_is_noop_without_active_job():
+    assert profiled(busy_stage) is busy_stage
+
+
+def test_choose_mode(monkeypatch):
+    monkeypatch.setattr(profiling, 'ADMIN_TOKEN', 'admin')
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATE', 0.0)
+    assert choose_mode({'X-Profile': 'sample', 'X-Admin-Token': 'admin'}) == 'sample'
+    assert choose_mode({'X-Profile': 'yes', 'X-Admin-Token': 'admin'}) == 'cprofile'
+    assert choose_mode({'X-Profile': 'sample', 'X-Admin-Token': 'wrong'}) is None
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATE', 1.0)
+    assert choose_mode({}) == profiling.PROFILE_SAMPLE_MODE
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_MODE', 'flamegraph')
+    assert choose_mode({}) == 'sample'
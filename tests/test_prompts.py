@@ -0,0 +1,158 @@
+import base64
+import sys
+import threading
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+import pipeline
+from dag import run_dag
+from quota import QuotaGovernor
+from prompts import (HOSTED_IMAGES_HEADER, README_PROMPT, TokenLedger, attachment_descriptors, build_prompt,
+                     compact_brief, describe_attachment, estimate_tokens, file_prompt, strip_inline_data, truncate)
+
+DATA_URI = 'data:image/png;base64,' + base64.b64encode(b'\x89PNG' + b'\x00' * 3000).decode()
+
+
+def test_estimate_tokens_tracks_words_and_symbols():
+    assert estimate_tokens('') == 1
+    assert estimate_tokens('Build a page') == 3
+    assert estimate_tokens('internationalization') == 4
+    assert estimate_tokens('<div class="x">') == 8
+    text = 'Create a captcha solver that handles ?url=https://example.com/a.png. ' * 50
+    assert 0.5 < estimate_tokens(text) / (len(text) / 4) < 1.5
+
+
+def test_truncate_prefers_sentence_boundary():
+    text = 'First sentence here. Second one is here. Third goes on and on and on.'
+    out = truncate(text, 15)
+    assert out == 'First sentence here. Second one is here. [...]'
+    assert estimate_tokens(out) <= 15
+    assert truncate(text, 1000) == text
+
+
+def test_inline_data_becomes_descriptor():
+    brief = f'Show this logo {DATA_URI} in the header.'
+    assert strip_inline_data(brief) == 'Show this logo [inline image/png, 2.9 KB] in the header.'
+    assert describe_attachment({'name': 'logo.png', 'url': DATA_URI}) == 'logo.png (image/png, 2.9 KB)'
+    assert describe_attachment({'name': 'data.csv', 'mime': 'text/csv', 'size': 120, 'path': '/srv/x'}) \
+        == 'data.csv (text/csv, 120 B)'
+    snippet = attachment_descriptors([{'name': 'logo.png', 'url': DATA_URI},
+                                      {'name': 'data.csv', 'mime': 'text/csv', 'size': 120}], skip=['logo.png'])
+    assert snippet.endswith('\n- data.csv (text/csv, 120 B)')
+    assert 'logo.png' not in snippet
+
+
+def test_compact_brief_dedupes_and_bounds_summary():
+    brief = ('Build a todo app.\n\nBuild a todo app.  Items persist in localStorage. '
+             + 'Use a clean layout. ' * 200 + f'Logo: {DATA_URI}')
+    summary = compact_brief(brief, max_tokens=40)
+    assert summary.startswith('Build a todo app. Items persist in localStorage. Use a clean layout.')
+    assert summary.count('Build a todo app') == 1
+    assert 'base64' not in summary
+    assert estimate_tokens(summary) <= 40
+
+
+def test_compact_brief_keeps_urls_filenames_and_attachment_lines():
+    hosted = (f'\n{HOSTED_IMAGES_HEADER}\n- logo.png (40x30): display https://host/assets/ab/webp, '
+              'preview https://host/assets/ab/thumb, grayscale for OCR https://host/assets/ab/gray')
+    files = attachment_descriptors([{'name': 'data.csv', 'mime': 'text/csv', 'size': 120}])
+    brief = ('Solve ?url=https://example.com/image.png and load script.js. Is it v1.2? Yes! '
+             + 'Keep the layout tidy. ' * 100 + hosted + files)
+    summary = compact_brief(brief, max_tokens=40)
+    assert summary.startswith('Solve ?url=https://example.com/image.png and load script.js. Is it v1.2? Yes!')
+    assert summary.count('Keep the layout tidy.') == 1
+    assert summary.endswith(hosted.strip() + files)
+
+    prompt = file_prompt('index.html', 'Render the table. ' * 2000 + hosted, 'index.html exists', budget=300)
+    assert hosted.strip() in prompt and prompt.endswith('Check requirement: index.html exists')
+
+
+def test_prompts_stay_within_budget_and_keep_the_check():
+    brief = 'Render the table. ' * 2000
+    prompt = file_prompt('script.js', brief, 'script.js sorts rows by column', budget=300)
+    assert estimate_tokens(prompt) <= 300
+    assert prompt.endswith('Check requirement: script.js sorts rows by column')
+    readme = file_prompt('README.md', brief, 'README.md is professional', budget=300)
+    assert readme.endswith(README_PROMPT.rsplit('\n', 1)[1])
+    assert build_prompt('{brief}', 1000, brief='short') == 'short'
+
+
+class Usage:
+    prompt_token_count = 120
+    candidates_token_count = 480
+
+
+class Reported:
+    text = 'ignored'
+    usage_metadata = Usage()
+
+
+class Unreported:
+    text = 'word ' * 10
+
+
+def test_ledger_prefers_reported_counts():
+    ledger = TokenLedger()
+    ledger.record('gen:index.html', 'prompt text', Reported())
+    ledger.record('gen:index.html', 'a b c', Unreported())
+    metrics = ledger.metrics()
+    assert metrics['stages']['gen:index.html'] == {'calls': 2, 'prompt_tokens': 123, 'response_tokens': 490}
+    assert metrics['prompt_tokens'] == 123 and metrics['response_tokens'] == 490
+
+
+class FakeResponse:
+    status_code = 201
+    text = ''
+    content = b''
+    headers = {}
+
+    def json(self):
+        return {}
+
+
+def test_pipeline_uses_summary_and_records_tokens(tmp_path, monkeypatch):
+    prompts = []
+    lock = threading.Lock()
+
+    class Model:
+        def generate_content(self, prompt, request_options=None):
+            with lock:
+                prompts.append(prompt)
+            return Reported()
+
+    monkeypatch.setattr(pipeline, 'http_request', lambda method, url, timeout=None, **kw: FakeResponse())
+    # Earlier tests drain the shared 10 RPM governor.
+    monkeypatch.setattr(pipeline, 'GEMINI_QUOTA', QuotaGovernor(rpm=1000, tpm=10 ** 7))
+    brief = 'Build a dashboard. ' + 'Charts update live. ' * 3 + f'Logo {DATA_URI}'
+    data = {'task': 'demo', 'round': 1, 'checks': ['README.md is professional', 'style.css exists']}
+    ctx = pipeline.TaskContext(data, brief, str(tmp_path), model=Model())
+    run_dag(pipeline.build_stages(ctx), max_workers=4)
+
+    assert len(prompts) == 3
+    assert all('base64' not in p for p in prompts)
+    assert sum('Charts update live.' in p for p in prompts) == 3
+    assert all(p.count('Charts update live.') == 1 for p in prompts if 'Check requirement' in p)
+    stages = ctx.tokens.metrics()['stages']
+    assert set(stages) == {'brief', 'gen:README.md', 'gen:style.css'}
+    assert stages['brief'] == {'calls': 1, 'prompt_tokens': 120, 'response_tokens': 480}
+
+
+def test_brief_prompt_keeps_attachment_lines(monkeypatch):
+    prompts = []
+
+    class Model:
+        def generate_content(self, prompt, request_options=None):
+            prompts.append(prompt)
+            return Reported()
+
+    monkeypatch.setattr(pipeline, 'GEMINI_QUOTA', QuotaGovernor(rpm=1000, tpm=10 ** 7))
+    monkeypatch.setattr(pipeline, 'PROMPT_TOKEN_BUDGET', 200)
+    files = attachment_descriptors([{'name': 'data.csv', 'mime': 'text/csv', 'size': 120}])
+    ctx = pipeline.TaskContext({'task': 'demo', 'round': 1, 'checks': []},
+                               'Render the table. ' * 500 + f'Logo {DATA_URI}' + files, '.', model=Model())
+    pipeline.generate_brief(ctx)
+    assert prompts[0].endswith(files.strip())
+    assert estimate_tokens(prompts[0]) <= 200
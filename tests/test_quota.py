@@ -0,0 +1,121 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+from quota import QuotaGovernor, QuotaExceeded, is_throttled, job_priority
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Throttled(Exception):
+    def __str__(self):
+        return '429 RESOURCE_EXHAUSTED: quota exceeded'
+
+
+def test_bucket_limits_requests_per_minute():
+    clock = FakeClock()
+    gov = QuotaGovernor(rpm=2, tpm=1000, clock=clock)
+    gov.acquire(10, timeout=0)
+    gov.acquire(10, timeout=0)
+    try:
+        gov.acquire(10, timeout=0)
+    except QuotaExceeded:
+        pass
+    else:
+        raise AssertionError('third request should not fit in a 2 rpm bucket')
+    clock.now += 30  # one request refilled at 2 rpm
+    gov.acquire(10, timeout=0)
+
+
+def test_token_bucket_limits_large_prompts():
+    clock = FakeClock()
+    gov = QuotaGovernor(rpm=100, tpm=100, clock=clock)
+    gov.acquire(80, timeout=0)
+    try:
+        gov.acquire(80, timeout=0)
+    except QuotaExceeded:
+        pass
+    else:
+        raise AssertionError('tokens per minute should be enforced')
+
+
+def test_throttling_halves_rate_and_success_recovers():
+    gov = QuotaGovernor(rpm=600, tpm=10 ** 6, recovery_step=0.25)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise Throttled()
+        return 'ok'
+
+    gov.report_throttled(retry_after=0)
+    assert gov.rate == 0.5
+    assert gov.call(flaky, prompt='hi', retries=2) == 'ok'
+    assert len(calls) == 2
+    assert gov.rate == 0.5  # halved again to 0.25, then recovered by one step
+
+
+def test_concurrent_throttles_back_off_once():
+    clock = FakeClock()
+    gov = QuotaGovernor(rpm=600, tpm=10 ** 6, clock=clock)
+    granted = [gov.acquire(1) for _ in range(4)]
+    clock.now += 1
+    for acquired_at in granted:  # one burst: four in-flight calls all see 429
+        gov.report_throttled(retry_after=0, acquired_at=acquired_at)
+    assert gov.rate == 0.5
+    clock.now += 1
+    gov.report_throttled(retry_after=0, acquired_at=gov.acquire(1))
+    assert gov.rate == 0.25
+
+
+def test_higher_priority_waiter_goes_first():
+    gov = QuotaGovernor(rpm=60, tpm=10 ** 6)
+    gov._state['requests'] = 0.0
+    order = []
+
+    def worker(name, priority):
+        gov.acquire(1, priority=priority)
+        order.append(name)
+
+    low = threading.Thread(target=worker, args=('round1', job_priority(1)))
+    low.start()
+    time.sleep(0.05)
+    high = threading.Thread(target=worker, args=('round2', job_priority(2, 3, 4)))
+    high.start()
+    low.join(5)
+    high.join(5)
+    assert order == ['round2', 'round1']
+
+
+def test_shared_state_file(tmp_path):
+    state = str(tmp_path / 'quota.json')
+    a = QuotaGovernor(rpm=1, tpm=1000, state_file=state)
+    b = QuotaGovernor(rpm=1, tpm=1000, state_file=state)
+    a.acquire(1, timeout=0)
+    try:
+        b.acquire(1, timeout=0)
+    except QuotaExceeded:
+        pass
+    else:
+        raise AssertionError('second governor should see the shared bucket')
+
+
+def test_is_throttled():
+    class Resp:
+        status_code = 429
+
+    assert is_throttled(Resp())
+    assert is_throttled(Throttled())
+    assert not is_throttled(ValueError('bad input'))
@@ -0,0 +1,157 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+from dag import Stage, StageFailed, run_dag
+from pipeline import tracked
+from registry import JobRecord, JobRegistry, benchmark
+
+
+def test_records_use_slots():
+    record = JobRecord('demo', 'n', 1, 0.0)
+    assert not hasattr(record, '__dict__')
+
+
+def test_stage_counters_follow_transitions():
+    registry = JobRegistry()
+    a = registry.start('a', 'n1')
+    b = registry.start('b', 'n2', 2)
+    assert registry.stage_counts() == {'queued': 2}
+
+    registry.advance(a, 'gen:index.html')
+    registry.advance(a, 'gen:style.css')
+    registry.advance(b, 'push:index.html')
+    assert registry.stage_counts() == {'gen': 1, 'push': 1}
+    assert registry.get('a').stage == 'gen'
+    assert registry.get('b', 'n2').round == 2
+
+    registry.finish(a, 'OK')
+    registry.finish(a, 'failed')  # ignored: already finished
+    registry.advance(a, 'build')  # ignored: not running
+    assert registry.stage_counts() == {'push': 1}
+    stats = registry.stats()
+    assert stats['running'] == 1 and stats['outcomes'] == {'OK': 1}
+    assert registry.get('a').status == 'OK'
+
+
+def test_concurrent_stages_are_counted_per_job():
+    registry = JobRegistry()
+    a = registry.start('a', 'n1')
+    for stage in ('gen:index.html', 'gen:style.css', 'push:README.md'):
+        registry.advance(a, stage)
+    assert registry.stage_counts() == {'gen': 1, 'push': 1}
+    assert registry.get('a').running == {'gen': 2, 'push': 1}
+
+    registry.stage_done(a, 'gen:index.html')
+    registry.stage_done(a, 'push:README.md')
+    registry.stage_done(a, 'build')  # ignored: never started
+    assert registry.stage_counts() == {'gen': 1}
+    assert registry.lookup('a')['running'] == {'gen': 1}
+    registry.finish(a, 'failed', 'gen:style.css: boom')
+    assert registry.stage_counts() == {}
+
+
+def test_restarting_a_job_supersedes_the_old_record():
+    registry = JobRegistry()
+    old = registry.start('a', 'n1')
+    registry.advance(old, 'brief')
+    new = registry.start('a', 'n1')
+    registry.finish(old, 'failed')
+    assert registry.stage_counts() == {'queued': 1}
+    assert registry.get('a', 'n1') is new
+
+
+def test_history_is_bounded_and_spills_to_disk(tmp_path):
+    registry = JobRegistry(tmp_path, history=3)
+    for i in range(5):
+        registry.finish(registry.start(f'task-{i}', f'n{i}'), 'OK' if i % 2 == 0 else 'failed', None)
+    stats = registry.stats()
+    assert stats['history'] == 3 and stats['spilled'] == 2
+    assert registry.get('task-0') is None
+    assert registry.get('task-4').status == 'OK'
+
+    assert [e['task'] for e in registry.spilled()] == ['task-0', 'task-1']
+    assert registry.lookup('task-1')['status'] == 'failed'
+    assert registry.lookup('task-3')['nonce'] == 'n3'
+    assert registry.lookup('missing') is None
+    registry.close()
+    lines = (tmp_path / 'history.jsonl').read_text().splitlines()
+    assert json.loads(lines[0])['task'] == 'task-0'
+    # A new process indexes the spill files it finds.
+    assert JobRegistry(tmp_path, history=3).lookup('task-1')['status'] == 'failed'
+
+
+def test_spill_file_rotates_and_lookups_use_the_index(tmp_path):
+    registry = JobRegistry(tmp_path, history=1, spill_bytes=600)
+    for i in range(20):
+        registry.finish(registry.start(f'task-{i}', f'n{i}'), 'OK')
+    assert (tmp_path / 'history.jsonl.1').exists()
+    assert (tmp_path / 'history.jsonl').stat().st_size <= 600 + 300
+    on_disk = [e['task'] for e in registry.spilled()]
+    assert on_disk == [f'task-{i}' for i in range(19 - len(on_disk), 19)]
+    assert registry.lookup('task-0') is None  # rotated away
+    assert registry.lookup(on_disk[0])['nonce'] == 'n' + on_disk[0].split('-')[1]
+    assert registry.lookup('task-18')['status'] == 'OK'
+    assert registry.lookup('task-19')['status'] == 'OK'  # still in memory
+
+
+def test_replicas_share_the_spill_files(tmp_path):
+    a, b = JobRegistry(tmp_path, history=1), JobRegistry(tmp_path, history=1)
+    for i in range(3):
+        a.finish(a.start(f'a{i}', 'n'), 'OK')
+        b.finish(b.start(f'b{i}', 'n'), 'failed')
+    assert [e['task'] for e in a.spilled()] == ['a0', 'b0', 'a1', 'b1']
+    assert a.lookup('a1')['status'] == 'OK' and b.lookup('b1')['status'] == 'failed'
+
+
+def test_lookup_checks_the_task_when_another_replica_rotated(tmp_path):
+    a = JobRegistry(tmp_path, history=1, spill_bytes=300)
+    b = JobRegistry(tmp_path, history=1, spill_bytes=300)
+    for i in range(3):
+        a.finish(a.start(f'a{i}', 'n'), 'OK')
+    assert a.lookup('a1')['task'] == 'a1'
+    # b rotates the shared file: a's offset for a1 now holds b1's line in history.jsonl.
+    for i in range(3):
+        b.finish(b.start(f'b{i}', 'n'), 'failed')
+    assert (tmp_path / 'history.jsonl.1').exists()
+    on_disk = [e['task'] for e in a.spilled()]
+    assert 'a1' in on_disk and 'b0' in on_disk
+    for task in on_disk:  # b's jobs too, picked up from the shared files
+        assert a.lookup(task)['task'] == task
+    assert a.lookup('missing') is None
+
+
+def test_tracked_stages_report_progress():
+    registry = JobRegistry()
+    record = registry.start('demo', 'n')
+    seen = []
+
+    def progress(name):
+        registry.advance(record, name)
+        seen.append(dict(registry.get('demo').running))
+
+    def fail(results):
+        raise RuntimeError('boom')
+
+    stages = [Stage('repo', lambda r: 'repo'), Stage('gen:index.html', lambda r: 'x', deps=['repo']),
+              Stage('build', lambda r: 1, deps=['gen:index.html'])]
+    run_dag([tracked(s, progress, lambda name: registry.stage_done(record, name)) for s in stages],
+            max_workers=2)
+    assert seen == [{'repo': 1}, {'gen': 1}, {'build': 1}]
+    assert record.running == {} and registry.stage_counts() == {}
+
+    with pytest.raises(StageFailed):
+        run_dag([tracked(Stage('push:x', fail), progress, lambda name: registry.stage_done(record, name))])
+    assert record.running == {}
+
+
+def test_benchmark_smoke():
+    result = benchmark(jobs=2000, lookups=2000)
+    assert result['spilled'] == 1000 and result['history_in_memory'] == 1000
+    assert result['bytes_per_job'] < 2000
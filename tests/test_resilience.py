@@ -0,0 +1,131 @@
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import requests
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+from resilience import (CircuitBreaker, CircuitOpen, DeadlineExceeded, LatencyTracker,
+                        TaskBudget, hedge, http_request)
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """Fake upstream: /slow/<seconds> sleeps, /fail returns 502, anything else is fast."""
+
+    def do_GET(self):
+        if self.path.startswith('/slow/'):
+            time.sleep(float(self.path.rsplit('/', 1)[1]))
+        status = 502 if self.path == '/fail' else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clients that time out close the socket mid-response
+
+
+@pytest.fixture
+def server():
+    httpd = QuietServer(('127.0.0.1', 0), SlowHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_stage_deadline_bounded_by_task_budget():
+    clock = FakeClock()
+    budget = TaskBudget(total=100, shares={'a': 0.5, 'b': 0.5}, clock=clock)
+    stage = budget.stage('a')
+    assert stage.timeout(cap=None) == 50
+    assert stage.timeout(cap=10) == 10
+    clock.now = 90
+    assert budget.stage('b').timeout(cap=None) == 10  # only 10s left overall
+    with pytest.raises(DeadlineExceeded):
+        stage.timeout()
+
+
+def test_slow_server_hits_stage_timeout(server):
+    budget = TaskBudget(total=0.3, shares={'files': 1.0})
+    breaker = CircuitBreaker('fake', failure_threshold=10)
+    start = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        http_request('GET', f'{server}/slow/2', breaker=breaker, timeout=budget.stage('files').timeout())
+    assert time.monotonic() - start < 1.5
+
+
+def test_breaker_opens_and_half_opens(server):
+    clock = FakeClock()
+    breaker = CircuitBreaker('fake', failure_threshold=2, reset_timeout=5, clock=clock)
+    for _ in range(2):
+        assert http_request('GET', f'{server}/fail', breaker=breaker).status_code == 502
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpen):
+        http_request('GET', f'{server}/ok', breaker=breaker)
+    clock.now += 5
+    assert breaker.state == 'half-open'
+    assert http_request('GET', f'{server}/ok', breaker=breaker).status_code == 200
+    assert breaker.state == 'closed'
+
+
+def test_gemini_throttling_does_not_open_breaker(monkeypatch):
+    import pipeline
+    from quota import QuotaGovernor
+
+    class Throttled(Exception):
+        def __str__(self):
+            return '429 RESOURCE_EXHAUSTED'
+
+    class ThrottledModel:
+        def generate_content(self, prompt, request_options=None):
+            raise Throttled()
+
+    breaker = CircuitBreaker('gemini', failure_threshold=2)
+    governor = QuotaGovernor(rpm=60000, tpm=10 ** 9, min_rate=0.5)
+    monkeypatch.setattr(pipeline, 'GEMINI_BREAKER', breaker)
+    monkeypatch.setattr(pipeline, 'GEMINI_QUOTA', governor)
+    stage = TaskBudget(total=30).stage('files')
+    for _ in range(2):
+        with pytest.raises(Throttled):
+            pipeline.generate_content(ThrottledModel(), 'hi', stage)
+    assert breaker.state == 'closed'
+
+
+def test_hedge_races_second_attempt(server):
+    tracker = LatencyTracker(min_samples=1)
+    delays = iter(['2', '0'])
+    start = time.monotonic()
+    resp = hedge(lambda: requests.get(f'{server}/slow/{next(delays)}', timeout=5), tracker, delay=0.1)
+    assert resp.status_code == 200
+    assert time.monotonic() - start < 1.5
+
+
+def test_hedge_delay_comes_from_p95():
+    tracker = LatencyTracker(min_samples=5)
+    assert tracker.percentile(0.95) is None
+    for ms in range(1, 101):
+        tracker.record(ms / 1000)
+    assert tracker.percentile(0.95) == pytest.approx(0.096)
+    assert hedge(lambda: 'fast', tracker) == 'fast'
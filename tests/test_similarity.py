@@ -0,0 +1,67 @@
+import sys
+from pathlib import Path
+
+repo_root = Path(__file__).resolve().parents[1]
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+from similarity import SimilarityIndex, adapt, asset_digests, benchmark, find_reusable, normalize
+
+CAPTCHA = 'Create a captcha solver that handles ?url=https://example.com/a.png. Default to attached sample.'
+CHECKS = ['Repo has MIT license', 'README.md is professional']
+
+
+def test_normalize_masks_urls_numbers_and_check_order():
+    a = normalize('Solve 15 captchas at ?url=https://a.com/x.png', ['b', 'a'])
+    b = normalize('Solve 3 captchas at ?url=/files/y.png', ['a', 'b'])
+    assert a == b
+
+
+def test_lookup_finds_near_duplicate_and_persists(tmp_path):
+    index = SimilarityIndex(tmp_path)
+    index.add('captcha-solver-1', CAPTCHA, CHECKS, {'index.html': '<h1>Captcha Solver 1</h1>'})
+    index.add('todo-app', 'Build a todo list stored in localStorage.', CHECKS, {'index.html': '<ul></ul>'})
+
+    reloaded = SimilarityIndex(tmp_path)
+    assert len(reloaded) == 2
+    entry, score = reloaded.lookup(CAPTCHA.replace('a.png', 'b.png'), list(reversed(CHECKS)))
+    assert entry['task'] == 'captcha-solver-1' and score > 0.99
+    entry, score = reloaded.lookup('Render a CSV of sales as a sortable table.', CHECKS)
+    assert score < 0.9
+
+
+def test_find_reusable_adapts_task_name(tmp_path):
+    index = SimilarityIndex(tmp_path)
+    assert find_reusable(index, 'captcha-solver-2', CAPTCHA, CHECKS) == {}
+    index.add('captcha-solver-1', CAPTCHA, CHECKS, {'README.md': '# Captcha Solver 1\nrepo captcha-solver-1'})
+    files = find_reusable(index, 'captcha-solver-2', CAPTCHA, CHECKS)
+    assert files == {'README.md': '# Captcha Solver 2\nrepo captcha-solver-2'}
+    assert find_reusable(index, 'other', 'Completely different brief about weather charts', [],
+                         threshold=0.9) == {}
+    assert adapt('x', 'same', 'same') == 'x'
+
+
+def test_find_reusable_requires_same_attachments(tmp_path):
+    old, new = 'a' * 64, 'b' * 64
+    index = SimilarityIndex(tmp_path)
+    index.add('captcha-solver-1', CAPTCHA, CHECKS, {'index.html': f'<img src="/assets/{old}/web">'},
+              assets=asset_digests(f'Logo hosted at https://host/assets/{old}/web'))
+    assert find_reusable(index, 'captcha-solver-2', CAPTCHA, CHECKS, assets=[new]) == {}
+    assert find_reusable(index, 'captcha-solver-2', CAPTCHA, CHECKS) == {}
+    assert 'index.html' in find_reusable(index, 'captcha-solver-2', CAPTCHA, CHECKS, assets=[old])
+
+
+def test_replicas_keep_each_others_entries(tmp_path):
+    one, two = SimilarityIndex(tmp_path), SimilarityIndex(tmp_path)
+    assert len(one) == len(two) == 0
+    one.add('t1', CAPTCHA, CHECKS, {'index.html': '<h1>one</h1>'})
+    two.add('t2', 'Build a todo list stored in localStorage.', CHECKS, {'index.html': '<ul></ul>'})
+    assert len(SimilarityIndex(tmp_path)) == 2
+    entry, score = one.lookup('Build a todo list stored in localStorage.', CHECKS)
+    assert entry['task'] == 't2' and score > 0.99
+
+
+def test_benchmark_runs_offline():
+    result = benchmark(str(repo_root / 'testdir'), repeat=2)
+    assert result['indexed'] >= 2
+    assert result['hit_rate'] > 0.5 and result['false_hit_rate'] == 0.0